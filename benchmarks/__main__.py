@@ -0,0 +1,91 @@
+# -*- Mode:Python; indent-tabs-mode:nil; tab-width:4 -*-
+#
+# Copyright (C) 2017 Canonical Ltd
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Snapcraft benchmarks.
+
+Usage:
+  benchmarks [--files N] [--repeat N] [--filter REGEXP] [--workdir DIR]
+             [--output FILE] [--compare FILE] [--threshold PERCENT]
+
+Options:
+  --files N            number of files in the generated trees
+                       [default: 10000].
+  --repeat N           number of times each benchmark is run, the fastest
+                       run is the one reported [default: 3].
+  --filter REGEXP      a regular expression to filter the benchmarks to run.
+  --workdir DIR        where to generate trees, they are kept to be reused
+                       by later runs with the same number of files. A
+                       temporary directory is used by default.
+  --output FILE        write the results as JSON into FILE.
+  --compare FILE       compare the results to those of a previous run
+                       written with --output, exits with an error if any
+                       benchmark regressed.
+  --threshold PERCENT  how much slower than in the compared run a benchmark
+                       needs to be to be considered a regression
+                       [default: 10].
+
+"""
+
+import json
+import logging
+import os
+import sys
+import tempfile
+
+import docopt
+
+import snapcraft.internal.dirs
+
+import benchmarks
+
+
+def main():
+    logging.basicConfig(level=logging.WARNING)
+
+    arguments = docopt.docopt(__doc__)
+    files = int(arguments['--files'])
+    repeat = int(arguments['--repeat'])
+
+    snapcraft.internal.dirs.setup_dirs()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        workdir = arguments['--workdir'] or temp_dir
+        workdir = os.path.join(os.path.abspath(workdir), str(files))
+        os.makedirs(workdir, exist_ok=True)
+        results = benchmarks.run(
+            workdir=workdir, files=files, repeat=repeat,
+            name_filter=arguments['--filter'])
+
+    if arguments['--output']:
+        with open(arguments['--output'], 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if arguments['--compare']:
+        with open(arguments['--compare']) as f:
+            previous = json.load(f)
+        lines, regressions = benchmarks.compare(
+            previous, results,
+            threshold=float(arguments['--threshold']) / 100)
+        print()
+        for line in lines:
+            print(line)
+        if regressions:
+            sys.exit('Regressions found in: {}'.format(
+                ', '.join(regressions)))
+
+
+if __name__ == '__main__':
+    main()
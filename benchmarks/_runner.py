@@ -0,0 +1,154 @@
+# -*- Mode:Python; indent-tabs-mode:nil; tab-width:4 -*-
+#
+# Copyright (C) 2017 Canonical Ltd
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import collections
+import gc
+import os
+import platform
+import re
+import shutil
+import statistics
+import time
+
+import snapcraft
+
+from benchmarks import _trees
+
+_benchmarks = collections.OrderedDict()
+
+# What a benchmark returns: run is timed, setup is run untimed before each
+# run of it.
+Case = collections.namedtuple('Case', ['run', 'setup'])
+Case.__new__.__defaults__ = (None,)
+
+
+def benchmark(name):
+    """Register a benchmark.
+
+    The decorated function receives a Context and returns a Case.
+    """
+    def _register(function):
+        _benchmarks[name] = function
+        return function
+    return _register
+
+
+class Context:
+    """What benchmarks get to prepare their case."""
+
+    def __init__(self, workdir, files):
+        self.workdir = workdir
+        self.files = files
+        self._tree = None
+
+    @property
+    def tree(self):
+        """A synthetic tree with the requested number of files.
+
+        It is shared by all the benchmarks, which must not change it.
+        """
+        if not self._tree:
+            tree = os.path.join(self.workdir, 'tree')
+            complete = os.path.join(self.workdir, 'tree.complete')
+            if not os.path.exists(complete):
+                if os.path.exists(tree):
+                    shutil.rmtree(tree)
+                _trees.make_tree(tree, self.files)
+                open(complete, 'w').close()
+            self._tree = tree
+        return self._tree
+
+    def path(self, *components):
+        """Return a path in the work directory, creating its parent."""
+        path = os.path.join(self.workdir, *components)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return path
+
+
+def run(*, workdir, files, repeat, name_filter=None, report=print):
+    """Run the benchmarks and return the results.
+
+    :param str workdir: a directory to generate trees and run into.
+    :param int files: the number of files in generated trees.
+    :param int repeat: how many times to time each benchmark.
+    :param str name_filter: a regular expression benchmark names need to
+                            match to be run.
+    :param report: called with a line of text for each benchmark run.
+    """
+    context = Context(workdir, files)
+    results = collections.OrderedDict()
+    for name, function in _benchmarks.items():
+        if name_filter and not re.search(name_filter, name):
+            continue
+        case = function(context)
+        timings = []
+        for _ in range(repeat):
+            if case.setup:
+                case.setup()
+            timings.append(_time(case.run))
+        results[name] = dict(
+            min=min(timings), median=statistics.median(timings),
+            mean=statistics.mean(timings), timings=timings)
+        report('{:<30} {:>10.4f}s (median {:.4f}s)'.format(
+            name, results[name]['min'], results[name]['median']))
+
+    return dict(snapcraft=snapcraft.__version__,
+                python=platform.python_version(),
+                machine=platform.machine(),
+                time=int(time.time()),
+                files=files, repeat=repeat, results=results)
+
+
+def _time(function):
+    # Collections triggered by what ran before would only add noise.
+    gc.collect()
+    gc.disable()
+    try:
+        start = time.perf_counter()
+        function()
+        return time.perf_counter() - start
+    finally:
+        gc.enable()
+
+
+def compare(previous, current, *, threshold):
+    """Compare results from two runs.
+
+    :param float threshold: relative slowdown past which a benchmark is
+                            considered to have regressed (e.g. 0.1 for 10%).
+    :returns: a list of lines describing the changes and the names of the
+              benchmarks that regressed.
+    """
+    lines = []
+    regressions = []
+    if previous.get('files') != current.get('files'):
+        lines.append('Warning: comparing runs on trees of {} and {} '
+                     'files'.format(previous.get('files'),
+                                    current.get('files')))
+    for name, result in current['results'].items():
+        try:
+            before = previous['results'][name]['min']
+        except KeyError:
+            continue
+        after = result['min']
+        change = (after - before) / before if before else 0
+        regressed = change > threshold
+        if regressed:
+            regressions.append(name)
+        lines.append('{:<30} {:>10.4f}s -> {:>10.4f}s {:>+8.1%}{}'.format(
+            name, before, after, change, ' REGRESSION' if regressed else ''))
+
+    return lines, regressions
@@ -0,0 +1,97 @@
+# -*- Mode:Python; indent-tabs-mode:nil; tab-width:4 -*-
+#
+# Copyright (C) 2017 Canonical Ltd
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Generate synthetic trees looking like what parts install."""
+
+import os
+import shutil
+
+# Files per directory, and directories per parent directory.
+_FANOUT = 100
+# One in how many files is a symlink, a pkg-config file, a script with a
+# shebang and an ELF binary.
+_SYMLINK_EVERY = 10
+_PC_EVERY = 50
+_SCRIPT_EVERY = 100
+_ELF_EVERY = 1000
+
+_PC_TEMPLATE = """prefix=/usr
+libdir=${{prefix}}/lib
+includedir=${{prefix}}/include
+
+Name: lib{index}
+Description: A library
+Version: 1.0
+Libs: -L${{libdir}} -l{index}
+Cflags: -I${{includedir}}
+"""
+
+
+def _elf_binaries():
+    binaries = []
+    for name in ('true', 'ls', 'cat', 'cp', 'sh'):
+        path = shutil.which(name)
+        if path:
+            binaries.append(os.path.realpath(path))
+    if not binaries:
+        raise RuntimeError('No ELF binaries found to put in trees')
+    return binaries
+
+
+def tree_path(index):
+    """Return the relative path of the index-th file of a tree."""
+    directory = index // _FANOUT
+    components = []
+    while True:
+        components.insert(0, 'd{}'.format(directory % _FANOUT))
+        directory //= _FANOUT
+        if not directory:
+            break
+    return os.path.join('usr', *components, 'f{}'.format(index))
+
+
+def make_tree(root, files):
+    """Create a tree with the given number of files under root.
+
+    Most files are small text files, some are relative symlinks to their
+    neighbours, pkg-config files, scripts with a shebang and dynamically
+    linked ELF binaries.
+    """
+    elf_binaries = _elf_binaries()
+    created_dirs = set()
+    for index in range(files):
+        path = os.path.join(root, tree_path(index))
+        directory = os.path.dirname(path)
+        if directory not in created_dirs:
+            os.makedirs(directory, exist_ok=True)
+            created_dirs.add(directory)
+
+        if index % _ELF_EVERY == _ELF_EVERY - 1:
+            binary = elf_binaries[(index // _ELF_EVERY) % len(elf_binaries)]
+            shutil.copy2(binary, path)
+        elif index % _SYMLINK_EVERY == _SYMLINK_EVERY - 1:
+            os.symlink(os.path.basename(tree_path(index - 1)), path)
+        elif index % _PC_EVERY == _PC_EVERY - 2:
+            path += '.pc'
+            with open(path, 'w') as f:
+                f.write(_PC_TEMPLATE.format(index=index))
+        elif index % _SCRIPT_EVERY == _SCRIPT_EVERY - 3:
+            with open(path, 'w') as f:
+                f.write('#!/usr/bin/python3\nprint({})\n'.format(index))
+            os.chmod(path, 0o755)
+        else:
+            with open(path, 'w') as f:
+                f.write('file {}\n'.format(index))
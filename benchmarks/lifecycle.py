@@ -0,0 +1,298 @@
+# -*- Mode:Python; indent-tabs-mode:nil; tab-width:4 -*-
+#
+# Copyright (C) 2017 Canonical Ltd
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Benchmarks for what the lifecycle steps spend their time on."""
+
+import contextlib
+import os
+import shutil
+
+import yaml
+
+import snapcraft
+from snapcraft import file_utils
+from snapcraft.internal import (
+    elf,
+    pluginhandler,
+    project_loader,
+    repo,
+    states,
+)
+
+from benchmarks._runner import benchmark, Case
+
+# Parts in the generated snapcraft.yaml.
+_CONFIG_PARTS = 100
+
+# Parts staging the same files.
+_SHARING_PARTS = 10
+
+
+class _Part:
+    """Stand-in for a PluginHandler with its stage fileset known."""
+
+    def __init__(self, name, installdir, fileset, index_file):
+        self.name = name
+        self.installdir = installdir
+        self.file_index = pluginhandler.FileIndex(installdir, index_file)
+        self._fileset = fileset
+
+    def migratable_fileset_for(self, step):
+        return self._fileset
+
+
+def _rmtree(path):
+    if os.path.exists(path):
+        shutil.rmtree(path)
+
+
+def _fileset(context):
+    return pluginhandler._migratable_filesets(['*'], context.tree)
+
+
+@benchmark('migratable_filesets')
+def migratable_filesets(context):
+    tree = context.tree
+    return Case(run=lambda: pluginhandler._migratable_filesets(
+        ['*', '-usr/d0'], tree))
+
+
+@benchmark('migratable_filesets_patterns')
+def migratable_filesets_patterns(context):
+    tree = context.tree
+    fileset = ['usr/*/d1', 'usr/**/*.pc', '-usr/d1/d1/d1', '-**/f1*']
+    fileset += ['-usr/d{}/d0'.format(i) for i in range(10)]
+    return Case(run=lambda: pluginhandler._migratable_filesets(
+        fileset, tree))
+
+
+@benchmark('migrate_files')
+def migrate_files(context):
+    tree = context.tree
+    files, dirs = _fileset(context)
+    destination = context.path('migrate_files')
+
+    return Case(
+        setup=lambda: _rmtree(destination),
+        run=lambda: pluginhandler._migrate_files(
+            files, dirs, tree, destination))
+
+
+@benchmark('link_or_copy_tree')
+def link_or_copy_tree(context):
+    tree = context.tree
+    destination = context.path('link_or_copy_tree')
+
+    return Case(
+        setup=lambda: _rmtree(destination),
+        run=lambda: file_utils.link_or_copy_tree(tree, destination))
+
+
+def _colliding_parts(context, name):
+    # Two parts installing the same files, so that all of them are compared.
+    fileset = _fileset(context)
+    other_tree = context.path('check_for_collisions', 'tree')
+    if not os.path.exists(other_tree):
+        shutil.copytree(context.tree, other_tree, symlinks=True)
+    index_files = [context.path(name, 'part1.json'),
+                   context.path(name, 'part2.json')]
+
+    def make_parts():
+        return [_Part('part1', context.tree, fileset, index_files[0]),
+                _Part('part2', other_tree, fileset, index_files[1])]
+
+    return make_parts, index_files
+
+
+@benchmark('check_for_collisions')
+def check_for_collisions(context):
+    # Parts that were compared before, as when staging again.
+    make_parts, _ = _colliding_parts(context, 'check_for_collisions')
+    pluginhandler.check_for_collisions(make_parts())
+
+    return Case(
+        run=lambda: pluginhandler.check_for_collisions(make_parts()))
+
+
+@benchmark('check_for_collisions_cold')
+def check_for_collisions_cold(context):
+    # Parts compared for the first time, all the files are read.
+    make_parts, index_files = _colliding_parts(
+        context, 'check_for_collisions_cold')
+
+    def setup():
+        for index_file in index_files:
+            if os.path.exists(index_file):
+                os.remove(index_file)
+
+    return Case(
+        setup=setup,
+        run=lambda: pluginhandler.check_for_collisions(make_parts()))
+
+
+@benchmark('find_dependencies')
+def find_dependencies(context):
+    tree = context.tree
+    files, _ = _fileset(context)
+    arch_triplet = snapcraft.ProjectOptions().arch_triplet
+
+    def run():
+        resolver = elf.LibraryResolver(arch_triplet=arch_triplet)
+        return pluginhandler._find_dependencies(tree, files, resolver)
+
+    return Case(run=run)
+
+
+@benchmark('find_dependencies_cached')
+def find_dependencies_cached(context):
+    # Priming again without changes, the dependency cache is up to date.
+    tree = context.tree
+    files, _ = _fileset(context)
+    arch_triplet = snapcraft.ProjectOptions().arch_triplet
+    cache_file = context.path('find_dependencies_cached', 'cache.json')
+
+    def run():
+        resolver = elf.LibraryResolver(arch_triplet=arch_triplet)
+        cache = pluginhandler.DependencyCache(cache_file, resolver)
+        return pluginhandler._find_dependencies(tree, files, resolver, cache)
+
+    run()
+    return Case(run=run)
+
+
+@benchmark('normalize')
+def normalize(context):
+    # Normalizing changes files, each run gets a fresh copy of the tree.
+    unpackdir = context.path('normalize')
+    base_repo = repo.BaseRepo(context.path('normalize-repo'))
+
+    def setup():
+        _rmtree(unpackdir)
+        shutil.copytree(context.tree, unpackdir, symlinks=True)
+
+    return Case(setup=setup, run=lambda: base_repo.normalize(unpackdir))
+
+
+@benchmark('restage')
+def restage(context):
+    # Staging and priming again, out of date but with nothing changed.
+    project = context.path('restage', 'project')
+    os.makedirs(project, exist_ok=True)
+    with _cwd(project):
+        project_options = snapcraft.ProjectOptions()
+    validator = project_loader.Validator()
+    handler = pluginhandler.load_plugin(
+        part_name='part', plugin_name='nil',
+        part_properties={'plugin': 'nil'}, project_options=project_options,
+        part_schema=validator.part_schema,
+        definitions_schema=validator.definitions_schema)
+    if not os.path.exists(handler.installdir):
+        shutil.copytree(context.tree, handler.installdir, symlinks=True)
+    handler.makedirs()
+    handler.mark_done('pull')
+    handler.mark_done('build')
+    handler.stage()
+    handler.prime()
+
+    def run():
+        handler.clean(step='stage', deferred=True)
+        handler.stage()
+        handler.prime()
+
+    return Case(run=run)
+
+
+@benchmark('clean_shared_area')
+def clean_shared_area(context):
+    # Cleaning the stage step of one of several parts staging the same files,
+    # none of which are removed.
+    files, dirs = _fileset(context)
+    parts_dir = context.path('clean_shared_area', 'parts')
+    part_names = ['part{}'.format(i) for i in range(_SHARING_PARTS)]
+
+    def setup():
+        index = pluginhandler.OwnershipIndex(parts_dir, 'stage')
+        index.clear()
+        for part_name in part_names:
+            index.add(part_name, files, dirs)
+        index.save()
+
+    def run():
+        index = pluginhandler.OwnershipIndex(parts_dir, 'stage')
+        index.release(part_names[0], files, dirs)
+        index.save()
+
+    return Case(setup=setup, run=run)
+
+
+def _stage_state(context):
+    files, dirs = _fileset(context)
+    return states.StageState(files, dirs, {'plugin': 'nil'},
+                             snapcraft.ProjectOptions())
+
+
+@benchmark('state_dump')
+def state_dump(context):
+    state = _stage_state(context)
+    statedir = context.path('state_dump', 'state')
+    os.makedirs(statedir, exist_ok=True)
+    part_states = states.PartStates(statedir)
+
+    return Case(run=lambda: part_states.set('stage', state))
+
+
+@benchmark('state_load')
+def state_load(context):
+    statedir = context.path('state_load', 'state')
+    os.makedirs(statedir, exist_ok=True)
+    states.PartStates(statedir).set('stage', _stage_state(context))
+
+    # The file lists are read along with the rest of the state.
+    return Case(run=lambda: states.PartStates(statedir).get('stage').files)
+
+
+@benchmark('config_load')
+def config_load(context):
+    project = context.path('config_load', 'project')
+    os.makedirs(project, exist_ok=True)
+    parts = {}
+    for index in range(_CONFIG_PARTS):
+        part = {'plugin': 'nil', 'stage-packages': ['hello'],
+                'stage': ['*', '-usr/share/doc']}
+        if index:
+            part['after'] = ['part{}'.format(index - 1)]
+        parts['part{}'.format(index)] = part
+    with open(os.path.join(project, 'snapcraft.yaml'), 'w') as f:
+        yaml.dump(dict(name='benchmark', version='0', summary='benchmark',
+                       description='benchmark', confinement='strict',
+                       grade='devel', parts=parts), f)
+    project_options = snapcraft.ProjectOptions()
+
+    def run():
+        with _cwd(project):
+            project_loader.load_config(project_options)
+
+    return Case(run=run)
+
+
+@contextlib.contextmanager
+def _cwd(path):
+    cwd = os.getcwd()
+    os.chdir(path)
+    try:
+        yield
+    finally:
+        os.chdir(cwd)
@@ -56,7 +56,7 @@ class CleanBuildStepBuiltTestCase(integration_tests.TestCase):
         self.assert_files_exist()
 
         output = self.run_snapcraft(
-            ['clean', '--step=build'], debug=False)
+            ['clean', '--step=build', '--from-scratch'], debug=False)
 
         for part_name, part in self.parts.items():
             self.assertThat(part['builddir'], Not(DirExists()))
@@ -89,7 +89,8 @@ class CleanBuildStepBuiltTestCase(integration_tests.TestCase):
     def test_clean_build_step_single_part(self):
         self.assert_files_exist()
 
-        self.run_snapcraft(['clean', 'part1', '--step=build'])
+        self.run_snapcraft(
+            ['clean', 'part1', '--step=build', '--from-scratch'])
         self.assertThat(self.parts['part1']['builddir'], Not(DirExists()))
         self.assertThat(self.parts['part1']['installdir'], Not(DirExists()))
         self.assertThat(self.parts['part1']['sourcedir'], DirExists())
@@ -142,7 +143,7 @@ class CleanBuildStepPrimedTestCase(integration_tests.TestCase):
     def test_clean_build_step(self):
         self.assert_files_exist()
 
-        self.run_snapcraft(['clean', '--step=build'])
+        self.run_snapcraft(['clean', '--step=build', '--from-scratch'])
         self.assertThat(self.stage_dir, Not(DirExists()))
         self.assertThat(self.prime_dir, Not(DirExists()))
 
@@ -158,7 +159,8 @@ class CleanBuildStepPrimedTestCase(integration_tests.TestCase):
     def test_clean_build_step_single_part(self):
         self.assert_files_exist()
 
-        self.run_snapcraft(['clean', 'part1', '--step=build'])
+        self.run_snapcraft(
+            ['clean', 'part1', '--step=build', '--from-scratch'])
         self.assertThat(os.path.join(self.stage_bindir, 'file1'),
                         Not(FileExists()))
         self.assertThat(os.path.join(self.stage_bindir, 'file2'), FileExists())
@@ -180,3 +182,20 @@ class CleanBuildStepPrimedTestCase(integration_tests.TestCase):
         # Now try to prime again
         self.run_snapcraft('prime')
         self.assert_files_exist()
+
+    def test_clean_build_step_builds_upon_what_was_built(self):
+        self.assert_files_exist()
+
+        self.run_snapcraft(['clean', 'part1', '--step=build'])
+        self.assertThat(
+            os.path.join(self.parts['part1']['builddir'], 'file1'),
+            FileExists())
+        self.assertThat(self.parts['part1']['installdir'], Not(DirExists()))
+        # What was staged and primed stays until part1 is primed again.
+        self.assertThat(os.path.join(self.stage_bindir, 'file1'),
+                        FileExists())
+        self.assertThat(os.path.join(self.snap_bindir, 'file1'),
+                        FileExists())
+
+        self.run_snapcraft('prime')
+        self.assert_files_exist()
@@ -84,8 +84,9 @@ class SnapTestCase(integration_tests.TestCase):
         self.skipTest("Fails to run correctly on travis.")
         self.run_snapcraft('cleanbuild', 'assemble')
 
+        # The project is streamed into the container.
         snap_source_path = 'assemble_1.0_source.tar.bz2'
-        self.assertThat(snap_source_path, FileExists())
+        self.assertThat(snap_source_path, Not(FileExists()))
 
         snap_file_path = 'assemble_1.0_{}.snap'.format(self.deb_arch)
         self.assertThat(snap_file_path, FileExists())
@@ -353,40 +353,72 @@ of the choice of plugin.
 """
 
 from collections import OrderedDict                 # noqa
-import pkg_resources                                # noqa
+import importlib
+import sys
+import types
+
 import yaml                                         # noqa
 
 from snapcraft._baseplugin import BasePlugin        # noqa
 from snapcraft._options import ProjectOptions       # noqa
 from snapcraft._help import topic_help              # noqa
-# FIXME LP: #1662658
-from snapcraft._store import (                      # noqa
-    create_key,
-    close,
-    download,
-    revisions,
-    gated,
-    list_keys,
-    list_registered,
-    login,
-    logout,
-    push,
-    register,
-    register_key,
-    release,
-    sign_build,
-    status,
-    validate,
-)
 from snapcraft import common                        # noqa
-from snapcraft import plugins                       # noqa
-from snapcraft import sources                       # noqa
 from snapcraft import file_utils                    # noqa
 from snapcraft import shell_utils                   # noqa
-from snapcraft.internal import repo                 # noqa
+
+# These bring in the store, source and repository dependencies (requests,
+# apt, libarchive...), they are only imported once first used so that
+# commands not needing them start fast.
+_LAZY_ATTRIBUTES = {
+    'plugins': ('snapcraft.plugins', None),
+    'sources': ('snapcraft.sources', None),
+    'repo': ('snapcraft.internal.repo', None),
+}
+# FIXME LP: #1662658
+for _name in ('create_key', 'close', 'download', 'revisions', 'gated',
+              'list_keys', 'list_registered', 'login', 'logout', 'push',
+              'register', 'register_key', 'release', 'sign_build', 'status',
+              'validate'):
+    _LAZY_ATTRIBUTES[_name] = ('snapcraft._store', _name)
+del _name
+
+
+class _SnapcraftModule(types.ModuleType):
+
+    def __getattr__(self, name):
+        try:
+            module_name, attribute = _LAZY_ATTRIBUTES[name]
+        except KeyError:
+            raise AttributeError(
+                'module {!r} has no attribute {!r}'.format(
+                    self.__name__, name)) from None
+        value = importlib.import_module(module_name)
+        if attribute:
+            value = getattr(value, attribute)
+        setattr(self, name, value)
+        return value
+
+    def __dir__(self):
+        return sorted(set(super().__dir__()) | set(_LAZY_ATTRIBUTES))
+
+
+sys.modules[__name__].__class__ = _SnapcraftModule
 
 
 def _get_version():
+    # pkg_resources takes longer to import than the rest of snapcraft,
+    # only fall back to it where importlib cannot tell.
+    try:
+        from importlib import metadata
+    except ImportError:
+        metadata = None
+    if metadata:
+        try:
+            return metadata.version('snapcraft')
+        except metadata.PackageNotFoundError:
+            return 'devel'
+
+    import pkg_resources
     try:
         return pkg_resources.require('snapcraft')[0].version
     except pkg_resources.DistributionNotFound:
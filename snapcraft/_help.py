@@ -17,12 +17,9 @@
 
 import importlib
 
-import snapcraft
-from snapcraft.internal import sources
-
 _TOPICS = {
-    'sources': sources,
-    'plugins': snapcraft,
+    'sources': 'snapcraft.internal.sources',
+    'plugins': 'snapcraft',
 }
 
 
@@ -37,10 +34,11 @@ def topic_help(topic, show_devel, list_topics):
 
 
 def _topic_help(module_name, devel):
+    module = importlib.import_module(_TOPICS[module_name])
     if devel:
-        help(_TOPICS[module_name])
+        help(module)
     else:
-        print(_TOPICS[module_name].__doc__)
+        print(module.__doc__)
 
 
 def _module_help(module_name, devel):
@@ -121,6 +121,26 @@ class ProjectOptions:
 
         return build_count
 
+    @property
+    def parallel_part_count(self):
+        return self.__parallel_part_count
+
+    @property
+    def parallel_fetch_count(self):
+        return self.__parallel_fetch_count
+
+    @property
+    def use_build_cache(self):
+        return self.__use_build_cache
+
+    @property
+    def apt_update_ttl(self):
+        return self.__apt_update_ttl
+
+    @property
+    def offline(self):
+        return self.__offline
+
     @property
     def is_cross_compiling(self):
         return self.__target_machine != self.__platform_arch
@@ -179,12 +199,20 @@ class ProjectOptions:
         return self.__debug
 
     def __init__(self, use_geoip=False, parallel_builds=True,
-                 target_deb_arch=None, debug=False):
+                 target_deb_arch=None, debug=False, parallel_part_count=1,
+                 parallel_fetch_count=4, use_build_cache=False,
+                 apt_update_ttl=common.DEFAULT_APT_UPDATE_TTL,
+                 offline=False):
         # TODO: allow setting a different project dir and check for
         #       snapcraft.yaml
         self.__project_dir = os.getcwd()
         self.__use_geoip = use_geoip
         self.__parallel_builds = parallel_builds
+        self.__parallel_part_count = parallel_part_count
+        self.__parallel_fetch_count = parallel_fetch_count
+        self.__use_build_cache = use_build_cache
+        self.__apt_update_ttl = apt_update_ttl
+        self.__offline = offline
         self._set_machine(target_deb_arch)
         self.__debug = debug
 
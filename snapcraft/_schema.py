@@ -21,11 +21,49 @@ import jsonschema
 import yaml
 
 from snapcraft.internal import (
+    cache,
     common,
     errors
 )
 
 
+class _Schema:
+
+    def __init__(self, schema):
+        self.schema = schema
+        self._validator = None
+
+    @property
+    def validator(self):
+        # Checking the schema and setting up a validator for it is costly,
+        # it is done once. The format checker is only created when first
+        # validating so that it picks up checks registered at import time.
+        if not self._validator:
+            cls = jsonschema.validators.validator_for(self.schema)
+            cls.check_schema(self.schema)
+            self._validator = cls(
+                self.schema, format_checker=jsonschema.FormatChecker())
+        return self._validator
+
+
+# Loaded schemas by file and stamp, shared by all the Validator instances.
+_schemas = {}
+
+
+def _load(schema_file):
+    with open(schema_file) as fp:
+        stat = os.fstat(fp.fileno())
+        key = (schema_file, stat.st_mtime_ns, stat.st_size)
+        if key not in _schemas:
+            schema_cache = cache.SchemaCache()
+            schema = schema_cache.get(schema_file=schema_file)
+            if schema is None:
+                schema = yaml.load(fp)
+                schema_cache.cache(schema_file=schema_file, schema=schema)
+            _schemas[key] = _Schema(schema)
+    return _schemas[key]
+
+
 class Validator:
 
     def __init__(self, snapcraft_yaml=None):
@@ -41,32 +79,36 @@ class Validator:
 
     @property
     def part_schema(self):
-        """Return part-specific schema properties."""
+        """Return part-specific schema properties.
+
+        It is shared with the other validators and must not be modified.
+        """
 
         sub = self.schema['parts']['patternProperties']
-        properties = sub['^(?!plugins$)[a-z0-9][a-z0-9+-\/]*$']['properties']
+        properties = sub[r'^(?!plugins$)[a-z0-9][a-z0-9+-\/]*$']['properties']
         return properties
 
     @property
     def definitions_schema(self):
-        """Return sub-schema that describes definitions used within schema."""
+        """Return sub-schema that describes definitions used within schema.
+
+        It is shared with the other validators and must not be modified.
+        """
 
-        return self._schema['definitions'].copy()
+        return self._schema['definitions']
 
     def _load_schema(self):
         schema_file = os.path.abspath(os.path.join(
             common.get_schemadir(), 'snapcraft.yaml'))
         try:
-            with open(schema_file) as fp:
-                self._schema = yaml.load(fp)
+            self._loaded_schema = _load(schema_file)
         except FileNotFoundError:
             raise errors.SnapcraftSchemaError(
                 'snapcraft validation file is missing from installation path')
+        self._schema = self._loaded_schema.schema
 
     def validate(self):
-        format_check = jsonschema.FormatChecker()
         try:
-            jsonschema.validate(
-                self._snapcraft, self._schema, format_checker=format_check)
+            self._loaded_schema.validator.validate(self._snapcraft)
         except jsonschema.ValidationError as e:
             raise errors.SnapcraftSchemaError.from_validation_error(e)
@@ -14,11 +14,14 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-from contextlib import contextmanager
+from contextlib import contextmanager, suppress
+import errno
+import fcntl
 import hashlib
 import logging
 import os
 import shutil
+import stat
 import subprocess
 import sys
 
@@ -83,11 +86,66 @@ def search_and_replace_contents(file_path, search_pattern, replacement):
             path=file_path, error=e))
 
 
+# From linux/fs.h, _IOW(0x94, 9, int).
+_FICLONE = 0x40049409
+# Errors meaning the filesystems involved can't clone, as opposed to errors
+# a copy would hit as well.
+_REFLINK_UNSUPPORTED_ERRORS = {
+    errno.EBADF, errno.EINVAL, errno.ENOTTY, errno.EOPNOTSUPP, errno.EXDEV}
+# (source device, destination device) pairs cloning failed for.
+_reflink_unsupported = set()
+
+
+def reflink_or_copy(source, destination, *, follow_symlinks=True):
+    """Clone source into destination. Copy if the filesystem can't clone.
+
+    Cloned files share their data blocks until either is written to, which
+    makes copying large files on filesystems supporting it (e.g. btrfs or
+    XFS) nearly free while keeping the copies independent, unlike hard links.
+
+    This takes the same arguments and returns the same as shutil.copy2.
+
+    :param str source: The file to be cloned.
+    :param str destination: The file, or directory, to clone into.
+    :param bool follow_symlinks: Whether or not symlinks should be followed.
+    """
+    if os.path.isdir(destination):
+        destination = os.path.join(destination, os.path.basename(source))
+
+    source_stat = os.stat(source, follow_symlinks=follow_symlinks)
+    if stat.S_ISREG(source_stat.st_mode):
+        destination_dir = os.path.dirname(destination) or os.curdir
+        devices = (source_stat.st_dev, os.stat(destination_dir).st_dev)
+        if devices not in _reflink_unsupported:
+            try:
+                _reflink(source, destination)
+            except OSError as e:
+                if e.errno not in _REFLINK_UNSUPPORTED_ERRORS:
+                    raise
+                _reflink_unsupported.add(devices)
+            else:
+                shutil.copystat(source, destination)
+                return destination
+
+    return shutil.copy2(source, destination, follow_symlinks=follow_symlinks)
+
+
+def _reflink(source, destination):
+    with open(source, 'rb') as source_file:
+        with open(destination, 'wb') as destination_file:
+            try:
+                fcntl.ioctl(destination_file.fileno(), _FICLONE,
+                            source_file.fileno())
+            except OSError:
+                os.remove(destination)
+                raise
+
+
 def link_or_copy(source, destination, follow_symlinks=False):
     """Hard-link source and destination files. Copy if it fails to link.
 
     Hard-linking may fail (e.g. a cross-device link, or permission denied), so
-    as a backup plan we just copy it.
+    as a backup plan we just copy it, cloning it where supported.
 
     :param str source: The source to which destination will be linked.
     :param str destination: The destination to be linked to source.
@@ -110,14 +168,28 @@ def link_or_copy(source, destination, follow_symlinks=False):
         # symlinks.
         os.link(source_path, destination, follow_symlinks=False)
     except OSError:
-        shutil.copy2(source, destination, follow_symlinks=follow_symlinks)
-        uid = os.stat(source, follow_symlinks=follow_symlinks).st_uid
-        gid = os.stat(source, follow_symlinks=follow_symlinks).st_gid
-        try:
-            os.chown(destination, uid, gid, follow_symlinks=follow_symlinks)
-        except PermissionError as e:
-            logger.debug('Unable to chown {destination}: {error}'.format(
-                destination=destination, error=e))
+        copy_with_ownership(source, destination,
+                            follow_symlinks=follow_symlinks)
+
+
+def copy_with_ownership(source, destination, follow_symlinks=False):
+    """Copy source into destination, cloning it where supported, and try to
+    preserve its owner.
+
+    :param str source: The file to be copied.
+    :param str destination: The file to copy into.
+    :param bool follow_symlinks: Whether or not symlinks should be followed.
+    :returns: the stat result of source.
+    """
+    reflink_or_copy(source, destination, follow_symlinks=follow_symlinks)
+    source_stat = os.stat(source, follow_symlinks=follow_symlinks)
+    try:
+        os.chown(destination, source_stat.st_uid, source_stat.st_gid,
+                 follow_symlinks=follow_symlinks)
+    except PermissionError as e:
+        logger.debug('Unable to chown {destination}: {error}'.format(
+            destination=destination, error=e))
+    return source_stat
 
 
 def link_or_copy_tree(source_tree, destination_tree,
@@ -165,6 +237,104 @@ def link_or_copy_tree(source_tree, destination_tree,
             copy_function(source, destination)
 
 
+def sync_tree(source_tree, destination_tree, *, ignore=None, synced=(),
+              copy_function=reflink_or_copy):
+    """Make destination_tree match source_tree, copying only what changed.
+
+    Files are considered unchanged if their size, mode and modification
+    time match. Times are preserved so that tools comparing them (e.g. make)
+    only redo what's needed.
+
+    :param str source_tree: Source directory to be copied.
+    :param str destination_tree: Destination directory.
+    :param ignore: a callable like the one taken by shutil.copytree.
+    :param synced: paths, relative to the trees, returned by a previous
+                   sync. Those no longer in source_tree are removed from
+                   destination_tree, other files in it are left alone.
+    :param copy_function: the function used to copy files.
+    :returns: the set of paths, relative to the trees, that were synced.
+    """
+    current = set()
+    create_similar_directory(source_tree, destination_tree)
+
+    for root, directories, files in os.walk(source_tree):
+        ignored = set(ignore(root, directories + files)) if ignore else set()
+        subdirectories = []
+        for name in directories:
+            if name in ignored:
+                continue
+            # Symlinks to directories are synced as symlinks.
+            if os.path.islink(os.path.join(root, name)):
+                files.append(name)
+            else:
+                subdirectories.append(name)
+        directories[:] = subdirectories
+
+        for name in directories:
+            source = os.path.join(root, name)
+            relative_path = os.path.relpath(source, source_tree)
+            destination = os.path.join(destination_tree, relative_path)
+            if os.path.islink(destination) or os.path.isfile(destination):
+                os.remove(destination)
+            create_similar_directory(source, destination)
+            current.add(relative_path)
+
+        for name in files:
+            if name in ignored:
+                continue
+            source = os.path.join(root, name)
+            relative_path = os.path.relpath(source, source_tree)
+            _sync_file(source, os.path.join(destination_tree, relative_path),
+                       copy_function)
+            current.add(relative_path)
+
+    _remove_unsynced(destination_tree, set(synced) - current)
+
+    return current
+
+
+def _remove_unsynced(destination_tree, relative_paths):
+    """Remove what was synced before but is no longer in the source."""
+    # Deepest paths first, so that directories are empty when we get to them.
+    for relative_path in sorted(relative_paths, reverse=True):
+        destination = os.path.join(destination_tree, relative_path)
+        if os.path.isdir(destination) and not os.path.islink(destination):
+            with suppress(OSError):
+                os.rmdir(destination)
+        else:
+            with suppress(FileNotFoundError):
+                os.remove(destination)
+
+
+def _sync_file(source, destination, copy_function):
+    source_stat = os.lstat(source)
+    try:
+        destination_stat = os.lstat(destination)
+    except FileNotFoundError:
+        destination_stat = None
+
+    if destination_stat:
+        if stat.S_ISDIR(destination_stat.st_mode):
+            shutil.rmtree(destination)
+        elif stat.S_ISLNK(source_stat.st_mode):
+            if (stat.S_ISLNK(destination_stat.st_mode) and
+                    os.readlink(source) == os.readlink(destination)):
+                return
+            os.remove(destination)
+        else:
+            if (destination_stat.st_mode == source_stat.st_mode and
+                    destination_stat.st_size == source_stat.st_size and
+                    destination_stat.st_mtime_ns == source_stat.st_mtime_ns):
+                return
+            # Remove it rather than writing over it, it may be a hard link.
+            os.remove(destination)
+
+    if stat.S_ISLNK(source_stat.st_mode):
+        os.symlink(os.readlink(source), destination)
+    else:
+        copy_function(source, destination)
+
+
 def create_similar_directory(source, destination, follow_symlinks=False):
     """Create a directory with the same permission bits and owner information.
 
@@ -234,3 +404,42 @@ def calculate_sha3_384(path):
                 break
             hasher.update(buf)
         return hasher.hexdigest()
+
+
+def calculate_tree_digest(directory, *, paths=None, ignore=None):
+    """Calculate a sha384 digest of the contents of a directory tree.
+
+    Names, contents, symlink targets and the executable bit are taken into
+    account, times and ownership are not.
+
+    :param str directory: the root of the tree.
+    :param paths: only digest these paths, relative to directory, instead
+                  of walking the tree.
+    :param ignore: a callable like the one taken by shutil.copytree.
+    """
+    if paths is None:
+        paths = []
+        for root, directories, files in os.walk(directory):
+            ignored = ignore(root, directories + files) if ignore else ()
+            directories[:] = [d for d in directories if d not in ignored]
+            paths.extend(os.path.relpath(os.path.join(root, name), directory)
+                         for name in directories + files
+                         if name not in ignored)
+
+    hasher = hashlib.sha384()
+    for path in sorted(paths):
+        full_path = os.path.join(directory, path)
+        hasher.update(path.encode() + b'\0')
+        if os.path.islink(full_path):
+            hasher.update(b'l' + os.readlink(full_path).encode())
+        elif os.path.isdir(full_path):
+            hasher.update(b'd')
+        elif os.path.exists(full_path):
+            executable = os.access(full_path, os.X_OK)
+            hasher.update(b'x' if executable else b'f')
+            with open(full_path, 'rb') as f:
+                for block in iter(lambda: f.read(2**20), b''):
+                    hasher.update(block)
+        hasher.update(b'\0')
+
+    return hasher.hexdigest()
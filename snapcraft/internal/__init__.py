@@ -17,4 +17,10 @@
 from snapcraft.internal import cache             # noqa
 from snapcraft.internal import deltas            # noqa
 from snapcraft.internal import states            # noqa
-from snapcraft.internal.project_loader import load_config  # noqa
+
+
+def load_config(project_options=None):
+    # project_loader brings in jsonschema and the plugin machinery, only
+    # import it for the commands that need a project.
+    from snapcraft.internal import project_loader
+    return project_loader.load_config(project_options)
@@ -15,5 +15,8 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 from ._apt import AptStagePackageCache  # noqa
+from ._build import BuildCache  # noqa
 from ._cache import SnapcraftCache  # noqa
+from ._cache import SnapcraftProjectCache  # noqa
+from ._schema import SchemaCache  # noqa
 from ._snap import SnapCache  # noqa
@@ -25,10 +25,11 @@ logger = logging.getLogger(__name__)
 class AptStagePackageCache(SnapcraftStagePackageCache):
     """Cache for stage-packages coming from apt."""
 
-    def __init__(self, *, sources_digest):
+    def __init__(self, *, sources_digest, create=True):
         """Create a new AptStagePackageCache.
 
         :param str sources_digest: Unique digest of the current apt sources.
+        :param bool create: whether to create the cache directories.
         """
 
         super().__init__()
@@ -40,4 +41,5 @@ class AptStagePackageCache(SnapcraftStagePackageCache):
             cache_base_dir, sources_digest)
         self.packages_dir = os.path.join(
             self.base_dir, 'var', 'cache', 'apt', 'archives')
-        os.makedirs(self.packages_dir, exist_ok=True)
+        if create:
+            os.makedirs(self.packages_dir, exist_ok=True)
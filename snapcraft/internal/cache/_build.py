@@ -0,0 +1,129 @@
+# -*- Mode:Python; indent-tabs-mode:nil; tab-width:4 -*-
+#
+# Copyright (C) 2017 Canonical Ltd
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import contextlib
+import logging
+import os
+import shutil
+import tempfile
+import time
+
+import yaml
+
+from ._cache import SnapcraftCache
+from snapcraft import file_utils
+
+logger = logging.getLogger(__name__)
+
+
+def _copy(source, destination):
+    file_utils.reflink_or_copy(source, destination, follow_symlinks=False)
+
+
+class BuildCache(SnapcraftCache):
+    """Cache for the result of building parts.
+
+    Entries are keyed by a fingerprint of everything going into a build and
+    hold the install directory and the build state of the part.
+    """
+
+    # Entries not used for this many seconds are pruned as new ones are
+    # cached.
+    MAX_AGE = 30 * 24 * 60 * 60
+
+    def __init__(self):
+        super().__init__()
+        self.build_cache_root = os.path.join(self.cache_root, 'builds')
+
+    def _entry_dir(self, fingerprint):
+        return os.path.join(self.build_cache_root, fingerprint)
+
+    def cache(self, *, fingerprint, installdir, state):
+        """Cache a copy of installdir along with its build state.
+
+        The install directory is copied (cloned where the filesystem
+        supports it) rather than linked so that later changes to it do not
+        leak into the cache.
+
+        :returns: path to the cache entry.
+        """
+        entry_dir = self._entry_dir(fingerprint)
+        if os.path.isdir(entry_dir):
+            return entry_dir
+
+        os.makedirs(self.build_cache_root, exist_ok=True)
+        temp_dir = tempfile.mkdtemp(dir=self.build_cache_root)
+        try:
+            file_utils.link_or_copy_tree(
+                installdir, os.path.join(temp_dir, 'install'),
+                copy_function=_copy)
+            with open(os.path.join(temp_dir, 'state'), 'w') as f:
+                f.write(yaml.dump(state))
+            os.rename(temp_dir, entry_dir)
+        except OSError as e:
+            logger.warning('Unable to cache build: {}'.format(e))
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+        return entry_dir
+
+    def get(self, *, fingerprint):
+        """Get the build state of a cached entry.
+
+        :returns: the build state, or None if there is no such entry.
+        """
+        state_file = os.path.join(self._entry_dir(fingerprint), 'state')
+        if not os.path.isfile(state_file):
+            return None
+
+        # The time of an entry is that of its last use.
+        with contextlib.suppress(OSError):
+            os.utime(self._entry_dir(fingerprint))
+        with open(state_file) as f:
+            return yaml.load(f.read())
+
+    def restore(self, *, fingerprint, installdir):
+        """Replace installdir with the one of a cached entry, hard-linking."""
+        if os.path.exists(installdir):
+            shutil.rmtree(installdir)
+        file_utils.link_or_copy_tree(
+            os.path.join(self._entry_dir(fingerprint), 'install'), installdir)
+
+    def prune(self, *, keep_fingerprints=(), max_age=None):
+        """Remove every cache entry but those in keep_fingerprints.
+
+        :param int max_age: if set, only entries not used for this many
+                            seconds are removed.
+        :returns: pruned entry paths list.
+        """
+        pruned = []
+        if not os.path.isdir(self.build_cache_root):
+            return pruned
+
+        now = time.time()
+        for fingerprint in os.listdir(self.build_cache_root):
+            if fingerprint in keep_fingerprints:
+                continue
+            entry_dir = self._entry_dir(fingerprint)
+            if max_age is not None:
+                try:
+                    if now - os.path.getmtime(entry_dir) < max_age:
+                        continue
+                except FileNotFoundError:
+                    continue
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            pruned.append(entry_dir)
+
+        return pruned
@@ -0,0 +1,83 @@
+# -*- Mode:Python; indent-tabs-mode:nil; tab-width:4 -*-
+#
+# Copyright (C) 2017 Canonical Ltd
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import collections
+import contextlib
+import hashlib
+import json
+import logging
+import os
+
+from ._cache import SnapcraftCache
+
+logger = logging.getLogger(__name__)
+
+
+class SchemaCache(SnapcraftCache):
+    """Cache for schemas parsed from yaml, stored as json.
+
+    Parsing the snapcraft schema with PyYAML takes a good part of the time
+    needed to load a project, json is much faster to load.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.schema_cache_root = os.path.join(self.cache_root, 'schema')
+
+    def _cache_file(self, schema_file):
+        digest = hashlib.sha256(schema_file.encode()).hexdigest()
+        return os.path.join(self.schema_cache_root, '{}.json'.format(digest))
+
+    @staticmethod
+    def _stamp(schema_file):
+        stat = os.stat(schema_file)
+        return [stat.st_mtime_ns, stat.st_size]
+
+    def cache(self, *, schema_file, schema):
+        """Cache the schema parsed from schema_file.
+
+        Failing to write the cache is not an error, the schema is parsed
+        again next time.
+        """
+        cache_file = self._cache_file(schema_file)
+        temp_file = '{}.{}'.format(cache_file, os.getpid())
+        try:
+            os.makedirs(self.schema_cache_root, exist_ok=True)
+            with open(temp_file, 'w') as f:
+                json.dump(dict(stamp=self._stamp(schema_file),
+                               schema=schema), f)
+            os.replace(temp_file, cache_file)
+        except (OSError, TypeError, ValueError) as e:
+            logger.debug('Cannot cache {!r}: {}'.format(schema_file, e))
+            with contextlib.suppress(OSError):
+                os.remove(temp_file)
+
+    def get(self, *, schema_file):
+        """Return the cached schema for schema_file or None.
+
+        A cached schema is only returned if schema_file did not change
+        since it was cached.
+        """
+        try:
+            with open(self._cache_file(schema_file)) as f:
+                cached = json.load(
+                    f, object_pairs_hook=collections.OrderedDict)
+        except (OSError, ValueError):
+            return None
+
+        if cached.get('stamp') != self._stamp(schema_file):
+            return None
+        return cached.get('schema')
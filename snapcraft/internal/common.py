@@ -27,10 +27,17 @@ import sys
 import tempfile
 import urllib
 
+from snapcraft.internal import tracing
+
 
 SNAPCRAFT_FILES = ['snapcraft.yaml', '.snapcraft.yaml', 'parts', 'stage',
                    'prime', 'snap']
 COMMAND_ORDER = ['pull', 'build', 'stage', 'prime']
+# FIXME: snapcraft targets the '16' series, hardcode it until more choices
+# become available server side -- vila 2016-04-22
+DEFAULT_SERIES = '16'
+# Seconds the package index stage-packages are fetched with is reused for.
+DEFAULT_APT_UPDATE_TTL = 3600
 _DEFAULT_PLUGINDIR = '/usr/share/snapcraft/plugins'
 _plugindir = _DEFAULT_PLUGINDIR
 _DEFAULT_SCHEMADIR = '/usr/share/snapcraft/schema'
@@ -59,7 +66,8 @@ def run(cmd, **kwargs):
         f.write('\n')
         f.write('exec "$@"')
         f.flush()
-        subprocess.check_call(['/bin/sh', f.name] + cmd, **kwargs)
+        with tracing.process(cmd):
+            subprocess.check_call(['/bin/sh', f.name] + cmd, **kwargs)
 
 
 def run_output(cmd, **kwargs):
@@ -70,7 +78,9 @@ def run_output(cmd, **kwargs):
         f.write('\n')
         f.write('exec "$@"')
         f.flush()
-        output = subprocess.check_output(['/bin/sh', f.name] + cmd, **kwargs)
+        with tracing.process(cmd):
+            output = subprocess.check_output(
+                ['/bin/sh', f.name] + cmd, **kwargs)
         try:
             return output.decode(sys.getfilesystemencoding()).strip()
         except UnicodeEncodeError:
@@ -0,0 +1,355 @@
+# -*- Mode:Python; indent-tabs-mode:nil; tab-width:4 -*-
+#
+# Copyright (C) 2017 Canonical Ltd
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Read what ELF files need at runtime and find it like ld.so does.
+
+This replaces running ldd on each file, which needs the dynamic linker of
+the architecture the files were built for to be runnable on the host.
+"""
+
+import collections
+import glob
+import logging
+import os
+import re
+import struct
+
+from snapcraft.internal import errors
+
+logger = logging.getLogger(__name__)
+
+_ELF_MAGIC = b'\x7fELF'
+_EI_NIDENT = 16
+_ELFCLASS32 = 1
+_ELFCLASS64 = 2
+_BYTE_ORDERS = {1: '<', 2: '>'}
+
+_PT_LOAD = 1
+_PT_DYNAMIC = 2
+_PT_INTERP = 3
+
+_DT_NULL = 0
+_DT_NEEDED = 1
+_DT_STRTAB = 5
+_DT_STRSZ = 10
+_DT_SONAME = 14
+_DT_RPATH = 15
+_DT_RUNPATH = 29
+
+# For each class: the header fields following e_ident, a program header,
+# where p_type, p_offset, p_vaddr and p_filesz are in it, and a dynamic
+# section entry.
+_LAYOUTS = {
+    _ELFCLASS32: ('HHIIIIIHHHHHH', 'IIIIIIII', (0, 1, 2, 4), 'iI'),
+    _ELFCLASS64: ('HHIQQQIHHHHHH', 'IIQQQQQQ', (0, 2, 3, 5), 'qQ'),
+}
+
+# The dynamic linker itself, ldd does not list it as a library.
+_DYNAMIC_LINKER = re.compile(r'^ld(64)?([-.].*)?\.so(\.[0-9]+)*$')
+
+
+class ElfFile:
+    """What an ELF file needs to be loaded.
+
+    :ivar str path: where the file was read from.
+    :ivar tuple arch: the class, byte order and machine of the file, a
+                      library can only be loaded by a file of the same arch.
+    :ivar str interp: the program interpreter, or None.
+    :ivar list needed: the names of the libraries needed (DT_NEEDED).
+    :ivar str soname: the name of the library (DT_SONAME), or None.
+    :ivar list rpath: the directories in DT_RPATH.
+    :ivar list runpath: the directories in DT_RUNPATH, or None if there is
+                        no DT_RUNPATH.
+    """
+
+    def __init__(self, *, path, arch, interp=None, needed=None, soname=None,
+                 rpath=None, runpath=None):
+        self.path = path
+        self.arch = tuple(arch)
+        self.interp = interp
+        self.needed = needed or []
+        self.soname = soname
+        self.rpath = rpath or []
+        self.runpath = runpath
+
+
+def read_elf_file(path):
+    """Return the ElfFile for path, or None if it is not an ELF file.
+
+    :raises snapcraft.internal.errors.CorruptedElfFileError: if path starts
+        like an ELF file but can't be read as one.
+    """
+    with open(path, 'rb') as f:
+        ident = f.read(_EI_NIDENT)
+        if len(ident) < _EI_NIDENT or not ident.startswith(_ELF_MAGIC):
+            return None
+        try:
+            return _read_elf_file(path, f, ident)
+        except (struct.error, ValueError) as e:
+            raise errors.CorruptedElfFileError(path=path, message=str(e))
+
+
+def _read_elf_file(path, f, ident):
+    elf_class = ident[4]
+    byte_order = _BYTE_ORDERS.get(ident[5])
+    if elf_class not in _LAYOUTS or not byte_order:
+        raise ValueError('unknown ELF class or byte order')
+    header_format, program_header_format, fields, dynamic_format = (
+        _LAYOUTS[elf_class])
+
+    header = struct.Struct(byte_order + header_format)
+    (_, machine, _, _, phoff, _, _, _, phentsize, phnum, _, _, _) = (
+        header.unpack(f.read(header.size)))
+
+    program_header = struct.Struct(byte_order + program_header_format)
+    f.seek(phoff)
+    table = f.read(phentsize * phnum)
+    loads = []
+    interp = None
+    dynamic = None
+    for index in range(phnum):
+        entry = program_header.unpack_from(table, index * phentsize)
+        p_type, p_offset, p_vaddr, p_filesz = (entry[i] for i in fields)
+        if p_type == _PT_LOAD:
+            loads.append((p_vaddr, p_offset, p_filesz))
+        elif p_type == _PT_INTERP:
+            f.seek(p_offset)
+            interp = os.fsdecode(f.read(p_filesz).rstrip(b'\0'))
+        elif p_type == _PT_DYNAMIC:
+            f.seek(p_offset)
+            dynamic = f.read(p_filesz)
+
+    elf_file = ElfFile(path=path, arch=(elf_class, byte_order, machine),
+                       interp=interp)
+    if dynamic:
+        _read_dynamic_section(elf_file, f, dynamic,
+                              struct.Struct(byte_order + dynamic_format),
+                              loads)
+    return elf_file
+
+
+def _read_dynamic_section(elf_file, f, dynamic, entry_struct, loads):
+    strings = collections.defaultdict(list)
+    strtab_address = strtab_size = None
+    for tag, value in _dynamic_entries(dynamic, entry_struct):
+        if tag == _DT_STRTAB:
+            strtab_address = value
+        elif tag == _DT_STRSZ:
+            strtab_size = value
+        elif tag in _STRING_TAGS:
+            strings[tag].append(value)
+    if not strings:
+        return
+    if strtab_address is None or strtab_size is None:
+        raise ValueError('dynamic section without a string table')
+
+    strtab = _read_loaded(f, strtab_address, strtab_size, loads)
+    for tag, indexes in strings.items():
+        attribute, convert = _STRING_TAGS[tag]
+        setattr(elf_file, attribute,
+                convert([_string(strtab, i) for i in indexes]))
+
+
+def _dynamic_entries(dynamic, entry_struct):
+    for offset in range(0, len(dynamic) - entry_struct.size + 1,
+                        entry_struct.size):
+        tag, value = entry_struct.unpack_from(dynamic, offset)
+        if tag == _DT_NULL:
+            return
+        yield tag, value
+
+
+def _read_loaded(f, address, size, loads):
+    # The string table is found by its address once loaded.
+    for vaddr, offset, filesz in loads:
+        if vaddr <= address < vaddr + filesz:
+            f.seek(address - vaddr + offset)
+            return f.read(size)
+    raise ValueError('string table is not in a loaded segment')
+
+
+def _string(strtab, index):
+    return os.fsdecode(strtab[index:strtab.index(b'\0', index)])
+
+
+def _split_paths(values):
+    return [d for value in values for d in value.split(':')]
+
+
+# The ElfFile attribute set from the strings of each tag, and how.
+_STRING_TAGS = {
+    _DT_NEEDED: ('needed', list),
+    _DT_SONAME: ('soname', lambda values: values[0]),
+    _DT_RPATH: ('rpath', _split_paths),
+    _DT_RUNPATH: ('runpath', _split_paths),
+}
+
+
+class LibraryResolver:
+    """Find the libraries ELF files need, in the order ld.so looks for them.
+
+    For each library needed, ld.so searches:
+
+    - the DT_RPATH of the file needing it and of the files that needed
+      those, up to the executable, unless the file has a DT_RUNPATH.
+    - LD_LIBRARY_PATH, here library_paths.
+    - the DT_RUNPATH of the file needing it.
+    - the directories from ld.so.conf, then the default ones for the
+      target architecture.
+
+    Only libraries of the same class and machine as the file being
+    resolved are used, so host libraries are skipped when cross-compiling.
+    Files read are kept for the lifetime of the resolver.
+    """
+
+    def __init__(self, *, arch_triplet, library_paths=(),
+                 ld_so_conf='/etc/ld.so.conf'):
+        self._arch_triplet = arch_triplet
+        self._library_paths = list(library_paths)
+        self._system_paths = _unique(
+            _read_ld_so_conf(ld_so_conf) +
+            [os.path.join(d, arch_triplet) for d in ('/lib', '/usr/lib')] +
+            ['/lib', '/usr/lib', '/lib64', '/usr/lib64'])
+        self._elf_files = {}
+        self._found = {}
+
+    @property
+    def arch_triplet(self):
+        return self._arch_triplet
+
+    @property
+    def search_path(self):
+        """The directories searched for every file, in order."""
+        return tuple(self._library_paths + self._system_paths)
+
+    def get_dependencies(self, elf_file, searched=None):
+        """Return the paths of the libraries elf_file needs to be loaded.
+
+        Libraries needed by those libraries are included, those that can't
+        be found are not.
+
+        :param set searched: if given, the directories from DT_RPATH and
+                             DT_RUNPATH searched, on top of search_path,
+                             are added to it.
+        """
+        found = []
+        # Names of libraries already loaded, mapped to their path.
+        loaded = {}
+        queue = collections.deque([(elf_file, (elf_file,))])
+        while queue:
+            loader, loaders = queue.popleft()
+            search_path = None
+            for name in loader.needed:
+                if name in loaded or self._is_dynamic_linker(name, elf_file):
+                    continue
+                if '/' in name:
+                    path = name
+                else:
+                    if search_path is None:
+                        search_path = self._search_path(loader, loaders,
+                                                        searched)
+                    path = self._find(name, search_path, elf_file.arch)
+                loaded[name] = path
+                library = self._read(path) if path else None
+                if not library:
+                    logger.debug('Unable to find {!r} needed by {!r}'.format(
+                        name, loader.path))
+                    continue
+                found.append(path)
+                if library.soname:
+                    loaded.setdefault(library.soname, path)
+                queue.append((library, (library,) + loaders))
+        return found
+
+    @staticmethod
+    def _is_dynamic_linker(name, elf_file):
+        if elf_file.interp:
+            return name == os.path.basename(elf_file.interp)
+        return _DYNAMIC_LINKER.match(name) is not None
+
+    def _search_path(self, loader, loaders, searched=None):
+        rpath = []
+        if loader.runpath is None:
+            for elf_file in loaders:
+                if elf_file.runpath is None:
+                    rpath.extend(self._expand(elf_file.rpath, elf_file))
+        runpath = []
+        if loader.runpath is not None:
+            runpath = self._expand(loader.runpath, loader)
+        if searched is not None:
+            searched.update(rpath, runpath)
+        return tuple(rpath + self._library_paths + runpath +
+                     self._system_paths)
+
+    def _expand(self, directories, elf_file):
+        origin = os.path.dirname(os.path.abspath(elf_file.path))
+        expanded = []
+        for directory in directories:
+            if not directory:
+                continue
+            for token, value in (('ORIGIN', origin),
+                                 ('LIB', 'lib/' + self._arch_triplet)):
+                directory = directory.replace('${' + token + '}', value)
+                directory = directory.replace('$' + token, value)
+            # Other substitutions depend on the machine running the file.
+            if '$' not in directory:
+                expanded.append(directory)
+        return expanded
+
+    def _find(self, name, search_path, arch):
+        key = (name, search_path, arch)
+        if key not in self._found:
+            self._found[key] = None
+            for directory in search_path:
+                path = os.path.join(directory, name)
+                library = self._read(path)
+                if library and library.arch == arch:
+                    self._found[key] = path
+                    break
+        return self._found[key]
+
+    def _read(self, path):
+        if path not in self._elf_files:
+            try:
+                self._elf_files[path] = read_elf_file(path)
+            except (OSError, errors.CorruptedElfFileError):
+                self._elf_files[path] = None
+        return self._elf_files[path]
+
+
+def _read_ld_so_conf(path):
+    """Return the directories listed in an ld.so.conf file."""
+    directories = []
+    try:
+        with open(path) as f:
+            lines = f.readlines()
+    except OSError:
+        return directories
+
+    for line in lines:
+        line = line.split('#', 1)[0].strip()
+        if line.startswith('include'):
+            pattern = line.split(None, 1)[1] if ' ' in line else ''
+            pattern = os.path.join(os.path.dirname(path), pattern)
+            for include in sorted(glob.glob(pattern)):
+                directories.extend(_read_ld_so_conf(include))
+        elif line and not line.startswith('hwcap'):
+            directories.extend(d for d in re.split(r'[:\s,]', line) if d)
+    return directories
+
+
+def _unique(items):
+    return list(collections.OrderedDict.fromkeys(items))
@@ -148,6 +148,32 @@ class RequiredPathDoesNotExist(SnapcraftError):
     fmt = 'Required path does not exist: {path!r}'
 
 
+class CorruptedElfFileError(SnapcraftError):
+
+    fmt = 'Unable to parse ELF file {path!r}: {message}'
+
+
+class InvalidPackingProfileError(SnapcraftError):
+
+    fmt = 'Unknown packing profile {profile!r}, it must be one of: {profiles}'
+
+
+class InvalidBlockSizeError(SnapcraftError):
+
+    fmt = (
+        'Invalid block size {block_size!r}: it must be a power of 2 between '
+        '4K and 1M, such as 128K'
+    )
+
+
+class InvalidSourceDateEpochError(SnapcraftError):
+
+    fmt = (
+        'Invalid SOURCE_DATE_EPOCH {value!r}: it must be a number of seconds '
+        'since the epoch'
+    )
+
+
 class SnapcraftSchemaError(SnapcraftError):
 
     fmt = '{message}'
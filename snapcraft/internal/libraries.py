@@ -19,7 +19,6 @@ import glob
 import logging
 import os
 import platform
-import subprocess
 
 from snapcraft.internal import common
 
@@ -81,24 +80,23 @@ def _get_system_libs():
     return _libraries
 
 
-def get_dependencies(elf):
+def get_dependencies(elf_file, resolver, searched=None):
     """Return a list of libraries that are needed to satisfy elf's runtime.
 
     This may include libraries contained within the project.
+
+    :param elf_file: a snapcraft.internal.elf.ElfFile.
+    :param resolver: the snapcraft.internal.elf.LibraryResolver finding
+                     the libraries.
+    :param set searched: if given, the directories searched on top of the
+                         resolver's search_path are added to it.
     """
-    logger.debug('Getting dependencies for {!r}'.format(str(elf)))
-    ldd_out = ''
-    try:
-        ldd_out = common.run_output(['ldd', elf]).split('\n')
-    except subprocess.CalledProcessError:
-        logger.warning(
-            'Unable to determine library dependencies for {!r}'.format(elf))
-        return []
-    ldd_out = [l.split() for l in ldd_out]
-    ldd_out = [l[2] for l in ldd_out if len(l) > 2 and os.path.exists(l[2])]
+    logger.debug('Getting dependencies for {!r}'.format(elf_file.path))
+    libs = resolver.get_dependencies(elf_file, searched)
 
     # Now lets filter out what would be on the system
     system_libs = _get_system_libs()
-    libs = [l for l in ldd_out if not os.path.basename(l) in system_libs]
+    libs = [lib for lib in libs
+            if os.path.basename(lib) not in system_libs]
 
     return libs
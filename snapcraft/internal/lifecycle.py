@@ -14,17 +14,19 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import collections
 import contextlib
+import functools
 import logging
 import os
 import shutil
-import tarfile
 import time
-from subprocess import check_call, Popen, PIPE, STDOUT
+from subprocess import check_call, Popen, PIPE, STDOUT, TimeoutExpired
 from tempfile import TemporaryDirectory
 
 import yaml
 from progressbar import AnimatedMarker, ProgressBar
+from tabulate import tabulate
 
 import snapcraft
 from snapcraft import formatting_utils
@@ -35,8 +37,11 @@ from snapcraft.internal import (
     meta,
     pluginhandler,
     repo,
+    scheduler,
+    squashfs,
+    tracing,
 )
-from snapcraft.internal.cache import SnapCache
+from snapcraft.internal.cache import SnapCache, SnapcraftProjectCache
 from snapcraft.internal.indicators import is_dumb_terminal
 from snapcraft.internal.project_loader import replace_attr
 
@@ -108,13 +113,27 @@ def execute(step, project_options, part_names=None):
     :returns: A dict with the snap name, version, type and architectures.
     """
     config = snapcraft.internal.load_config(project_options)
-    repo.Repo.install_build_packages(config.build_tools)
+    if any(part.is_clean('build') for part in config.all_parts):
+        build_tools = config.build_tools
+    else:
+        # Nothing is left to pull or build, so there is no need to load the
+        # plugins to find out what they need to do it.
+        build_tools = config.parts.project_build_tools
+    repo.Repo.install_build_packages(build_tools)
 
     if (os.environ.get('SNAPCRAFT_SETUP_CORE') and
             config.data['confinement'] == 'classic'):
         _setup_core(project_options.deb_arch)
 
-    _Executor(config, project_options).run(step, part_names)
+    indexes = _index_shared_areas(config, project_options)
+    try:
+        _Executor(config, project_options).run(step, part_names)
+    finally:
+        # Remove what was left for steps that didn't run again.
+        for part in config.all_parts:
+            part.clean_deferred()
+        for index in indexes.values():
+            index.save()
 
     return {'name': config.data['name'],
             'version': config.data['version'],
@@ -122,6 +141,27 @@ def execute(step, project_options, part_names=None):
             'type': config.data.get('type', '')}
 
 
+def _index_shared_areas(config, project_options):
+    """Return the ownership index of each step, shared by all the parts.
+
+    The indexes are only updated in memory as parts are staged, primed and
+    cleaned, they need to be saved once done.
+    """
+    indexes = {}
+    for step in ('stage', 'prime'):
+        index = pluginhandler.OwnershipIndex(project_options.parts_dir, step)
+        if not index.exists():
+            # Parts staged or primed by a snapcraft that didn't keep an
+            # index of the files owned by each part are indexed from their
+            # state, once.
+            index.seed(config.get_project_state(step))
+            index.save()
+        indexes[step] = index
+    for part in config.all_parts:
+        part.share_ownership_indexes(indexes)
+    return indexes
+
+
 def _setup_core(deb_arch):
     core_path = common.get_core_path()
     if os.path.exists(core_path) and os.listdir(core_path):
@@ -202,16 +242,126 @@ class _Executor:
 
         step_index = common.COMMAND_ORDER.index(step) + 1
 
-        for step in common.COMMAND_ORDER[0:step_index]:
-            if step == 'stage':
-                pluginhandler.check_for_collisions(self.config.all_parts)
-            for part in parts:
-                if step not in self._steps_run[part.name]:
-                    self._run_step(step, part, part_names)
-                    self._steps_run[part.name].add(step)
+        # Even if parts are built one at a time, downloads are done
+        # concurrently as soon as there is more than one part to pull.
+        parts_to_pull = [p for p in parts
+                         if 'pull' not in self._steps_run[p.name]]
+        if (self.project_options.parallel_part_count > 1 or
+                len(parts_to_pull) > 1):
+            self._run_parallel(
+                common.COMMAND_ORDER[0:step_index], parts, part_names)
+        else:
+            for step in common.COMMAND_ORDER[0:step_index]:
+                if step == 'stage':
+                    pluginhandler.check_for_collisions(self.config.all_parts)
+                for part in parts:
+                    if step not in self._steps_run[part.name]:
+                        self._run_step(step, part, part_names)
+                        self._steps_run[part.name].add(step)
 
         self._create_meta(step, part_names)
 
+    def _run_parallel(self, steps, parts, part_names):
+        """Run steps for parts concurrently, following the after graph.
+
+        pull and build run in child processes, up to parallel_part_count
+        builds at a time. stage and prime share the staging and priming
+        areas so they run in this process, one part at a time.
+
+        Sources and stage-packages of the parts to pull are fetched right
+        away, up to parallel_fetch_count at a time, so that downloads
+        overlap with builds. This is also used with a single build at a time
+        when there is more than one part to pull.
+
+        A part starts once its prerequisites are staged, prerequisites are
+        staged as soon as they are built. Every other part is staged once
+        all builds are done and primed once all parts are staged, as it
+        would be when running serially.
+        """
+        parts_steps = self._get_parallel_steps(steps, parts, part_names)
+        prereqs = {name: self.parts_config.get_prereqs(name)
+                   for name in parts_steps}
+        needed_by_others = set().union(*prereqs.values())
+
+        jobs = scheduler.Scheduler({
+            'fetch': self.project_options.parallel_fetch_count,
+            'pull': self.project_options.parallel_fetch_count,
+            'build': self.project_options.parallel_part_count,
+        })
+        build_jobs = {(name, 'build') for name in parts_steps}
+        stage_jobs = {(name, 'stage') for name in parts_steps}
+        for part in self.config.all_parts:
+            if part.name not in parts_steps:
+                continue
+            requires = {(p, 'stage') for p in prereqs[part.name]}
+            if 'pull' in parts_steps[part.name]:
+                jobs.add((part.name, 'fetch'), part.prefetch, pool='fetch',
+                         on_done=part.mark_prefetched)
+                requires.add((part.name, 'fetch'))
+            for step in parts_steps[part.name]:
+                if step == 'stage' and part.name not in needed_by_others:
+                    requires |= build_jobs
+                elif step == 'prime':
+                    requires |= stage_jobs
+                jobs.add((part.name, step),
+                         functools.partial(self._run_parallel_step,
+                                           step, part, part_names),
+                         requires=requires,
+                         pool=step if step in ('pull', 'build') else None,
+                         on_done=functools.partial(
+                             self._mark_step_run, part, step))
+                requires = {(part.name, step)}
+
+        jobs.run()
+
+    def _mark_step_run(self, part, step, result=None):
+        if step in ('pull', 'build'):
+            # The step ran in a child process.
+            part.reload_states()
+        self._steps_run[part.name].add(step)
+
+    def _get_parallel_steps(self, steps, parts, part_names):
+        parts_steps = collections.OrderedDict()
+        for part in parts:
+            parts_steps[part.name] = steps
+
+        # Prerequisites need to make it to the stage step regardless of
+        # the step requested.
+        names = list(parts_steps)
+        stage_steps = common.COMMAND_ORDER[
+            0:common.COMMAND_ORDER.index('stage') + 1]
+        while names:
+            name = names.pop()
+            prereqs = self.parts_config.get_prereqs(name)
+            unstaged_prereqs = {p for p in prereqs
+                                if 'stage' not in self._steps_run[p]}
+            if not unstaged_prereqs.issubset(part_names):
+                raise RuntimeError(
+                    'Requested {!r} of {!r} but there are unsatisfied '
+                    'prerequisites: {!r}'.format(
+                        steps[-1], name, ' '.join(
+                            p for p in self.config.part_names
+                            if p in unstaged_prereqs - set(part_names))))
+            for prereq in unstaged_prereqs:
+                if len(parts_steps.get(prereq, [])) < len(stage_steps):
+                    parts_steps[prereq] = stage_steps
+                    names.append(prereq)
+
+        for name in parts_steps:
+            parts_steps[name] = [s for s in parts_steps[name]
+                                 if s not in self._steps_run[name]]
+        return parts_steps
+
+    def _run_parallel_step(self, step, part, part_names):
+        if step == 'stage':
+            # Parts still pulled or built in child processes own their
+            # install directories and file indexes, they are checked once
+            # they are built.
+            pluginhandler.check_for_collisions(
+                [p for p in self.config.all_parts
+                 if 'build' in self._steps_run[p.name]])
+        self._run_step(step, part, part_names)
+
     def _run_step(self, step, part, part_names):
         common.reset_env()
         prereqs = self.parts_config.get_prereqs(part.name)
@@ -235,21 +385,24 @@ class _Executor:
                 '{}'.format(part.name, ' '.join(unstaged_prereqs)))
             self.run('stage', unstaged_prereqs)
 
-        # Run the preparation function for this step (if implemented)
-        with contextlib.suppress(AttributeError):
-            getattr(part, 'prepare_{}'.format(step))()
+        with tracing.span('{} {}'.format(step, part.name), 'step',
+                          part=part.name, step=step):
+            # Run the preparation function for this step (if implemented)
+            with contextlib.suppress(AttributeError):
+                getattr(part, 'prepare_{}'.format(step))()
 
-        common.env = self.parts_config.build_env_for_part(part)
-        common.env.extend(self.config.project_env())
+            common.env = self.parts_config.build_env_for_part(part)
+            common.env.extend(self.config.project_env())
 
-        part = _replace_in_part(part)
-        getattr(part, step)()
+            part = _replace_in_part(part)
+            getattr(part, step)()
 
     def _create_meta(self, step, part_names):
         if step == 'prime' and part_names == self.config.part_names:
             common.env = self.config.snap_env()
-            meta.create_snap_packaging(self.config.data,
-                                       self.project_options)
+            with tracing.span('create snap packaging'):
+                meta.create_snap_packaging(self.config.data,
+                                           self.project_options)
 
     def _handle_dirty(self, part, step, dirty_report):
         if step not in _STEPS_TO_AUTOMATICALLY_CLEAN_IF_DIRTY:
@@ -283,9 +436,6 @@ class _Executor:
                     step, part.name))
             raise RuntimeError(''.join(message_components))
 
-        staged_state = self.config.get_project_state('stage')
-        primed_state = self.config.get_project_state('prime')
-
         # We need to clean this step, but if it involves cleaning the stage
         # step and it has dependents that have been built, we need to ask for
         # them to first be cleaned (at least back to the build step).
@@ -308,7 +458,8 @@ class _Executor:
                             step, part.name, humanized_parts,
                             pluralized_depends))
 
-        part.clean(staged_state, primed_state, step, '(out of date)')
+        # The step runs again right away, only what changed is migrated.
+        part.clean(step=step, hint='(out of date)', deferred=True)
 
 
 def _create_tar_filter(tar_filename):
@@ -324,17 +475,19 @@ def _create_tar_filter(tar_filename):
     return _tar_filter
 
 
-def cleanbuild(project_options, remote=''):
+def cleanbuild(project_options, remote='', *, cached_image=False):
     config = snapcraft.internal.load_config(project_options)
-    tar_filename = '{}_{}_source.tar.bz2'.format(
+    build_packages = config.build_tools if cached_image else ()
+    # Left by cleanbuild before the project was streamed.
+    tar_filename = './{}_{}_source.tar.bz2'.format(
         config.data['name'], config.data['version'])
 
-    with tarfile.open(tar_filename, 'w:bz2') as t:
-        t.add(os.path.curdir, filter=_create_tar_filter(tar_filename))
-
     snap_filename = common.format_snap_name(config.data)
-    lxd.Cleanbuilder(snap_filename, tar_filename, project_options,
-                     remote=remote).execute()
+    lxd.Cleanbuilder(snap_filename, os.getcwd(), project_options,
+                     remote=remote,
+                     tar_filter=_create_tar_filter(tar_filename),
+                     cached_image=cached_image,
+                     build_packages=build_packages).execute()
 
 
 def _snap_data_from_dir(directory):
@@ -347,7 +500,7 @@ def _snap_data_from_dir(directory):
             'type': snap.get('type', '')}
 
 
-def snap(project_options, directory=None, output=None):
+def _get_snap_dir(project_options, directory):
     if directory:
         snap_dir = os.path.abspath(directory)
         snap = _snap_data_from_dir(snap_dir)
@@ -356,6 +509,20 @@ def snap(project_options, directory=None, output=None):
         snap_dir = project_options.snap_dir
         snap = execute('prime', project_options)
 
+    return snap_dir, snap
+
+
+def snap(project_options, directory=None, output=None, *,
+         profile=squashfs.DEFAULT_PROFILE, processors=None, block_size=None,
+         reproducible=False):
+    # Fail on invalid packing options before priming.
+    squashfs.get_mksquashfs_args(
+        profile=profile, processors=processors, block_size=block_size)
+    timestamp = squashfs.get_source_date_epoch() if reproducible else None
+    snap_dir, snap = _get_snap_dir(project_options, directory)
+    if reproducible:
+        packing_order = squashfs.PackingOrder(_get_packing_order_file(snap))
+
     snap_name = output or common.format_snap_name(snap)
 
     # If a .snap-build exists at this point, when we are about to override
@@ -367,45 +534,152 @@ def snap(project_options, directory=None, output=None):
         logger.warning('Renaming stale build assertion to {}'.format(_new))
         os.rename(snap_build, _new)
 
-    # These options need to match the review tools:
-    # http://bazaar.launchpad.net/~click-reviewers/click-reviewers-tools/trunk/view/head:/clickreviews/common.py#L38
-    mksquashfs_args = ['-noappend', '-comp', 'xz', '-no-xattrs']
-    if snap['type'] != 'os':
-        mksquashfs_args.append('-all-root')
+    if profile != squashfs.DEFAULT_PROFILE:
+        logger.warning(
+            'Packing with the {!r} profile, the store only accepts snaps '
+            'packed with the {!r} one.'.format(
+                profile, squashfs.DEFAULT_PROFILE))
+
+    with TemporaryDirectory() as temp_dir:
+        if reproducible:
+            sort_file = os.path.join(temp_dir, 'sort')
+            version = _get_reproducible_mksquashfs_version()
+            packing_order.write_sort_file(snap_dir, sort_file)
+            env = os.environ.copy()
+            env['SOURCE_DATE_EPOCH'] = str(timestamp)
+        else:
+            sort_file = version = env = None
+
+        mksquashfs_args = squashfs.get_mksquashfs_args(
+            profile=profile, snap_type=snap['type'], processors=processors,
+            block_size=block_size, timestamp=timestamp, sort_file=sort_file,
+            version=version)
+
+        ret, output = _run_mksquashfs(
+            snap_dir, snap_name, mksquashfs_args,
+            'Snapping {!r}'.format(snap['name']), env=env)
+        if ret == 0 and reproducible:
+            packing_order.save()
+    if ret != 0:
+        logger.error(output)
+        raise RuntimeError('Failed to create snap {!r}'.format(snap_name))
+
+    logger.debug(output)
+
+    logger.info('Snapped {}'.format(snap_name))
+    return snap_name
+
 
-    with Popen(['mksquashfs', snap_dir, snap_name] + mksquashfs_args,
-               stdout=PIPE, stderr=STDOUT) as proc:
-        ret = None
+def _get_reproducible_mksquashfs_version():
+    version = squashfs.get_mksquashfs_version()
+    if not squashfs.is_reproducible(version):
+        logger.warning(
+            'mksquashfs {} cannot set the time of the files it packs, use '
+            'squashfs-tools 4.4 or later for a reproducible snap.'.format(
+                '.'.join(str(n) for n in version) or '(unknown version)'))
+    return version
+
+
+def _get_packing_order_file(snap):
+    # Snaps of the same project for different architectures have different
+    # files, each keeps its own order. format_snap_name() works out the
+    # architecture in the name of the snap, on a copy as it changes it.
+    snap = snap.copy()
+    common.format_snap_name(snap)
+    return os.path.join(
+        SnapcraftProjectCache(project_name=snap['name']).project_cache_root,
+        'packing_order', '{}.json'.format(snap['arch']))
+
+
+def _run_mksquashfs(snap_dir, snap_name, mksquashfs_args, message, env=None):
+    mksquashfs_command = ['mksquashfs', snap_dir, snap_name] + mksquashfs_args
+    # Only pass env when set, so mksquashfs otherwise runs like any other
+    # command.
+    kwargs = {'env': env} if env else {}
+    with tracing.process(mksquashfs_command), \
+            Popen(mksquashfs_command, stdout=PIPE, stderr=STDOUT,
+                  **kwargs) as proc:
         if is_dumb_terminal():
-            logger.info('Snapping {!r} ...'.format(snap['name']))
-            ret = proc.wait()
+            logger.info('{} ...'.format(message))
+            output = proc.communicate()[0]
         else:
-            message = '\033[0;32m\rSnapping {!r}\033[0;32m '.format(
-                snap['name'])
+            message = '\033[0;32m\r{}\033[0;32m '.format(message)
             progress_indicator = ProgressBar(
                 widgets=[message, AnimatedMarker()], maxval=7)
             progress_indicator.start()
 
-            ret = proc.poll()
             count = 0
-
-            while ret is None:
+            while True:
+                # Waiting on the output rather than sleeping returns as soon
+                # as mksquashfs is done, and keeps reading what it prints so
+                # that it never blocks on a full pipe.
+                try:
+                    output = proc.communicate(timeout=.2)[0]
+                    break
+                except TimeoutExpired:
+                    pass
                 if count >= 7:
                     progress_indicator.start()
                     count = 0
                 progress_indicator.update(count)
                 count += 1
-                time.sleep(.2)
-                ret = proc.poll()
         print('')
-        if ret != 0:
-            logger.error(proc.stdout.read().decode('utf-8'))
-            raise RuntimeError('Failed to create snap {!r}'.format(snap_name))
 
-        logger.debug(proc.stdout.read().decode('utf-8'))
+    return proc.returncode, output.decode('utf-8')
 
-    logger.info('Snapped {}'.format(snap_name))
-    return snap_name
+
+def compression_report(project_options, directory=None, *, processors=None,
+                       block_size=None):
+    """Pack the snap with each profile, then report their size and time.
+
+    :returns: the profile, compression, size in bytes, ratio to the size of
+              the files packed and seconds taken for each profile.
+    :rtype: list
+    """
+    # Fail on invalid packing options before priming.
+    squashfs.get_mksquashfs_args(processors=processors,
+                                 block_size=block_size)
+    snap_dir, snap = _get_snap_dir(project_options, directory)
+    unpacked_size = _get_directory_size(snap_dir)
+
+    report = []
+    with TemporaryDirectory() as temp_dir:
+        for profile, profile_info in squashfs.PROFILES.items():
+            mksquashfs_args = squashfs.get_mksquashfs_args(
+                profile=profile, snap_type=snap['type'],
+                processors=processors, block_size=block_size)
+            snap_name = os.path.join(temp_dir, '{}.snap'.format(profile))
+            start = time.monotonic()
+            ret, output = _run_mksquashfs(
+                snap_dir, snap_name, mksquashfs_args,
+                'Packing {!r} with the {!r} profile'.format(
+                    snap['name'], profile))
+            seconds = time.monotonic() - start
+            if ret != 0:
+                logger.error(output)
+                raise RuntimeError(
+                    'Failed to pack {!r} with the {!r} profile'.format(
+                        snap['name'], profile))
+            size = os.path.getsize(snap_name)
+            report.append((profile, profile_info.description, size,
+                           size / unpacked_size if unpacked_size else 0,
+                           seconds))
+
+    print(tabulate(
+        [(profile, description, '{:.1f} MB'.format(size / 1000000),
+          '{:.1%}'.format(ratio), '{:.1f}s'.format(seconds))
+         for profile, description, size, ratio, seconds in report],
+        headers=['Profile', 'Compression', 'Size', 'Ratio', 'Time'],
+        tablefmt='plain'))
+    return report
+
+
+def _get_directory_size(directory):
+    size = 0
+    for root, _, files in os.walk(directory):
+        for name in files:
+            size += os.lstat(os.path.join(root, name)).st_size
+    return size
 
 
 def _reverse_dependency_tree(config, part_name):
@@ -418,18 +692,17 @@ def _reverse_dependency_tree(config, part_name):
     return dependents
 
 
-def _clean_part_and_all_dependents(part_name, step, config, staged_state,
-                                   primed_state):
+def _clean_part_and_all_dependents(part_name, step, config, deferred):
     # Obtain the reverse dependency tree for this part. Make sure all
     # dependents are cleaned.
     dependents = _reverse_dependency_tree(config, part_name)
     dependent_parts = {p for p in config.all_parts
                        if p.name in dependents}
     for dependent_part in dependent_parts:
-        dependent_part.clean(staged_state, primed_state, step)
+        dependent_part.clean(step=step, deferred=deferred)
 
     # Finally, clean the part in question
-    config.parts.clean_part(part_name, staged_state, primed_state, step)
+    config.parts.clean_part(part_name, step, deferred=deferred)
 
 
 def _verify_dependents_will_be_cleaned(part_name, clean_part_names, step,
@@ -451,7 +724,7 @@ def _verify_dependents_will_be_cleaned(part_name, clean_part_names, step,
                                        's' if len(dependents) == 1 else ''))
 
 
-def _clean_parts(part_names, step, config, staged_state, primed_state):
+def _clean_parts(part_names, step, config, deferred=False):
     if not step:
         step = 'pull'
 
@@ -462,8 +735,7 @@ def _clean_parts(part_names, step, config, staged_state, primed_state):
 
     # Now we can actually clean.
     for part_name in part_names:
-        _clean_part_and_all_dependents(
-            part_name, step, config, staged_state, primed_state)
+        _clean_part_and_all_dependents(part_name, step, config, deferred)
 
 
 def _remove_directory_if_empty(directory):
@@ -495,13 +767,13 @@ def _cleanup_common_directories_for_step(step, project_options, parts=None):
         # Remove the priming area.
         _cleanup_common(
             project_options.snap_dir, 'prime', 'Cleaning up priming area',
-            parts)
+            parts, project_options.parts_dir)
 
     if index <= common.COMMAND_ORDER.index('stage'):
         # Remove the staging area.
         _cleanup_common(
             project_options.stage_dir, 'stage', 'Cleaning up staging area',
-            parts)
+            parts, project_options.parts_dir)
 
     if index <= common.COMMAND_ORDER.index('pull'):
         # Remove the parts directory (but leave local plugins alone).
@@ -514,11 +786,13 @@ def _cleanup_common_directories_for_step(step, project_options, parts=None):
     _remove_directory_if_empty(project_options.parts_dir)
 
 
-def _cleanup_common(directory, step, message, parts):
+def _cleanup_common(directory, step, message, parts, parts_dir):
     if os.path.isdir(directory):
         logger.info(message)
         shutil.rmtree(directory)
+    pluginhandler.OwnershipIndex(parts_dir, step).clear()
     for part in parts:
+        part.clean_deferred(step)
         part.mark_cleaned(step)
 
 
@@ -537,7 +811,7 @@ def _cleanup_parts_dir(parts_dir, local_plugins_dir, parts):
         part.mark_cleaned('pull')
 
 
-def clean(project_options, parts, step=None):
+def clean(project_options, parts, step=None, *, from_scratch=False):
     # step defaults to None because that's how it comes from docopt when it's
     # not set.
     if not step:
@@ -562,9 +836,18 @@ def clean(project_options, parts, step=None):
     else:
         parts = [part.name for part in config.all_parts]
 
-    staged_state = config.get_project_state('stage')
-    primed_state = config.get_project_state('prime')
-
-    _clean_parts(parts, step, config, staged_state, primed_state)
-
-    _cleanup_common_directories(config, project_options)
+    # Unless asked to start from scratch, the parts are built again on top
+    # of what was built, and only what changed is staged and primed again,
+    # see PluginHandler.clean(). The staging and priming areas are then kept
+    # as they are.
+    deferred = step == 'build' and not from_scratch
+
+    indexes = _index_shared_areas(config, project_options)
+    try:
+        _clean_parts(parts, step, config, deferred)
+    finally:
+        for index in indexes.values():
+            index.save()
+
+    if not deferred:
+        _cleanup_common_directories(config, project_options)
@@ -15,17 +15,32 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import calendar
+import hashlib
 import logging
 import os
+import re
 import sys
-from contextlib import contextmanager
-from subprocess import check_call, check_output, CalledProcessError
+import tarfile
+import time
+from contextlib import contextmanager, suppress
+from subprocess import (
+    check_call,
+    check_output,
+    CalledProcessError,
+    Popen,
+    PIPE,
+)
 from time import sleep
 
 import petname
 
+import snapcraft
 from snapcraft.internal.errors import SnapcraftEnvironmentError
-from snapcraft.internal import cache
+from snapcraft.internal import (
+    cache,
+    repo,
+)
 
 
 logger = logging.getLogger(__name__)
@@ -33,22 +48,44 @@ logger = logging.getLogger(__name__)
 _NETWORK_PROBE_COMMAND = \
     'import urllib.request; urllib.request.urlopen("{}", timeout=5)'.format(
         'http://start.ubuntu.com/connectivity-check.html')
+# Prints the apt sources of the container as snapcraft reads them there.
+_LOCAL_SOURCES_COMMAND = (
+    'import glob, sys; '
+    'paths = glob.glob("/etc/apt/sources.list.d/*.list"); '
+    'paths.append("/etc/apt/sources.list"); '
+    '[sys.stdout.buffer.write(open(p, "rb").read()) for p in paths]')
 _PROXY_KEYS = ['http_proxy', 'https_proxy', 'no_proxy', 'ftp_proxy']
+# The network is probed every second for this many seconds.
+_NETWORK_PROBE_RETRIES = 25
+# Cached images are prepared again once older than this many seconds, and
+# their package lists are updated before building once older than a day.
+_IMAGE_MAX_AGE = 7 * 24 * 60 * 60
+_IMAGE_UPDATE_AGE = 24 * 60 * 60
 
 
 class Cleanbuilder:
 
-    def __init__(self, snap_output, tar_filename, project_options,
-                 remote=None):
+    def __init__(self, snap_output, project_dir, project_options,
+                 remote=None, *, tar_filter=None, cached_image=False,
+                 build_packages=()):
         self._snap_output = snap_output
-        self._tar_filename = tar_filename
+        self._project_dir = project_dir
+        self._tar_filter = tar_filter
         self._project_options = project_options
+        self._build_packages = sorted(set(build_packages))
         container_name = 'snapcraft-{}'.format(petname.Generate(3, '-'))
 
         if not remote:
             remote = _get_default_remote()
         _verify_remote(remote)
+        self._remote = remote
         self._container_name = '{}:{}'.format(remote, container_name)
+        if cached_image:
+            self._cached_image = '{}:{}'.format(remote, _get_image_alias(
+                self._project_options.deb_arch, self._build_packages))
+        else:
+            self._cached_image = None
+        self._image_age = None
 
     def _push_file(self, src, dst):
         check_call(['lxc', 'file', 'push',
@@ -61,13 +98,37 @@ class Cleanbuilder:
     def _container_run(self, cmd):
         check_call(['lxc', 'exec', self._container_name, '--'] + cmd)
 
+    def _push_tree(self, src, dst, tar_filter=None, arcname=os.path.curdir):
+        # The tree is streamed into tar in the container, nothing is written
+        # to disk on either end before it is extracted. It is not compressed
+        # as packing it would take longer than transferring it.
+        cmd = ['lxc', 'exec', self._container_name, '--',
+               'tar', 'xf', '-', '-C', dst]
+        proc = Popen(cmd, stdin=PIPE)
+        try:
+            with tarfile.open(fileobj=proc.stdin, mode='w|') as tar:
+                tar.add(src, arcname=arcname, filter=tar_filter)
+            # Closing flushes what is left, which tar may not read either.
+            proc.stdin.close()
+        except BrokenPipeError:
+            # tar exited early, its return code tells why.
+            with suppress(BrokenPipeError):
+                proc.stdin.close()
+        returncode = proc.wait()
+        if returncode != 0:
+            raise CalledProcessError(returncode, cmd)
+
+    def _get_base_image(self):
+        return 'ubuntu:xenial/{}'.format(self._project_options.deb_arch)
+
     @contextmanager
     def _create_container(self):
+        image = self._get_base_image()
+        if self._cached_image:
+            self._image_age = self._ensure_cached_image()
+            image = self._cached_image
         try:
-            check_call([
-                'lxc', 'launch', '-e',
-                'ubuntu:xenial/{}'.format(self._project_options.deb_arch),
-                self._container_name])
+            check_call(['lxc', 'launch', '-e', image, self._container_name])
             check_call([
                 'lxc', 'config', 'set', self._container_name,
                 'environment.SNAPCRAFT_SETUP_CORE', '1'])
@@ -77,12 +138,67 @@ class Cleanbuilder:
             print('Stopping {}'.format(self._container_name))
             check_call(['lxc', 'stop', '-f', self._container_name])
 
+    def _ensure_cached_image(self):
+        """Publish the cached image if missing or too old.
+
+        :returns: the age of the image in seconds, None if unknown.
+        """
+        try:
+            info = check_output(['lxc', 'image', 'info', self._cached_image])
+        except CalledProcessError:
+            info = None
+
+        if info is not None:
+            age = _get_image_age(info.decode(sys.getfilesystemencoding()))
+            if age is None or age < _IMAGE_MAX_AGE:
+                return age
+            logger.info('The {} image is {} days old'.format(
+                self._cached_image, int(age // (24 * 60 * 60))))
+
+        logger.info('Preparing the {} image to build in'.format(
+            self._cached_image))
+        # Containers are launched from the image as ephemeral ones, each
+        # build starts from the image as it was published.
+        check_call(
+            ['lxc', 'launch', self._get_base_image(), self._container_name])
+        try:
+            self._wait_for_network()
+            self._install_snapcraft()
+            if self._build_packages:
+                try:
+                    self._container_run(
+                        ['apt-get', 'install', '-y'] + self._build_packages)
+                except CalledProcessError:
+                    # Some may come from sources only added by the parts,
+                    # snapcraft installs them when building.
+                    logger.warning(
+                        'Could not install the build packages in the image.')
+            check_call(['lxc', 'stop', self._container_name])
+            if info is not None:
+                # The alias is taken by the old image.
+                check_call(['lxc', 'image', 'delete', self._cached_image])
+            check_call(['lxc', 'publish', self._container_name,
+                        '{}:'.format(self._remote),
+                        '--alias', self._cached_image.split(':', 1)[1]])
+        finally:
+            check_call(['lxc', 'delete', '-f', self._container_name])
+
+        return 0
+
+    def _install_snapcraft(self):
+        self._container_run(['apt-get', 'update'])
+        self._container_run(['apt-get', 'install', 'snapcraft', '-y'])
+
     def execute(self):
         with self._create_container():
             self._setup_project()
             self._wait_for_network()
-            self._container_run(['apt-get', 'update'])
-            self._container_run(['apt-get', 'install', 'snapcraft', '-y'])
+            if not self._cached_image:
+                self._install_snapcraft()
+            elif self._image_age is None or (
+                    self._image_age > _IMAGE_UPDATE_AGE):
+                # For the build packages of the parts to be up to date.
+                self._container_run(['apt-get', 'update'])
             try:
                 self._container_run(
                     ['snapcraft', 'snap', '--output', self._snap_output])
@@ -97,23 +213,26 @@ class Cleanbuilder:
 
     def _setup_project(self):
         logger.info('Setting up container with project assets')
-        dst = os.path.join('/root', os.path.basename(self._tar_filename))
-        self._push_file(self._tar_filename, dst)
-        self._container_run(['tar', 'xvf', dst])
+        self._push_tree(self._project_dir, '/root', self._tar_filter)
 
         logger.info('Copying snapcraft cache into container')
+        # Only the stage-packages fetched with the apt sources of the
+        # container are of use there.
+        sources = check_output(['lxc', 'exec', self._container_name, '--',
+                                'python3', '-c', _LOCAL_SOURCES_COMMAND])
+        stage_package_cache = cache.AptStagePackageCache(
+            sources_digest=repo.get_sources_digest(
+                sources.decode(sys.getfilesystemencoding())),
+            create=False)
+        if not os.path.isdir(stage_package_cache.base_dir):
+            return
         snapcraft_cache = cache.SnapcraftCache()
-        # Later versions have a `push --recursive`. For now we have to do it
-        # the hard way and walk the cache ourselves.
-        for root, dirs, files in os.walk(snapcraft_cache.cache_root):
-            destination_root = os.path.join(
-                '/root', '.cache', 'snapcraft', os.path.relpath(
-                    root, snapcraft_cache.cache_root))
-            self._container_run(['mkdir', '-p', destination_root])
-            for file_path in files:
-                source = os.path.join(root, file_path)
-                destination = os.path.join(destination_root, file_path)
-                self._push_file(source, destination)
+        # tar creates the directories leading to it.
+        self._push_tree(
+            stage_package_cache.base_dir, '/root', arcname=os.path.join(
+                '.cache', 'snapcraft', os.path.relpath(
+                    stage_package_cache.base_dir,
+                    snapcraft_cache.cache_root)))
 
     def _pull_snap(self):
         src = os.path.join('/root', self._snap_output)
@@ -122,20 +241,50 @@ class Cleanbuilder:
 
     def _wait_for_network(self):
         logger.info('Waiting for a network connection...')
-        not_connected = True
-        retry_count = 5
-        while not_connected:
-            sleep(5)
+        retry_count = _NETWORK_PROBE_RETRIES
+        while True:
+            # The network is often up by the time the container is set up,
+            # it is probed before waiting.
             try:
                 self._container_run(['python3', '-c', _NETWORK_PROBE_COMMAND])
-                not_connected = False
+                break
             except CalledProcessError as e:
                 retry_count -= 1
                 if retry_count == 0:
                     raise e
+            sleep(1)
         logger.info('Network connection established')
 
 
+def _get_image_alias(deb_arch, build_packages):
+    """Return the alias of the image cleanbuilds can be cached in.
+
+    :param str deb_arch: the architecture of the image.
+    :param list build_packages: the packages installed in the image.
+    :returns: an alias unique to the version of snapcraft, deb_arch and
+              build_packages.
+    :rtype: string.
+    """
+    digest = hashlib.sha256(
+        ' '.join(sorted(build_packages)).encode('utf-8')).hexdigest()
+    version = re.sub(r'[^\w.-]', '-', snapcraft.__version__)
+    return 'snapcraft-{}-xenial-{}-{}'.format(version, deb_arch, digest[:12])
+
+
+def _get_image_age(image_info):
+    """Return the age of an image.
+
+    :param str image_info: the output of `lxc image info`.
+    :returns: the age of the image in seconds, None if it is not listed.
+    """
+    match = re.search(r'^Created: (\d+/\d+/\d+ \d+:\d+) UTC$', image_info,
+                      re.MULTILINE)
+    if not match:
+        return None
+    created = calendar.timegm(time.strptime(match.group(1), '%Y/%m/%d %H:%M'))
+    return time.time() - created
+
+
 def _get_default_remote():
     """Query and return the default lxd remote.
 
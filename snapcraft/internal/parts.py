@@ -158,7 +158,7 @@ class PartsConfig:
         self._parts_data = parts.get('parts', {})
         self._project_options = project_options
         self._validator = validator
-        self.build_tools = build_tools
+        self._build_tools = build_tools
         self._snapcraft_yaml = snapcraft_yaml
 
         self.all_parts = []
@@ -171,6 +171,28 @@ class PartsConfig:
     def part_names(self):
         return self._part_names
 
+    @property
+    def build_tools(self):
+        """The packages needed to pull and build the parts.
+
+        This loads the code of the plugins of all the parts.
+        """
+        build_tools = list(self._build_tools)
+        for part_name in self._part_names:
+            part = self.get_part(part_name)
+            build_tools += part.code.build_packages
+            if part.source_handler and part.source_handler.command:
+                build_tools.append(
+                    repo.Repo.get_packages_for_source_type(
+                        part.source_handler.command))
+
+        return build_tools
+
+    @property
+    def project_build_tools(self):
+        """The packages the project itself declares are needed to build."""
+        return list(self._build_tools)
+
     def _process_parts(self):
         for part_name in self._parts_data:
             if '/' in part_name:
@@ -253,9 +275,9 @@ class PartsConfig:
 
         return None
 
-    def clean_part(self, part_name, staged_state, primed_state, step):
+    def clean_part(self, part_name, step, deferred=False):
         part = self.get_part(part_name)
-        part.clean(staged_state, primed_state, step)
+        part.clean(step=step, deferred=deferred)
 
     def validate(self, part_names):
         for part_name in part_names:
@@ -273,11 +295,6 @@ class PartsConfig:
             part_schema=self._validator.part_schema,
             definitions_schema=self._validator.definitions_schema)
 
-        self.build_tools += part.code.build_packages
-        if part.source_handler and part.source_handler.command:
-            self.build_tools.append(
-                repo.Repo.get_packages_for_source_type(
-                    part.source_handler.command))
         self.all_parts.append(part)
 
         return part
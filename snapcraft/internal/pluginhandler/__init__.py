@@ -17,20 +17,23 @@
 import contextlib
 import copy
 import filecmp
+import hashlib
 import importlib
+import inspect
+import json
 import logging
 import os
 import shutil
+import stat
 import sys
 from glob import glob, iglob
 
 import jsonschema
-import magic
-import yaml
 
 import snapcraft
 from snapcraft import file_utils
 from snapcraft.internal.errors import (
+    CorruptedElfFileError,
     PrimeFileConflictError,
     PluginError,
     MissingState,
@@ -38,14 +41,22 @@ from snapcraft.internal.errors import (
     SnapcraftSchemaError
 )
 from snapcraft.internal import (
+    cache,
     common,
+    elf,
     libraries,
     repo,
     sources,
     states,
+    tracing,
 )
 from ._scriptlets import ScriptRunner
 from ._build_attributes import BuildAttributes
+from ._dependency_cache import DependencyCache
+from ._file_index import FileIndex
+from ._file_migrator import FileMigrator
+from ._fileset import FilesetMatcher
+from ._ownership_index import OwnershipIndex
 from ._stage_package_handler import StagePackageHandler
 
 logger = logging.getLogger(__name__)
@@ -67,16 +78,68 @@ class PluginHandler:
     def installdir(self):
         return self.code.installdir
 
+    @property
+    def file_index(self):
+        """The index of the files in installdir, see FileIndex."""
+        if (self.__file_index is None or
+                self.__file_index.root != self.installdir):
+            self.__file_index = FileIndex(
+                self.installdir,
+                os.path.join(self._partdir, 'file-index.json'))
+        return self.__file_index
+
+    @property
+    def code(self):
+        """The plugin, its code is loaded the first time it's needed."""
+        if self._code is None:
+            try:
+                self._load_code(
+                    self._plugin_name, self._part_properties,
+                    self._part_schema, self._definitions_schema)
+            except jsonschema.ValidationError as e:
+                error = SnapcraftSchemaError.from_validation_error(e)
+                raise PluginError(
+                    'properties failed to load for {}: {}'.format(
+                        self.name, error.message))
+
+        return self._code
+
+    @code.setter
+    def code(self, code):
+        self._code = code
+
+    @property
+    def _stage_package_handler(self):
+        if self.__stage_package_handler is None:
+            stage_packages = getattr(self.code, 'stage_packages', [])
+            sources = getattr(self.code, 'PLUGIN_STAGE_SOURCES', None)
+            self.__stage_package_handler = StagePackageHandler(
+                stage_packages, self.ubuntudir,
+                sources=sources, project_options=self._project_options)
+
+        return self.__stage_package_handler
+
     def __init__(self, *, plugin_name, part_name,
                  part_properties, project_options, part_schema,
                  definitions_schema):
         self.valid = False
-        self.code = None
+        self._code = None
+        self.__stage_package_handler = None
+        self.__file_index = None
+        # Filesets by step, they only change along with the steps' states.
+        self._migratable_filesets = {}
+        # Ownership indexes by step shared with the other parts, see
+        # share_ownership_indexes().
+        self._ownership_indexes = {}
+        self._plugin_name = plugin_name
+        self._part_schema = part_schema
+        self._definitions_schema = definitions_schema
         self.config = {}
         self._name = part_name
         self._part_properties = _expand_part_properties(
             part_properties, part_schema)
         self.stage_packages = []
+        self._prefetched = False
 
         # Some legacy parts can have a '/' in them to separate the main project
         # part with the subparts. This is rather unfortunate as it affects the
@@ -90,8 +153,10 @@ class PluginHandler:
         self.snapdir = project_options.snap_dir
 
         parts_dir = project_options.parts_dir
+        self._partdir = os.path.join(parts_dir, part_name)
         self.ubuntudir = os.path.join(parts_dir, part_name, 'ubuntu')
         self.statedir = os.path.join(parts_dir, part_name, 'state')
+        self._states = states.PartStates(self.statedir)
         self.sourcedir = os.path.join(parts_dir, part_name, 'src')
 
         self.source_handler = self._get_source_handler(self._part_properties)
@@ -101,21 +166,6 @@ class PluginHandler:
 
         self._migrate_state_file()
 
-        try:
-            self._load_code(
-                plugin_name, self._part_properties, part_schema,
-                definitions_schema)
-        except jsonschema.ValidationError as e:
-            error = SnapcraftSchemaError.from_validation_error(e)
-            raise PluginError('properties failed to load for {}: {}'.format(
-                part_name, error.message))
-
-        stage_packages = getattr(self.code, 'stage_packages', [])
-        sources = getattr(self.code, 'PLUGIN_STAGE_SOURCES', None)
-        self._stage_package_handler = StagePackageHandler(
-            stage_packages, self.ubuntudir,
-            sources=sources, project_options=self._project_options)
-
     def _load_code(self, plugin_name, properties, part_schema,
                    definitions_schema):
         module_name = plugin_name.replace('-', '_')
@@ -140,10 +190,10 @@ class PluginHandler:
                 raise PluginError('unknown plugin: {}'.format(plugin_name))
 
         plugin = _get_plugin(module)
+        plugin_schema = _plugin_schema(plugin, part_schema, definitions_schema)
         _validate_pull_and_build_properties(
-            plugin_name, plugin, part_schema, definitions_schema)
-        options = _make_options(
-            part_schema, definitions_schema, properties, plugin.schema())
+            plugin_name, plugin, plugin_schema.schema)
+        options = _make_options(properties, plugin_schema)
         # For backwards compatibility we add the project to the plugin
         try:
             self.code = plugin(self.name, options, self._project_options)
@@ -208,6 +258,7 @@ class PluginHandler:
             if step:
                 os.remove(self.statedir)
                 os.makedirs(self.statedir)
+                self._states.reload()
                 self.mark_done(step)
 
     def notify_part_progress(self, progress, hint=''):
@@ -215,7 +266,7 @@ class PluginHandler:
 
     def last_step(self):
         for step in reversed(common.COMMAND_ORDER):
-            if os.path.exists(self._step_state_file(step)):
+            if self._states.has_run(step):
                 return step
 
         return None
@@ -276,8 +327,8 @@ class PluginHandler:
 
         index = common.COMMAND_ORDER.index(step)
 
-        with open(self._step_state_file(step), 'w') as f:
-            f.write(yaml.dump(state))
+        self._states.set(step, state)
+        self._migratable_filesets.clear()
 
         # We know we've only just completed this step, so make sure any later
         # steps don't have a saved state.
@@ -286,47 +337,77 @@ class PluginHandler:
                 self.mark_cleaned(command)
 
     def mark_cleaned(self, step):
-        state_file = self._step_state_file(step)
-        if os.path.exists(state_file):
-            os.remove(state_file)
-
-        if os.path.isdir(self.statedir) and not os.listdir(self.statedir):
-            os.rmdir(self.statedir)
+        self._states.remove(step)
+        self._migratable_filesets.clear()
 
     def get_state(self, step):
-        state = None
-        state_file = self._step_state_file(step)
-        if os.path.isfile(state_file):
-            with open(state_file, 'r') as f:
-                state = yaml.load(f.read())
-
-        return state
+        return self._states.get(step)
 
     def _step_state_file(self, step):
         return os.path.join(self.statedir, step)
 
+    def reload_states(self):
+        """Read states again, for steps run by another process."""
+
+        self._states.reload()
+        self._migratable_filesets.clear()
+        # The other process saved the file index as it left it.
+        self.__file_index = None
+
     def _fetch_stage_packages(self):
         try:
-            self.stage_packages = self._stage_package_handler.fetch()
-        except repo.errors.PackageNotFoundError as e:
+            with tracing.span('fetch stage-packages', part=self.name):
+                self.stage_packages = self._stage_package_handler.fetch()
+        except (repo.errors.PackageNotFoundError,
+                repo.errors.PackageIndexNotCachedError,
+                repo.errors.PackageNotCachedError) as e:
             raise RuntimeError("Error downloading stage packages for part "
                                "{!r}: {}".format(self.name, e.message))
 
     def _unpack_stage_packages(self):
-        self._stage_package_handler.unpack(self.installdir)
+        with tracing.span('unpack stage-packages', part=self.name):
+            self._stage_package_handler.unpack(self.installdir)
+        self._migratable_filesets.clear()
+
+    def _pull_source(self):
+        with tracing.span('pull source', part=self.name):
+            self.source_handler.pull()
+
+    def prefetch(self):
+        """Download the source and stage-packages ahead of the pull step.
+
+        Only the part's own directories and the download caches are used,
+        so this can run before the part's prerequisites are staged.
+
+        :returns: the stage-packages fetched, to be handed over to
+                  mark_prefetched.
+        """
+        self.makedirs()
+        self.notify_part_progress('Fetching')
+        self._fetch_stage_packages()
+        if self.source_handler:
+            self._pull_source()
+
+        return self.stage_packages
+
+    def mark_prefetched(self, stage_packages):
+        self.stage_packages = stage_packages
+        self._prefetched = True
 
     def prepare_pull(self, force=False):
         self.makedirs()
         self.notify_part_progress('Preparing to pull')
-        self._fetch_stage_packages()
+        if not self._prefetched:
+            self._fetch_stage_packages()
         self._unpack_stage_packages()
 
     def pull(self, force=False):
         self.makedirs()
         self.notify_part_progress('Pulling')
-        if self.source_handler:
-            self.source_handler.pull()
-        self.code.pull()
+        if self.source_handler and not self._prefetched:
+            self._pull_source()
+        with tracing.span('plugin pull', part=self.name):
+            self.code.pull()
 
         self.mark_pull_done()
 
@@ -355,7 +436,12 @@ class PluginHandler:
             else:
                 shutil.rmtree(self.sourcedir)
 
+        # The dependency cache outlives rebuilds, not the part.
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(self._dependency_cache_file())
+
         self.code.clean_pull()
+        self._prefetched = False
         self.mark_cleaned('pull')
 
     def prepare_build(self, force=False):
@@ -365,29 +451,31 @@ class PluginHandler:
         # unpack again here just in case the build step has been cleaned.
         self._unpack_stage_packages()
 
+    # FIXME: It's not necessary to ignore here anymore since it's now done
+    # in the Local source. However, it's left here so that it continues to
+    # work on old snapcraft trees that still have src symlinks.
+    def _ignore_snapcraft_files(self, directory, files):
+        if directory == self.sourcedir:
+            snaps = glob(os.path.join(directory, '*.snap'))
+            if snaps:
+                snaps = [os.path.basename(s) for s in snaps]
+                return common.SNAPCRAFT_FILES + snaps
+            else:
+                return common.SNAPCRAFT_FILES
+        else:
+            return []
+
     def build(self, force=False):
         self.makedirs()
-        self.notify_part_progress('Building')
 
-        if os.path.exists(self.code.build_basedir):
-            shutil.rmtree(self.code.build_basedir)
-
-        # FIXME: It's not necessary to ignore here anymore since it's now done
-        # in the Local source. However, it's left here so that it continues to
-        # work on old snapcraft trees that still have src symlinks.
-        def ignore(directory, files):
-            if directory == self.sourcedir:
-                snaps = glob(os.path.join(directory, '*.snap'))
-                if snaps:
-                    snaps = [os.path.basename(s) for s in snaps]
-                    return common.SNAPCRAFT_FILES + snaps
-                else:
-                    return common.SNAPCRAFT_FILES
-            else:
-                return []
+        fingerprint = None
+        if self._project_options.use_build_cache:
+            fingerprint = self._build_fingerprint()
+            if self._restore_build(fingerprint):
+                return
 
-        shutil.copytree(self.code.sourcedir, self.code.build_basedir,
-                        symlinks=True, ignore=ignore)
+        self.notify_part_progress('Building')
+        self._sync_build_dir()
 
         script_runner = ScriptRunner(builddir=self.code.build_basedir)
 
@@ -396,10 +484,98 @@ class PluginHandler:
         if build_scriptlet:
             script_runner.run(scriptlet=build_scriptlet)
         else:
-            self.code.build()
+            with tracing.span('plugin build', part=self.name):
+                self.code.build()
         script_runner.run(scriptlet=self._part_properties.get('install'))
 
         self.mark_build_done()
+        self.file_index.refresh()
+
+        if fingerprint:
+            build_cache = cache.BuildCache()
+            build_cache.cache(
+                fingerprint=fingerprint, installdir=self.installdir,
+                state=self.get_state('build'))
+            build_cache.prune(keep_fingerprints=[fingerprint],
+                              max_age=cache.BuildCache.MAX_AGE)
+
+    def _sync_build_dir(self):
+        """Bring the build directory up to date with the source directory.
+
+        A build directory left over by a previous build (one that failed
+        or is out of date) is only updated with what changed in the source,
+        so that the build tools can pick up where they left. A build step
+        cleaned from scratch gets a full copy of the source.
+        """
+        manifest = self._build_manifest_file()
+        synced = None
+        with contextlib.suppress(FileNotFoundError, ValueError):
+            with open(manifest) as f:
+                synced = json.load(f)
+
+        if synced is None and os.path.exists(self.code.build_basedir):
+            shutil.rmtree(self.code.build_basedir)
+
+        synced = file_utils.sync_tree(
+            self.code.sourcedir, self.code.build_basedir,
+            ignore=self._ignore_snapcraft_files, synced=synced or ())
+
+        with open(manifest, 'w') as f:
+            json.dump(sorted(synced), f)
+
+    def _remove_build_dir(self):
+        if os.path.exists(self.code.build_basedir):
+            shutil.rmtree(self.code.build_basedir)
+
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(self._build_manifest_file())
+
+    def _build_manifest_file(self):
+        return os.path.join(self._partdir, 'build-manifest.json')
+
+    def _build_fingerprint(self):
+        """Return a digest of everything going into building this part."""
+
+        pull_state = self.get_state('pull')
+        build_inputs = {
+            'pull-properties': states.PullState(
+                self.code.get_pull_properties(), self._part_properties,
+                self._project_options).properties,
+            'build-properties': states.BuildState(
+                self.code.get_build_properties(), self._part_properties,
+                self._project_options).properties,
+            'scriptlets': {name: self._part_properties.get(name)
+                           for name in ('prepare', 'build', 'install')},
+            'stage-packages': getattr(pull_state, 'assets', {}).get(
+                'stage-packages'),
+            'source': file_utils.calculate_tree_digest(
+                self.code.sourcedir, ignore=self._ignore_snapcraft_files),
+            'after': {dep.name: _staged_files_digest(dep)
+                      for dep in self.deps},
+            'deb-arch': self._project_options.deb_arch,
+            'plugin': _plugin_digest(self.code),
+            # Builds can refer to where they are installed and to what is
+            # staged, as in .pc and .la files, shebangs or prefixes.
+            'installdir': os.path.abspath(self.installdir),
+            'stagedir': os.path.abspath(self.stagedir),
+        }
+
+        return hashlib.sha384(json.dumps(
+            build_inputs, sort_keys=True, default=str).encode()).hexdigest()
+
+    def _restore_build(self, fingerprint):
+        build_cache = cache.BuildCache()
+        state = build_cache.get(fingerprint=fingerprint)
+        if not state:
+            return False
+
+        self.notify_part_progress('Restoring', '(from the build cache)')
+        build_cache.restore(fingerprint=fingerprint,
+                            installdir=self.installdir)
+        self.mark_done('build', state)
+        self.file_index.refresh()
+
+        return True
 
     def mark_build_done(self):
         build_properties = self.code.get_build_properties()
@@ -408,17 +584,24 @@ class PluginHandler:
             build_properties, self._part_properties,
             self._project_options))
 
-    def clean_build(self, hint=''):
+    def clean_build(self, hint='', deferred=False):
         if self.is_clean('build'):
             hint = '{} {}'.format(hint, '(already clean)').strip()
             self.notify_part_progress('Skipping cleaning build for',
                                       hint)
+            # A build that didn't complete leaves its build directory
+            # behind to be built upon, asking for a clean build drops it.
+            if not deferred and os.path.exists(self._build_manifest_file()):
+                self._remove_build_dir()
             return
 
         self.notify_part_progress('Cleaning build for', hint)
 
-        if os.path.exists(self.code.build_basedir):
-            shutil.rmtree(self.code.build_basedir)
+        # An out of date build, or one cleaned with `snapcraft clean -s
+        # build`, is built again on top of what the build tools left, only
+        # cleaning it from scratch drops it.
+        if not deferred:
+            self._remove_build_dir()
 
         if os.path.exists(self.installdir):
             shutil.rmtree(self.installdir)
@@ -427,6 +610,13 @@ class PluginHandler:
         self.mark_cleaned('build')
 
     def migratable_fileset_for(self, step):
+        if step not in self._migratable_filesets:
+            self._migratable_filesets[step] = self._migratable_fileset_for(
+                step)
+        files, dirs = self._migratable_filesets[step]
+        return set(files), set(dirs)
+
+    def _migratable_fileset_for(self, step):
         plugin_fileset = self.code.snap_fileset()
         fileset = self._get_fileset(step).copy()
         includes = _get_includes(fileset)
@@ -452,6 +642,7 @@ class PluginHandler:
         fileset = self._get_fileset('organize', {})
 
         _organize_filesets(fileset.copy(), self.code.installdir)
+        self._migratable_filesets.clear()
 
     def stage(self, force=False):
         self.makedirs()
@@ -460,25 +651,33 @@ class PluginHandler:
         snap_files, snap_dirs = self.migratable_fileset_for('stage')
 
         def fixup_func(file_path):
-            if os.path.islink(file_path):
-                return
             if not file_path.endswith('.pc'):
                 return
+            if os.path.islink(file_path):
+                return
             repo.fix_pkg_config(self.stagedir, file_path, self.code.installdir)
 
-        _migrate_files(snap_files, snap_dirs, self.code.installdir,
-                       self.stagedir, fixup_func=fixup_func)
+        files_to_migrate, dirs_to_migrate, manifest = self._changed_fileset(
+            'stage', self.code.installdir, snap_files, snap_dirs)
+        with tracing.span('migrate files', part=self.name, step='stage'):
+            _migrate_files(files_to_migrate, dirs_to_migrate,
+                           self.code.installdir, self.stagedir,
+                           fixup_func=fixup_func)
         # TODO once `snappy try` is in place we will need to copy
         # dependencies here too
 
-        self.mark_stage_done(snap_files, snap_dirs)
+        self.mark_stage_done(snap_files, snap_dirs, manifest)
+        self._states.remove_deferred('stage')
 
-    def mark_stage_done(self, snap_files, snap_dirs):
+    def mark_stage_done(self, snap_files, snap_dirs, manifest=None):
+        self._own_shared_area('stage', snap_files, snap_dirs)
         self.mark_done('stage', states.StageState(
             snap_files, snap_dirs, self._part_properties,
-            self._project_options))
+            self._project_options, manifest))
 
-    def clean_stage(self, project_staged_state, hint=''):
+    def clean_stage(self, project_staged_state, hint='', deferred=False):
+        if not deferred:
+            self.clean_deferred('stage')
         if self.is_clean('stage'):
             hint = '{} {}'.format(hint, '(already clean)').strip()
             self.notify_part_progress('Skipping cleaning staging area for',
@@ -490,7 +689,10 @@ class PluginHandler:
         state = self.get_state('stage')
 
         try:
-            self._clean_shared_area(self.stagedir, state,
+            if deferred and state.manifest is not None:
+                self._defer_clean('stage')
+                return
+            self._clean_shared_area('stage', state.files, state.directories,
                                     project_staged_state)
         except AttributeError:
             raise MissingState(
@@ -503,9 +705,19 @@ class PluginHandler:
         self.makedirs()
         self.notify_part_progress('Priming')
         snap_files, snap_dirs = self.migratable_fileset_for('prime')
-        _migrate_files(snap_files, snap_dirs, self.stagedir, self.snapdir)
-
-        dependencies = _find_dependencies(self.snapdir, snap_files)
+        files_to_migrate, dirs_to_migrate, manifest = self._changed_fileset(
+            'prime', self.stagedir, snap_files, snap_dirs)
+        with tracing.span('migrate files', part=self.name, step='prime'):
+            _migrate_files(files_to_migrate, dirs_to_migrate, self.stagedir,
+                           self.snapdir)
+
+        resolver = elf.LibraryResolver(
+            arch_triplet=self._project_options.arch_triplet,
+            library_paths=self._get_library_paths())
+        cache = DependencyCache(self._dependency_cache_file(), resolver)
+        with tracing.span('find dependencies', part=self.name):
+            dependencies = _find_dependencies(self.snapdir, snap_files,
+                                              resolver, cache)
 
         # Split the necessary dependencies into their corresponding location.
         # We'll both migrate and track the system dependencies, but we'll only
@@ -531,14 +743,37 @@ class PluginHandler:
                 _migrate_files(system, system_dependency_paths, '/',
                                self.snapdir, follow_symlinks=True)
 
-        self.mark_prime_done(snap_files, snap_dirs, dependency_paths)
+        self.mark_prime_done(snap_files, snap_dirs, dependency_paths,
+                             manifest)
+        self._states.remove_deferred('prime')
 
-    def mark_prime_done(self, snap_files, snap_dirs, dependency_paths):
+    def _get_library_paths(self):
+        """Return where libraries are searched for before the system.
+
+        This matches the LD_LIBRARY_PATH of the environment the part is
+        primed in.
+        """
+        arch_triplet = self._project_options.arch_triplet
+        library_paths = []
+        for root in (self.stagedir, self.installdir):
+            library_paths += libraries.determine_ld_library_path(root)
+        for root in (self.installdir, self.stagedir):
+            library_paths += common.get_library_paths(root, arch_triplet)
+        return library_paths
+
+    def _dependency_cache_file(self):
+        return os.path.join(self._partdir, 'dependency-cache.json')
+
+    def mark_prime_done(self, snap_files, snap_dirs, dependency_paths,
+                        manifest=None):
+        self._own_shared_area('prime', snap_files, snap_dirs)
         self.mark_done('prime', states.PrimeState(
             snap_files, snap_dirs, dependency_paths, self._part_properties,
-            self._project_options))
+            self._project_options, manifest))
 
-    def clean_prime(self, project_primed_state, hint=''):
+    def clean_prime(self, project_primed_state, hint='', deferred=False):
+        if not deferred:
+            self.clean_deferred('prime')
         if self.is_clean('prime'):
             hint = '{} {}'.format(hint, '(already clean)').strip()
             self.notify_part_progress('Skipping cleaning priming area for',
@@ -550,7 +785,10 @@ class PluginHandler:
         state = self.get_state('prime')
 
         try:
-            self._clean_shared_area(self.snapdir, state,
+            if deferred and state.manifest is not None:
+                self._defer_clean('prime')
+                return
+            self._clean_shared_area('prime', state.files, state.directories,
                                     project_primed_state)
         except AttributeError:
             raise MissingState(
@@ -559,23 +797,96 @@ class PluginHandler:
 
         self.mark_cleaned('prime')
 
-    def _clean_shared_area(self, shared_directory, part_state, project_state):
-        primed_files = part_state.files
-        primed_directories = part_state.directories
+    def _step_directory(self, step):
+        return {'stage': self.stagedir, 'prime': self.snapdir}[step]
+
+    def _defer_clean(self, step):
+        # An earlier deferred clean of step was finished when the step ran
+        # again, there is at most one.
+        self._states.defer(step)
+        self._migratable_filesets.clear()
+
+    def clean_deferred(self, step=None):
+        """Remove the files left by deferred cleans of steps not run again.
+
+        :param str step: the step to finish cleaning, all of them if None.
+        """
+        steps = [step] if step else ['prime', 'stage']
+        for step in steps:
+            state = self._states.get_deferred(step)
+            if state:
+                self._clean_shared_area(step, state.files,
+                                        state.directories, None)
+                self._states.remove_deferred(step)
+
+    def _changed_fileset(self, step, srcdir, snap_files, snap_dirs):
+        """Return what needs to be migrated for step, and its manifest.
+
+        If the last clean of step was deferred, what it left behind and is
+        no longer part of the step is removed, and files that are still in
+        place and didn't change since they were migrated are not migrated
+        again. This is what out of date steps and `snapcraft clean -s build`
+        do. After any other clean, like `snapcraft clean -s stage`, the files
+        are gone and all of them are migrated.
+
+        Files are compared by size and modification time, build tools that
+        install files anew, with the time of the install, leave nothing
+        unchanged.
+        """
+        manifest = _file_manifest(srcdir, snap_files)
+        state = self._states.get_deferred(step)
+        if not state:
+            return snap_files, snap_dirs, manifest
+
+        self._clean_shared_area(
+            step, set(state.files) - snap_files,
+            set(state.directories) - snap_dirs, None)
+        dstdir = self._step_directory(step)
+        unchanged = {f for f, entry in manifest.items()
+                     if _same_file(state.manifest.get(f), entry) and
+                     os.path.lexists(os.path.join(dstdir, f))}
+        logger.debug('{} of {} files to {} for {!r} are unchanged'.format(
+            len(unchanged), len(snap_files), step, self.name))
+        directories = {d for d in state.directories
+                       if os.path.isdir(os.path.join(dstdir, d))}
+        return snap_files - unchanged, snap_dirs - directories, manifest
+
+    def share_ownership_indexes(self, indexes):
+        """Use the given ownership indexes instead of one per change.
+
+        :param dict indexes: the OwnershipIndex of each step, those given
+                             are not saved, whoever shares them does.
+        """
+        self._ownership_indexes = indexes
+
+    def _ownership_index(self, step, project_state=None):
+        index = self._ownership_indexes.get(step)
+        if index is not None:
+            return index
+
+        index = OwnershipIndex(self._project_options.parts_dir, step)
+        if project_state and not index.exists():
+            # The other parts were migrated before the index was kept.
+            index.seed(project_state)
+        return index
 
+    def _save_ownership_index(self, step, index):
+        if step not in self._ownership_indexes:
+            index.save()
+
+    def _own_shared_area(self, step, files, directories):
+        index = self._ownership_index(step)
+        index.add(self.name, files, directories)
+        self._save_ownership_index(step, index)
+
+    def _clean_shared_area(self, step, files, directories, project_state):
         # We want to make sure we don't remove a file or directory that's
-        # being used by another part. So we'll examine the state for all parts
-        # in the project and leave any files or directories found to be in
-        # common.
-        for other_name, other_state in project_state.items():
-            if other_state and (other_name != self.name):
-                primed_files -= other_state.files
-                primed_directories -= other_state.directories
-
-        # Finally, clean the files and directories that are specific to this
-        # part.
-        _clean_migrated_files(primed_files, primed_directories,
-                              shared_directory)
+        # being used by another part, so only what no other part owns is
+        # removed.
+        index = self._ownership_index(step, project_state)
+        files, directories = index.release(self.name, files, directories)
+        self._save_ownership_index(step, index)
+        _clean_migrated_files(files, directories, self._step_directory(step))
 
     def get_primed_dependency_paths(self):
         dependency_paths = set()
@@ -591,7 +902,16 @@ class PluginHandler:
         return self.code.env(root)
 
     def clean(self, project_staged_state=None, project_primed_state=None,
-              step=None, hint=''):
+              step=None, hint='', deferred=False):
+        """Clean step and the steps after it, all of them if None.
+
+        If deferred, the files of the stage and prime steps are left in
+        place, for those steps to only migrate what changed when run again.
+        clean_deferred() removes them if they are not. Otherwise they are
+        removed right away and the steps migrate everything when run again.
+        The build directory is likewise kept to be synced by a deferred
+        clean, and dropped otherwise.
+        """
         if not project_staged_state:
             project_staged_state = {}
 
@@ -600,7 +920,7 @@ class PluginHandler:
 
         try:
             self._clean_steps(project_staged_state, project_primed_state,
-                              step, hint)
+                              step, hint, deferred)
         except MissingState:
             # If one of the step cleaning rules is missing state, it must be
             # running on the output of an old Snapcraft. In that case, if we
@@ -611,17 +931,17 @@ class PluginHandler:
                 raise
 
             logger.info('Cleaning up for part {!r}'.format(self.name))
-            if os.path.exists(self.code.partdir):
-                shutil.rmtree(self.code.partdir)
+            if os.path.exists(self._partdir):
+                shutil.rmtree(self._partdir)
 
         # Remove the part directory if it's completely empty (i.e. all steps
         # have been cleaned).
-        if (os.path.exists(self.code.partdir) and
-                not os.listdir(self.code.partdir)):
-            os.rmdir(self.code.partdir)
+        if (os.path.exists(self._partdir) and
+                not os.listdir(self._partdir)):
+            os.rmdir(self._partdir)
 
     def _clean_steps(self, project_staged_state, project_primed_state,
-                     step=None, hint=None):
+                     step=None, hint=None, deferred=False):
         index = None
         if step:
             if step not in common.COMMAND_ORDER:
@@ -632,18 +952,34 @@ class PluginHandler:
             index = common.COMMAND_ORDER.index(step)
 
         if not index or index <= common.COMMAND_ORDER.index('prime'):
-            self.clean_prime(project_primed_state, hint)
+            self.clean_prime(project_primed_state, hint, deferred)
 
         if not index or index <= common.COMMAND_ORDER.index('stage'):
-            self.clean_stage(project_staged_state, hint)
+            self.clean_stage(project_staged_state, hint, deferred)
 
         if not index or index <= common.COMMAND_ORDER.index('build'):
-            self.clean_build(hint)
+            self.clean_build(hint, deferred)
 
         if not index or index <= common.COMMAND_ORDER.index('pull'):
             self.clean_pull(hint)
 
 
+def _staged_files_digest(part):
+    state = part.get_state('stage')
+    if not state:
+        return None
+
+    return file_utils.calculate_tree_digest(part.stagedir, paths=state.files)
+
+
+def _plugin_digest(plugin):
+    with open(inspect.getfile(type(plugin)), 'rb') as f:
+        plugin_source = f.read()
+
+    return '{}-{}'.format(snapcraft.__version__,
+                          hashlib.sha384(plugin_source).hexdigest())
+
+
 def _split_dependencies(dependencies, installdir, stagedir, snapdir):
     """Split dependencies into their corresponding location.
 
@@ -690,15 +1026,12 @@ def _expand_part_properties(part_properties, part_schema):
     in the schema itself.
     """
 
-    # First make a deep copy of the part schema. It contains nested mutables,
-    # and we'd rather not change them.
-    part_schema = copy.deepcopy(part_schema)
-
     # Come up with a dictionary of part schema properties and their default
-    # values as defined in the schema.
+    # values as defined in the schema. Defaults can be mutable, copy them
+    # so that they are not shared between parts.
     properties = {}
     for schema_property, subschema in part_schema.items():
-        properties[schema_property] = subschema.get('default')
+        properties[schema_property] = copy.deepcopy(subschema.get('default'))
 
     # Now expand (overwriting if necessary) the default schema properties with
     # the ones from the actual part.
@@ -710,11 +1043,8 @@ def _expand_part_properties(part_properties, part_schema):
 def _merged_part_and_plugin_schemas(part_schema, definitions_schema,
                                     plugin_schema):
     plugin_schema = plugin_schema.copy()
-    if 'properties' not in plugin_schema:
-        plugin_schema['properties'] = {}
-
-    if 'definitions' not in plugin_schema:
-        plugin_schema['definitions'] = {}
+    plugin_schema['properties'] = plugin_schema.get('properties', {}).copy()
+    plugin_schema['definitions'] = plugin_schema.get('definitions', {}).copy()
 
     # The part schema takes precedence over the plugin's schema.
     plugin_schema['properties'].update(part_schema)
@@ -723,10 +1053,41 @@ def _merged_part_and_plugin_schemas(part_schema, definitions_schema,
     return plugin_schema
 
 
-def _validate_pull_and_build_properties(plugin_name, plugin, part_schema,
-                                        definitions_schema):
-    merged_schema = _merged_part_and_plugin_schemas(
-        part_schema, definitions_schema, plugin.schema())
+class _PluginSchema:
+    """A plugin's schema merged with the part schema, and its validator."""
+
+    def __init__(self, plugin, part_schema, definitions_schema):
+        # Kept so that the ids used to memoize this stay theirs.
+        self.part_schema = part_schema
+        self.definitions_schema = definitions_schema
+
+        schema = _merged_part_and_plugin_schemas(
+            part_schema, definitions_schema, plugin.schema())
+        # This is for backwards compatibility for when most of the
+        # schema was overridable by the plugins.
+        if 'required' in schema and not schema['required']:
+            del schema['required']
+        self.schema = schema
+
+        cls = jsonschema.validators.validator_for(schema)
+        cls.check_schema(schema)
+        self.validator = cls(schema)
+
+
+# Merged schemas by plugin class and part and definitions schemas, which
+# are shared by all the parts of a project.
+_plugin_schemas = {}
+
+
+def _plugin_schema(plugin, part_schema, definitions_schema):
+    key = (plugin, id(part_schema), id(definitions_schema))
+    if key not in _plugin_schemas:
+        _plugin_schemas[key] = _PluginSchema(
+            plugin, part_schema, definitions_schema)
+    return _plugin_schemas[key]
+
+
+def _validate_pull_and_build_properties(plugin_name, plugin, merged_schema):
     merged_properties = merged_schema['properties']
 
     # First, validate pull properties
@@ -757,30 +1118,19 @@ def _validate_step_properties(step_properties, schema_properties):
     return invalid_properties
 
 
-def _make_options(part_schema, definitions_schema, properties, plugin_schema):
-    # Make copies as these dictionaries are tampered with
-    part_schema = part_schema.copy()
-    properties = properties.copy()
-
-    plugin_schema = _merged_part_and_plugin_schemas(
-        part_schema, definitions_schema, plugin_schema)
-
-    # This is for backwards compatibility for when most of the
-    # schema was overridable by the plugins.
-    if 'required' in plugin_schema and not plugin_schema['required']:
-            del plugin_schema['required']
-    # With the same backwards compatibility in mind we need to remove
-    # the source entry before validation. To those concerned, it has
-    # already been validated.
+def _make_options(properties, plugin_schema):
+    # For backwards compatibility for when most of the schema was
+    # overridable by the plugins, we need to remove the source entry before
+    # validation. To those concerned, it has already been validated.
     validated_properties = properties.copy()
     remove_set = [k for k in sources.get_source_defaults().keys()
                   if k in validated_properties]
     for key in remove_set:
         del validated_properties[key]
 
-    jsonschema.validate(validated_properties, plugin_schema)
+    plugin_schema.validator.validate(validated_properties)
 
-    options = _populate_options(properties, plugin_schema)
+    options = _populate_options(properties, plugin_schema.schema)
 
     return options
 
@@ -846,64 +1196,39 @@ def load_plugin(part_name, *, plugin_name, part_properties=None,
 def _migratable_filesets(fileset, srcdir):
     includes, excludes = _get_file_list(fileset)
 
-    include_files = _generate_include_set(srcdir, includes)
-    exclude_files, exclude_dirs = _generate_exclude_set(srcdir, excludes)
-
-    # And chop files, including whole trees if any dirs are mentioned
-    snap_files = include_files - exclude_files
-    for exclude_dir in exclude_dirs:
-        snap_files = set([x for x in snap_files
-                          if not x.startswith(exclude_dir + '/')])
-
-    # Separate dirs from files
-    snap_dirs = set([x for x in snap_files
-                     if os.path.isdir(os.path.join(srcdir, x)) and
-                     not os.path.islink(os.path.join(srcdir, x))])
-    snap_files = snap_files - snap_dirs
-
-    # Make sure we also obtain the parent directories of files
-    for snap_file in snap_files:
-        dirname = os.path.dirname(snap_file)
-        while dirname:
-            snap_dirs.add(dirname)
-            dirname = os.path.dirname(dirname)
-
-    return snap_files, snap_dirs
+    return FilesetMatcher(includes, excludes).match(srcdir)
 
 
 def _migrate_files(snap_files, snap_dirs, srcdir, dstdir, missing_ok=False,
                    follow_symlinks=False, fixup_func=lambda *args: None):
-
-    for directory in snap_dirs:
-        src = os.path.join(srcdir, directory)
-        dst = os.path.join(dstdir, directory)
-
-        snapcraft.file_utils.create_similar_directory(src, dst)
-
+    migrator = FileMigrator(srcdir, dstdir, missing_ok=missing_ok,
+                            follow_symlinks=follow_symlinks,
+                            fixup_func=fixup_func)
+    report = migrator.migrate(snap_files, snap_dirs)
+    logger.debug(
+        'Migrated {r.linked} linked and {r.copied} copied files '
+        '({r.bytes_copied} bytes) and {r.directories} directories from '
+        '{srcdir!r} to {dstdir!r}'.format(r=report, srcdir=srcdir,
+                                          dstdir=dstdir))
+    return report
+
+
+def _file_manifest(directory, snap_files):
+    """Return the size, modification time and inode of snap_files."""
+    manifest = {}
     for snap_file in snap_files:
-        src = os.path.join(srcdir, snap_file)
-        dst = os.path.join(dstdir, snap_file)
-
-        snapcraft.file_utils.create_similar_directory(os.path.dirname(src),
-                                                      os.path.dirname(dst))
-
-        if missing_ok and not os.path.exists(src):
-            continue
-
-        # If the file is already here and it's a symlink, leave it alone.
-        if os.path.islink(dst):
+        try:
+            st = os.lstat(os.path.join(directory, snap_file))
+        except FileNotFoundError:
             continue
+        manifest[snap_file] = [st.st_size, st.st_mtime_ns, st.st_ino]
+    return manifest
 
-        # Otherwise, remove and re-link it.
-        if os.path.exists(dst):
-            os.remove(dst)
-
-        if src.endswith('.pc'):
-            shutil.copy2(src, dst, follow_symlinks=follow_symlinks)
-        else:
-            file_utils.link_or_copy(src, dst, follow_symlinks=follow_symlinks)
 
-        fixup_func(dst)
+def _same_file(old_entry, entry):
+    # The inode changes with the file being linked again, only the size and
+    # the modification time tell whether it's the same.
+    return old_entry is not None and old_entry[:2] == entry[:2]
 
 
 def _organize_filesets(fileset, base_dir):
@@ -930,8 +1255,10 @@ def _organize_filesets(fileset, base_dir):
 
 
 def _clean_migrated_files(snap_files, snap_dirs, directory):
+    # Files left in place by a deferred clean may have been removed since.
     for snap_file in snap_files:
-        os.remove(os.path.join(directory, snap_file))
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(os.path.join(directory, snap_file))
 
     # snap_dirs may not be ordered so that subdirectories come before
     # parents, and we want to be able to remove directories if possible, so
@@ -940,43 +1267,89 @@ def _clean_migrated_files(snap_files, snap_dirs, directory):
 
     for snap_dir in snap_dirs:
         migrated_directory = os.path.join(directory, snap_dir)
-        if not os.listdir(migrated_directory):
+        if (os.path.isdir(migrated_directory) and
+                not os.listdir(migrated_directory)):
             os.rmdir(migrated_directory)
 
 
-def _find_dependencies(root, part_files):
-    ms = magic.open(magic.NONE)
-    if ms.load() != 0:
-        raise RuntimeError('Cannot load magic header detection')
-
-    elf_files = set()
+def _find_dependencies(root, part_files, resolver, cache=None):
+    """Return the libraries needed by the ELF files among part_files.
 
-    fs_encoding = sys.getfilesystemencoding()
+    :param DependencyCache cache: if given, only files that changed since
+                                  they were last looked at are read.
+    """
+    dependencies = set()
 
     for part_file in part_files:
         # Filter out object (*.o) files-- we only care about binaries.
         if part_file.endswith('.o'):
             continue
 
-        # No need to crawl links-- the original should be here, too.
         path = os.path.join(root, part_file)
-        if os.path.islink(path):
-            logger.debug('Skipped link {!r} while finding dependencies'.format(
-                path))
+        st = _get_regular_file_stat(path)
+        if st is None:
             continue
 
-        path = path.encode(fs_encoding, errors='surrogateescape')
-        # Finally, make sure this is actually an ELF before queueing it up
-        # for an ldd call.
-        file_m = ms.file(path)
-        if file_m.startswith('ELF') and 'dynamically linked' in file_m:
-            elf_files.add(path)
+        file_dependencies = _get_file_dependencies(
+            part_file, path, st, resolver, cache)
+        if file_dependencies:
+            dependencies.update(file_dependencies)
+
+    if cache is not None:
+        cache.prune(part_files)
+        cache.save()
+
+    return dependencies
 
-    dependencies = []
-    for elf_file in elf_files:
-        dependencies += libraries.get_dependencies(elf_file)
 
-    return set(dependencies)
+def _get_regular_file_stat(path):
+    """Return the stat of path, None if it's not a regular file."""
+    try:
+        st = os.lstat(path)
+    except FileNotFoundError:
+        return None
+    # No need to crawl links-- the original should be here, too.
+    if stat.S_ISLNK(st.st_mode):
+        logger.debug('Skipped link {!r} while finding dependencies'.format(
+            path))
+        return None
+    if not stat.S_ISREG(st.st_mode):
+        return None
+    return st
+
+
+def _get_file_dependencies(part_file, path, st, resolver, cache):
+    """Return the libraries path needs, from cache if it didn't change."""
+    if cache is None:
+        return _find_file_dependencies(path, resolver)
+
+    file_dependencies = cache.get(part_file, st)
+    if file_dependencies is False:
+        searched = set()
+        file_dependencies = _find_file_dependencies(path, resolver, searched)
+        cache.set(part_file, st, file_dependencies, searched)
+    return file_dependencies
+
+
+def _find_file_dependencies(path, resolver, searched=None):
+    """Return the libraries path needs, None if not dynamically linked."""
+    # Make sure this is actually a dynamically linked ELF before resolving
+    # what it needs.
+    try:
+        elf_file = elf.read_elf_file(path)
+    except CorruptedElfFileError as e:
+        logger.warning(
+            'Unable to determine library dependencies for {!r}: '
+            '{}'.format(path, e))
+        return None
+    except OSError as e:
+        # Files that cannot be read, like those only root can read, are
+        # not the part's libraries or programs to find dependencies for.
+        logger.debug('Unable to read {!r}: {}'.format(path, e))
+        return None
+    if not elf_file or not elf_file.needed:
+        return None
+    return libraries.get_dependencies(elf_file, resolver, searched)
 
 
 def _get_file_list(stage_set):
@@ -998,49 +1371,6 @@ def _get_file_list(stage_set):
     return includes, excludes
 
 
-def _generate_include_set(directory, includes):
-    include_files = set()
-    for include in includes:
-        if '*' in include:
-            pattern = os.path.join(directory, include)
-            matches = iglob(pattern, recursive=True)
-            include_files |= set(matches)
-        else:
-            include_files |= set([os.path.join(directory, include), ])
-
-    include_dirs = [x for x in include_files if os.path.isdir(x)]
-    include_files = set([os.path.relpath(x, directory) for x in include_files])
-
-    # Expand includeFiles, so that an exclude like '*/*.so' will still match
-    # files from an include like 'lib'
-    for include_dir in include_dirs:
-        for root, dirs, files in os.walk(include_dir):
-            include_files |= \
-                set([os.path.relpath(os.path.join(root, d), directory)
-                     for d in dirs])
-            include_files |= \
-                set([os.path.relpath(os.path.join(root, f), directory)
-                     for f in files])
-
-    return include_files
-
-
-def _generate_exclude_set(directory, excludes):
-    exclude_files = set()
-
-    for exclude in excludes:
-        pattern = os.path.join(directory, exclude)
-        matches = iglob(pattern, recursive=True)
-        exclude_files |= set(matches)
-
-    exclude_dirs = [os.path.relpath(x, directory)
-                    for x in exclude_files if os.path.isdir(x)]
-    exclude_files = set([os.path.relpath(x, directory)
-                         for x in exclude_files])
-
-    return exclude_files, exclude_dirs
-
-
 def _validate_relative_paths(files):
     for d in files:
         if os.path.isabs(d):
@@ -1069,36 +1399,51 @@ def _file_collides(file_this, file_other):
     return False
 
 
+def _indexed_file_collides(path, part, other_part):
+    if not path.endswith('.pc'):
+        same = part.file_index.same_contents(path, other_part.file_index)
+        if same is not None:
+            return not same
+
+    this = os.path.join(part.installdir, path)
+    other = os.path.join(other_part.installdir, path)
+    if os.path.islink(this) and os.path.islink(other):
+        return False
+    return _file_collides(this, other)
+
+
 def check_for_collisions(parts):
-    """Raises an EnvironmentError if conflicts are found between two parts."""
-    parts_files = {}
-    for part in parts:
-        # Gather our own files up
-        part_files, _ = part.migratable_fileset_for('stage')
-
-        # Scan previous parts for collisions
-        for other_part_name in parts_files:
-            common = part_files & parts_files[other_part_name]['files']
-            conflict_files = []
-            for f in common:
-                this = os.path.join(part.installdir, f)
-                other = os.path.join(
-                    parts_files[other_part_name]['installdir'],
-                    f)
-                if os.path.islink(this) and os.path.islink(other):
+    """Raises an EnvironmentError if conflicts are found between two parts.
+
+    Each file is only compared with the first part providing it, any other
+    part providing it was checked to have the same contents. Contents are
+    compared through the parts' file indexes, which only read files that
+    changed since their last comparison.
+    """
+    # The index of the first part providing each file.
+    owners = {}
+    try:
+        for index, part in enumerate(parts):
+            part_files, _ = part.migratable_fileset_for('stage')
+
+            # Conflicting files by the index of the other part.
+            conflicts = {}
+            for f in part_files:
+                owner = owners.setdefault(f, index)
+                if owner == index:
                     continue
-                if _file_collides(this, other):
-                    conflict_files.append(f)
+                if _indexed_file_collides(f, part, parts[owner]):
+                    conflicts.setdefault(owner, []).append(f)
 
-            if conflict_files:
+            if conflicts:
+                owner = min(conflicts)
                 raise SnapcraftPartConflictError(
-                    other_part_name=other_part_name,
+                    other_part_name=parts[owner].name,
                     part_name=part.name,
-                    conflict_files=conflict_files)
-
-        # And add our files to the list
-        parts_files[part.name] = {'files': part_files,
-                                  'installdir': part.installdir}
+                    conflict_files=conflicts[owner])
+    finally:
+        for part in parts:
+            part.file_index.save()
 
 
 def _get_includes(fileset):
@@ -0,0 +1,160 @@
+# -*- Mode:Python; indent-tabs-mode:nil; tab-width:4 -*-
+#
+# Copyright (C) 2017 Canonical Ltd
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import contextlib
+import hashlib
+import json
+import os
+
+# Bumped whenever what is stored for an entry changes.
+_CACHE_VERSION = 2
+
+# The fields of an entry.
+(_DEV, _INO, _SIZE, _MTIME, _LIBRARIES, _LIBRARY_STATS,
+ _SEARCHED) = range(7)
+
+
+def _stat_key(st):
+    return [st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns]
+
+
+class DependencyCache:
+    """Cache of the libraries needed by the files of a part's prime step.
+
+    Each relative path maps to the file's device, inode, size and
+    modification time, the libraries it needs (None if it is not a
+    dynamically linked ELF file), the same stat fields for each of those
+    libraries and a digest of the names in each directory searched for that
+    file only (its DT_RPATH and DT_RUNPATH, and those of its libraries). An
+    entry is only used if neither the file nor any of its libraries
+    changed, and if the resolver looks for libraries in the same
+    directories, containing the same names, as when it was stored.
+    """
+
+    def __init__(self, cache_file, resolver):
+        self._cache_file = cache_file
+        self._context = _resolver_context(resolver)
+        self._entries = None
+        self._dirty = False
+        # Digests of the names in the directories searched, by directory.
+        self._listings = {}
+
+    def _load(self):
+        if self._entries is not None:
+            return
+        self._entries = {}
+        with contextlib.suppress(FileNotFoundError, ValueError):
+            with open(self._cache_file) as f:
+                cache = json.load(f)
+            if (cache.get('version') == _CACHE_VERSION and
+                    cache.get('context') == self._context):
+                self._entries = cache['entries']
+
+    def get(self, path, st):
+        """Return the cached libraries path needs, or False if unknown.
+
+        :param str path: the path of the file, used as the key.
+        :param os.stat_result st: the current lstat of the file.
+        :returns: the list of libraries, None if path is not a dynamically
+                  linked ELF file, or False if there is no valid entry.
+        """
+        self._load()
+        entry = self._entries.get(path)
+        if entry is None or entry[:_LIBRARIES] != _stat_key(st):
+            return False
+        for directory, listing in entry[_SEARCHED]:
+            if self._listing_digest(directory) != listing:
+                return False
+        libraries = entry[_LIBRARIES]
+        if libraries:
+            for library, library_stat in zip(libraries, entry[_LIBRARY_STATS]):
+                try:
+                    if _stat_key(os.stat(library)) != library_stat:
+                        return False
+                except OSError:
+                    return False
+        return libraries
+
+    def set(self, path, st, libraries, searched=()):
+        """Remember the libraries path needs, None if not dynamically linked.
+
+        Libraries that can't be stat'ed are not cached, they will be
+        looked for again next time.
+
+        :param searched: the directories searched for path on top of the
+                         resolver's search_path.
+        """
+        self._load()
+        library_stats = []
+        for library in libraries or ():
+            try:
+                library_stats.append(_stat_key(os.stat(library)))
+            except OSError:
+                self._entries.pop(path, None)
+                self._dirty = True
+                return
+        listings = [[d, self._listing_digest(d)] for d in sorted(searched)]
+        self._entries[path] = _stat_key(st) + [libraries, library_stats,
+                                               listings]
+        self._dirty = True
+
+    def _listing_digest(self, directory):
+        if directory not in self._listings:
+            self._listings[directory] = hashlib.sha1(
+                _listing(directory)).hexdigest()
+        return self._listings[directory]
+
+    def prune(self, paths):
+        """Drop the entries of files other than paths."""
+        self._load()
+        for path in set(self._entries) - set(paths):
+            del self._entries[path]
+            self._dirty = True
+
+    def save(self):
+        """Write the cache if it changed since loaded."""
+        if not self._dirty:
+            return
+        os.makedirs(os.path.dirname(self._cache_file), exist_ok=True)
+        temp_file = '{}.partial'.format(self._cache_file)
+        with open(temp_file, 'w') as f:
+            json.dump({'version': _CACHE_VERSION, 'context': self._context,
+                       'entries': self._entries}, f)
+        os.replace(temp_file, self._cache_file)
+        self._dirty = False
+
+
+def _resolver_context(resolver):
+    """Return what the libraries found by resolver depend on.
+
+    That is the architecture and the names in each directory searched, so
+    that adding a library that would now be found first, or removing one,
+    invalidates the cache, but linking the same files again doesn't.
+    """
+    digest = hashlib.sha1()
+    for directory in resolver.search_path:
+        digest.update(os.fsencode(directory) + b'\0')
+        digest.update(_listing(directory))
+        digest.update(b'\0')
+    return [resolver.arch_triplet, digest.hexdigest()]
+
+
+def _listing(directory):
+    """Return the names in directory, nothing if it can't be listed."""
+    with contextlib.suppress(OSError):
+        return b''.join(os.fsencode(name) + b'/'
+                        for name in sorted(os.listdir(directory)))
+    return b''
@@ -0,0 +1,145 @@
+# -*- Mode:Python; indent-tabs-mode:nil; tab-width:4 -*-
+#
+# Copyright (C) 2017 Canonical Ltd
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import contextlib
+import json
+import os
+import stat
+
+from snapcraft import file_utils
+
+# Bumped whenever what is stored for an entry changes.
+_INDEX_VERSION = 1
+
+# The fields of an entry, its content digest is only known once needed.
+_DEV, _INO, _SIZE, _MTIME, _DIGEST = range(5)
+
+
+class FileIndex:
+    """Index of the regular files in a part's install directory.
+
+    Each relative path maps to the file's device, inode, size, modification
+    time and content digest. Entries are checked against the file before
+    being used and digests are only computed when first asked for, so that
+    comparing a file with another one only reads it if it changed since
+    the last comparison.
+    """
+
+    def __init__(self, root, index_file):
+        self.root = root
+        self._index_file = index_file
+        self._entries = None
+        self._dirty = False
+
+    def _load(self):
+        if self._entries is not None:
+            return
+        self._entries = {}
+        with contextlib.suppress(FileNotFoundError, ValueError):
+            with open(self._index_file) as f:
+                index = json.load(f)
+            if index.get('version') == _INDEX_VERSION:
+                self._entries = index['entries']
+
+    def _stat(self, path):
+        """Return the entry for path without its digest, or None.
+
+        Only regular files have an entry.
+        """
+        try:
+            st = os.lstat(os.path.join(self.root, path))
+        except FileNotFoundError:
+            return None
+        if not stat.S_ISREG(st.st_mode):
+            return None
+        return [st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns, None]
+
+    def entry(self, path):
+        """Return the up to date entry for path, or None."""
+        self._load()
+        entry = self._stat(path)
+        cached = self._entries.get(path)
+        if entry is None:
+            if cached is not None:
+                del self._entries[path]
+                self._dirty = True
+            return None
+        if cached is not None and cached[:_DIGEST] == entry[:_DIGEST]:
+            return cached
+        self._entries[path] = entry
+        self._dirty = True
+        return entry
+
+    def digest(self, path, entry=None):
+        """Return the digest of the contents of path, computing it once.
+
+        :param list entry: the up to date entry for path, if known.
+        """
+        if entry is None:
+            entry = self.entry(path)
+        if entry[_DIGEST] is None:
+            entry[_DIGEST] = file_utils.calculate_sha3_384(
+                os.path.join(self.root, path))
+            self._dirty = True
+        return entry[_DIGEST]
+
+    def same_contents(self, path, other):
+        """Return whether path has the same contents in the other index.
+
+        :returns: None if path is not a regular file in both.
+        """
+        this_entry = self.entry(path)
+        other_entry = other.entry(path)
+        if this_entry is None or other_entry is None:
+            return None
+        if this_entry[:_SIZE] == other_entry[:_SIZE]:
+            # The same file, e.g. hard linked.
+            return True
+        if this_entry[_SIZE] != other_entry[_SIZE]:
+            return False
+        return (self.digest(path, this_entry) ==
+                other.digest(path, other_entry))
+
+    def refresh(self):
+        """Index all the files under root, dropping what went away.
+
+        Digests of unchanged files are kept.
+        """
+        self._load()
+        entries = {}
+        for directory, _, files in os.walk(self.root):
+            for name in files:
+                path = os.path.relpath(
+                    os.path.join(directory, name), self.root)
+                entry = self.entry(path)
+                if entry is not None:
+                    entries[path] = entry
+        if entries != self._entries:
+            self._entries = entries
+            self._dirty = True
+        self.save()
+
+    def save(self):
+        """Write the index if it changed since loaded."""
+        if not self._dirty:
+            return
+        os.makedirs(os.path.dirname(self._index_file), exist_ok=True)
+        temp_file = '{}.partial'.format(self._index_file)
+        with open(temp_file, 'w') as f:
+            json.dump({'version': _INDEX_VERSION, 'entries': self._entries},
+                      f)
+        os.replace(temp_file, self._index_file)
+        self._dirty = False
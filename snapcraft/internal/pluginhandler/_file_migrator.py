@@ -0,0 +1,156 @@
+# -*- Mode:Python; indent-tabs-mode:nil; tab-width:4 -*-
+#
+# Copyright (C) 2017 Canonical Ltd
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import collections
+import concurrent.futures
+import errno
+import os
+import shutil
+import stat
+
+from snapcraft import file_utils
+
+# Files are migrated in batches of this many, sorted so that a batch mostly
+# touches a single directory.
+_BATCH_SIZE = 256
+
+MigrationReport = collections.namedtuple(
+    'MigrationReport', ['directories', 'linked', 'copied', 'bytes_copied'])
+
+
+def _default_workers():
+    return min(8, os.cpu_count() or 1)
+
+
+class FileMigrator:
+    """Migrate files from one tree into another, hard-linking if possible.
+
+    Each directory is created once, before any file, and files are then
+    linked or copied in batches by a pool of threads. Whether the trees are
+    on the same device is checked once, files are not linked when they are
+    not.
+    """
+
+    def __init__(self, srcdir, dstdir, *, missing_ok=False,
+                 follow_symlinks=False, fixup_func=lambda *args: None,
+                 workers=None):
+        self._srcdir = srcdir
+        self._dstdir = dstdir
+        self._missing_ok = missing_ok
+        self._follow_symlinks = follow_symlinks
+        self._fixup_func = fixup_func
+        self._workers = workers or _default_workers()
+        self._can_link = True
+
+    def migrate(self, snap_files, snap_dirs):
+        """Migrate snap_files and snap_dirs, relative to the trees.
+
+        :returns: a MigrationReport.
+        """
+        directories = set(snap_dirs)
+        directories.update(os.path.dirname(f) for f in snap_files)
+        # Parents sort before their subdirectories.
+        for directory in sorted(directories):
+            file_utils.create_similar_directory(
+                os.path.join(self._srcdir, directory),
+                os.path.join(self._dstdir, directory))
+        if not snap_files:
+            return MigrationReport(len(directories), 0, 0, 0)
+
+        self._can_link = (os.stat(self._srcdir).st_dev ==
+                          os.stat(self._dstdir).st_dev)
+        snap_files = sorted(snap_files)
+        batches = [snap_files[i:i + _BATCH_SIZE]
+                   for i in range(0, len(snap_files), _BATCH_SIZE)]
+        if len(batches) == 1 or self._workers == 1:
+            results = [self._migrate_batch(b) for b in batches]
+        else:
+            with concurrent.futures.ThreadPoolExecutor(
+                    max_workers=self._workers) as executor:
+                results = list(executor.map(self._migrate_batch, batches))
+
+        linked, copied, bytes_copied = (sum(r) for r in zip(*results))
+        return MigrationReport(len(directories), linked, copied, bytes_copied)
+
+    def _migrate_batch(self, snap_files):
+        linked = copied = bytes_copied = 0
+        for snap_file in snap_files:
+            result = self._migrate_file(snap_file)
+            if result is None:
+                continue
+            if result is True:
+                linked += 1
+            else:
+                copied += 1
+                bytes_copied += result
+        return linked, copied, bytes_copied
+
+    def _migrate_file(self, snap_file):
+        """Return True if the file was linked, its size if it was copied."""
+        src = os.path.join(self._srcdir, snap_file)
+        dst = os.path.join(self._dstdir, snap_file)
+
+        if self._missing_ok and not os.path.exists(src):
+            return None
+
+        # pkg-config files are fixed up, so they must not be shared.
+        if self._can_link and not src.endswith('.pc'):
+            try:
+                if not self._link(src, dst):
+                    return None
+            except OSError as e:
+                if e.errno == errno.EXDEV:
+                    self._can_link = False
+            else:
+                self._fixup_func(dst)
+                return True
+
+        if not self._remove_destination(dst):
+            return None
+        if src.endswith('.pc'):
+            shutil.copy2(src, dst, follow_symlinks=self._follow_symlinks)
+            size = os.stat(dst).st_size
+        else:
+            size = file_utils.copy_with_ownership(
+                src, dst, follow_symlinks=self._follow_symlinks).st_size
+        self._fixup_func(dst)
+        return size
+
+    def _link(self, src, dst):
+        """Link src to dst, return False if dst is a symlink left alone."""
+        # os.link doesn't follow symlinks, resolve them ourselves.
+        if self._follow_symlinks:
+            src = os.path.realpath(src)
+        try:
+            os.link(src, dst, follow_symlinks=False)
+        except FileExistsError:
+            if not self._remove_destination(dst):
+                return False
+            os.link(src, dst, follow_symlinks=False)
+        return True
+
+    @staticmethod
+    def _remove_destination(dst):
+        """Remove dst, return False if it is a symlink left alone."""
+        try:
+            dst_stat = os.lstat(dst)
+        except FileNotFoundError:
+            return True
+        # If the file is already here and it's a symlink, leave it alone.
+        if stat.S_ISLNK(dst_stat.st_mode):
+            return False
+        os.remove(dst)
+        return True
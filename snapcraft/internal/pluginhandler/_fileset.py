@@ -0,0 +1,280 @@
+# -*- Mode:Python; indent-tabs-mode:nil; tab-width:4 -*-
+#
+# Copyright (C) 2017 Canonical Ltd
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import fnmatch
+import os
+import re
+
+_MAGIC = re.compile('[*?[]')
+
+
+class _Node:
+    """A state of the matcher, reached once a path matched its segments."""
+
+    __slots__ = ('literals', 'wildcards', 'globstar', 'is_globstar',
+                 'include', 'include_dirs', 'exclude', 'exclude_dirs',
+                 'has_include', 'has_exclude')
+
+    def __init__(self, is_globstar=False):
+        self.literals = {}
+        # Maps each wildcard segment to its compiled match function, whether
+        # it matches hidden names and the node it leads to.
+        self.wildcards = {}
+        self.globstar = None
+        self.is_globstar = is_globstar
+        # Whether a path reaching this node matches, the _dirs variants only
+        # match directories.
+        self.include = False
+        self.include_dirs = False
+        self.exclude = False
+        self.exclude_dirs = False
+        # Whether a path below this node can still match.
+        self.has_include = False
+        self.has_exclude = False
+
+    def children(self):
+        yield from self.literals.values()
+        for _, _, child in self.wildcards.values():
+            yield child
+        if self.globstar:
+            yield self.globstar
+
+
+class FilesetMatcher:
+    """Include and exclude patterns compiled into a single matcher.
+
+    The patterns of a stage or snap fileset are compiled into a trie of
+    path segments which is applied while walking a directory once. Includes
+    with a '*' and all excludes follow the rules of glob.glob(recursive=True):
+    wildcards do not match hidden names, '**' matches any number of
+    directories and a trailing '/' only matches directories. Other includes
+    are taken literally. Included directories bring in everything below them
+    and excluded directories are not walked at all.
+    """
+
+    def __init__(self, includes, excludes):
+        self._root = _Node()
+        self._literal_includes = []
+        for include in includes:
+            if '*' in include:
+                self._add(include, 'include')
+            else:
+                include = os.path.normpath(include)
+                self._literal_includes.append(include)
+                self._add(include, 'include', literal=True)
+        for exclude in excludes:
+            self._add(exclude, 'exclude')
+        self._mark_reachable(self._root)
+
+    def _add(self, pattern, kind, literal=False):
+        segments = []
+        for segment in pattern.split('/'):
+            if segment in ('', '.'):
+                continue
+            # Consecutive '**' match the same as a single one.
+            if not literal and segment == '**' and segments[-1:] == ['**']:
+                continue
+            segments.append(segment)
+        dirs_only = not literal and pattern.endswith('/')
+        node = self._root
+        for index, segment in enumerate(segments):
+            if not literal and segment == '**':
+                if index == len(segments) - 1:
+                    # Like glob, a trailing '**' also yields the directory
+                    # it starts from.
+                    setattr(node, kind + '_dirs', True)
+                if not node.globstar:
+                    node.globstar = _Node(is_globstar=True)
+                node = node.globstar
+            elif literal or not _MAGIC.search(segment):
+                node = node.literals.setdefault(segment, _Node())
+            else:
+                if segment not in node.wildcards:
+                    node.wildcards[segment] = (
+                        re.compile(fnmatch.translate(segment)).match,
+                        segment.startswith('.'), _Node())
+                node = node.wildcards[segment][2]
+        setattr(node, kind + '_dirs' if dirs_only else kind, True)
+
+    def _mark_reachable(self, node):
+        node.has_include = node.include or node.include_dirs
+        node.has_exclude = node.exclude or node.exclude_dirs
+        for child in node.children():
+            self._mark_reachable(child)
+            node.has_include |= child.has_include
+            node.has_exclude |= child.has_exclude
+
+    @staticmethod
+    def _advance(nodes, name):
+        """Return the nodes matching name and those to match below it."""
+        hidden = name.startswith('.')
+        matched = set()
+        for node in nodes:
+            child = node.literals.get(name)
+            if child:
+                matched.add(child)
+            for match, match_hidden, child in node.wildcards.values():
+                if (match_hidden or not hidden) and match(name):
+                    matched.add(child)
+            if node.is_globstar and not hidden:
+                matched.add(node)
+        # A '**' may match no directory at all, so what follows it is
+        # matched from the same directory.
+        below = [n.globstar for n in matched if n.globstar]
+        return matched, below + list(matched)
+
+    def match(self, directory):
+        """Return the files and directories of directory in the fileset.
+
+        :returns: a tuple of the relative paths of the files (including
+                  symlinks and literal includes that do not exist) and of the
+                  directories to migrate, which contain every parent of
+                  the files.
+        """
+        matches = _Matches()
+
+        root_nodes = {self._root}
+        if self._root.globstar:
+            root_nodes.add(self._root.globstar)
+        # A leading '**' also matches the directory itself.
+        stack = [('', directory, root_nodes, self._root.include_dirs)]
+        while stack:
+            prefix, path, nodes, included = stack.pop()
+            try:
+                entries = list(os.scandir(path))
+            except OSError:
+                continue
+
+            if nodes:
+                subdirs = (self._match_entry(prefix, entry, nodes, included,
+                                             matches)
+                           for entry in entries)
+                stack.extend(subdir for subdir in subdirs if subdir)
+            else:
+                stack.extend(_include_entries(prefix, entries, matches))
+
+        self._add_missing_literal_includes(directory, matches)
+
+        return matches.files, matches.dirs | _parents(matches.files)
+
+    def _match_entry(self, prefix, entry, nodes, included, matches):
+        """Match entry, return what to walk below it if anything."""
+        relpath = prefix + entry.name
+        matched, advanced = self._advance(nodes, entry.name)
+        is_dir = _is_dir(entry)
+
+        if any(n.exclude or (is_dir and n.exclude_dirs) for n in matched):
+            matches.exclude(relpath, is_dir)
+            return None
+
+        is_symlink = entry.is_symlink()
+        entry_included = included or any(
+            n.include or (is_dir and n.include_dirs) for n in matched)
+        if entry_included:
+            matches.include(relpath, is_dir and not is_symlink)
+
+        if not is_dir:
+            return None
+        if is_symlink:
+            # Like glob, follow symlinks to directories when a pattern names
+            # what is inside them, but never expand them as part of an
+            # included tree.
+            entry_included = False
+            advanced = [n for n in advanced if not n.is_globstar]
+        advanced = _nodes_to_walk(advanced, entry_included)
+        if advanced is None:
+            return None
+        return relpath + '/', entry.path, advanced, entry_included
+
+    def _add_missing_literal_includes(self, directory, matches):
+        # Literal includes are migrated even when missing, as long as they
+        # are not excluded.
+        for include in self._literal_includes:
+            if include in matches:
+                continue
+            if os.path.lexists(os.path.join(directory, include)):
+                continue
+            if not any(include.startswith(d + '/')
+                       for d in matches.excluded_dirs):
+                matches.files.add(include)
+
+
+class _Matches:
+    """The paths FilesetMatcher.match() found so far."""
+
+    __slots__ = ('files', 'dirs', 'excluded', 'excluded_dirs')
+
+    def __init__(self):
+        self.files = set()
+        self.dirs = set()
+        self.excluded = set()
+        self.excluded_dirs = []
+
+    def __contains__(self, relpath):
+        return (relpath in self.files or relpath in self.dirs or
+                relpath in self.excluded)
+
+    def include(self, relpath, is_dir):
+        if is_dir:
+            self.dirs.add(relpath)
+        else:
+            self.files.add(relpath)
+
+    def exclude(self, relpath, is_dir):
+        self.excluded.add(relpath)
+        if is_dir:
+            self.excluded_dirs.append(relpath)
+
+
+def _include_entries(prefix, entries, matches):
+    """Include everything below an included directory.
+
+    Nothing is left to exclude below it, the directories to walk are
+    yielded.
+    """
+    for entry in entries:
+        relpath = prefix + entry.name
+        is_dir = entry.is_dir(follow_symlinks=False)
+        matches.include(relpath, is_dir)
+        if is_dir:
+            yield relpath + '/', entry.path, [], True
+
+
+def _is_dir(entry):
+    try:
+        return entry.is_dir()
+    except OSError:
+        return False
+
+
+def _nodes_to_walk(nodes, included):
+    """Return the nodes to match below a directory, None to skip it."""
+    if included:
+        return [n for n in nodes if n.has_exclude]
+    if any(n.has_include for n in nodes):
+        return [n for n in nodes if n.has_include or n.has_exclude]
+    return None
+
+
+def _parents(files):
+    # Make sure we also obtain the parent directories of files
+    parents = set()
+    for snap_file in files:
+        dirname = os.path.dirname(snap_file)
+        while dirname and dirname not in parents:
+            parents.add(dirname)
+            dirname = os.path.dirname(dirname)
+    return parents
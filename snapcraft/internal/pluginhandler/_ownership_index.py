@@ -0,0 +1,131 @@
+# -*- Mode:Python; indent-tabs-mode:nil; tab-width:4 -*-
+#
+# Copyright (C) 2017 Canonical Ltd
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import contextlib
+import json
+import os
+
+# Bumped whenever what is stored changes.
+_INDEX_VERSION = 1
+
+_KINDS = ('files', 'directories')
+
+
+class OwnershipIndex:
+    """The parts owning each file and directory of a shared area.
+
+    Several parts can migrate the same path to the staging or priming
+    area, a path is only removed from it once the last part owning it is
+    cleaned. The index is kept in the parts directory and updated as parts
+    are staged, primed and cleaned, so cleaning a part looks up its own
+    paths instead of going through the state of every other part.
+    """
+
+    def __init__(self, parts_dir, step):
+        self._index_file = os.path.join(
+            parts_dir, '.{}-owners.json'.format(step))
+        self._owners = None
+        self._found = False
+        self._dirty = False
+
+    def _load(self):
+        if self._owners is not None:
+            return
+        self._owners = {kind: {} for kind in _KINDS}
+        with contextlib.suppress(FileNotFoundError, ValueError):
+            with open(self._index_file) as f:
+                index = json.load(f)
+            if index.get('version') == _INDEX_VERSION:
+                for kind in _KINDS:
+                    self._owners[kind] = {
+                        path: set(owners)
+                        for path, owners in index[kind].items()}
+                self._found = True
+
+    def exists(self):
+        """Return whether the index was written before.
+
+        Parts staged or primed before it was written are not in it, see
+        seed().
+        """
+        self._load()
+        return self._found
+
+    def seed(self, project_state):
+        """Add the paths of each part in project_state.
+
+        :param dict project_state: the state of the step for each part, as
+                                   returned by Config.get_project_state().
+        """
+        for part_name, state in project_state.items():
+            if state:
+                self.add(part_name, state.files, state.directories)
+
+    def add(self, part_name, files, directories):
+        """Record part_name as an owner of files and directories."""
+        self._load()
+        for kind, paths in zip(_KINDS, (files, directories)):
+            owners = self._owners[kind]
+            for path in paths:
+                owners.setdefault(path, set()).add(part_name)
+        self._dirty = True
+
+    def release(self, part_name, files, directories):
+        """Drop part_name as an owner of files and directories.
+
+        :returns: the files and directories no part owns anymore, those not
+                  in the index included.
+        :rtype: tuple
+        """
+        self._load()
+        released = []
+        for kind, paths in zip(_KINDS, (files, directories)):
+            owners = self._owners[kind]
+            unowned = set()
+            for path in paths:
+                path_owners = owners.get(path)
+                if path_owners:
+                    path_owners.discard(part_name)
+                if not path_owners:
+                    owners.pop(path, None)
+                    unowned.add(path)
+            released.append(unowned)
+        self._dirty = True
+        return tuple(released)
+
+    def save(self):
+        """Write the index if it changed since loaded."""
+        if not self._dirty:
+            return
+        os.makedirs(os.path.dirname(self._index_file), exist_ok=True)
+        index = {'version': _INDEX_VERSION}
+        for kind in _KINDS:
+            index[kind] = {path: sorted(owners)
+                           for path, owners in self._owners[kind].items()}
+        temp_file = '{}.partial'.format(self._index_file)
+        with open(temp_file, 'w') as f:
+            json.dump(index, f)
+        os.replace(temp_file, self._index_file)
+        self._found = True
+        self._dirty = False
+
+    def clear(self):
+        """Remove the index, along with the shared area it is about."""
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(self._index_file)
+        self._owners = None
+        self._found = False
+        self._dirty = False
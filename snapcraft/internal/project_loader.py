@@ -34,7 +34,6 @@ from snapcraft.internal import (
     pluginhandler,
 )
 from snapcraft._schema import Validator
-from snapcraft.internal.parts import SnapcraftLogicError, get_remote_parts
 
 
 logger = logging.getLogger(__name__)
@@ -100,17 +99,20 @@ class Config:
     def all_parts(self):
         return self.parts.all_parts
 
+    @property
+    def build_tools(self):
+        return self.parts.build_tools
+
     @property
     def _remote_parts(self):
         if getattr(self, '_remote_parts_attr', None) is None:
-            self._remote_parts_attr = get_remote_parts()
+            self._remote_parts_attr = parts.get_remote_parts()
         return self._remote_parts_attr
 
     def __init__(self, project_options=None):
         if project_options is None:
             project_options = snapcraft.ProjectOptions()
 
-        self.build_tools = []
         self._project_options = project_options
 
         self._snapcraft_yaml = get_snapcraft_yaml()
@@ -129,13 +131,13 @@ class Config:
         _ensure_confinement_default(self.data, self._validator.schema)
         _ensure_grade_default(self.data, self._validator.schema)
 
-        self.build_tools = self.data.get('build-packages', [])
-        self.build_tools.extend(project_options.additional_build_packages)
+        build_tools = self.data.get('build-packages', [])
+        build_tools.extend(project_options.additional_build_packages)
 
         self.parts = parts.PartsConfig(self.data,
                                        self._project_options,
                                        self._validator,
-                                       self.build_tools,
+                                       build_tools,
                                        self._snapcraft_yaml)
 
         if 'architectures' not in self.data:
@@ -455,7 +457,7 @@ def _expand_filesets_for(step, properties):
             try:
                 new_step_set.extend(filesets[item[1:]])
             except KeyError:
-                raise SnapcraftLogicError(
+                raise parts.SnapcraftLogicError(
                     '\'{}\' referred to in the \'{}\' fileset but it is not '
                     'in filesets'.format(item, step))
         else:
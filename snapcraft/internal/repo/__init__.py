@@ -22,6 +22,7 @@ from ._base import fix_pkg_config  # noqa
 from ._platform import _get_repo_for_platform
 # Imported for backwards compatibility with plugins
 from ._deb import Ubuntu           # noqa
+from ._deb import get_sources_digest  # noqa
 
 Repo = _get_repo_for_platform()
 
@@ -15,6 +15,7 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import contextlib
+import fcntl
 import glob
 import hashlib
 import logging
@@ -25,6 +26,7 @@ import stat
 import string
 import subprocess
 import sys
+import time
 import urllib
 import urllib.request
 
@@ -33,7 +35,10 @@ from xml.etree import ElementTree
 
 import snapcraft
 from snapcraft import file_utils
-from snapcraft.internal import cache
+from snapcraft.internal import (
+    cache,
+    common,
+)
 from snapcraft.internal.indicators import is_dumb_terminal
 from ._base import BaseRepo
 from . import errors
@@ -54,14 +59,19 @@ deb http://${security}.ubuntu.com/${suffix} ${release}-security multiverse
 '''
 _GEOIP_SERVER = "http://geoip.ubuntu.com/lookup"
 _library_list = dict()
+# The package indexes updated by this process, they are not updated again.
+_updated_cache_dirs = set()
 
 
 class _AptCache:
 
-    def __init__(self, deb_arch, *, sources_list=None, use_geoip=False):
+    def __init__(self, deb_arch, *, sources_list=None, use_geoip=False,
+                 update_ttl=common.DEFAULT_APT_UPDATE_TTL, offline=False):
         self._deb_arch = deb_arch
         self._sources_list = sources_list
         self._use_geoip = use_geoip
+        self._update_ttl = update_ttl
+        self._offline = offline
 
     def _setup_apt(self, cache_dir):
         # Do not install recommends
@@ -122,39 +132,84 @@ class _AptCache:
                 "Cannot find 'dpkg' command needed to support multiarch")
 
         apt_cache = apt.Cache(rootdir=cache_dir, memonly=True)
-        apt_cache.update(fetch_progress=self.progress,
-                         sources_list=sources_list_file)
+        if self._needs_update(cache_dir):
+            apt_cache.update(fetch_progress=self.progress,
+                             sources_list=sources_list_file)
+            open(os.path.join(cache_dir, 'update-stamp'), 'w').close()
+            _updated_cache_dirs.add(cache_dir)
 
         return apt_cache
 
+    def _needs_update(self, cache_dir):
+        # The index is kept in cache_dir, which is only used for the same
+        # sources, it is updated once per process and then once update_ttl
+        # seconds went by.
+        if cache_dir in _updated_cache_dirs:
+            return False
+        updated = _get_index_update_time(cache_dir)
+        if updated is None:
+            if self._offline:
+                raise errors.PackageIndexNotCachedError()
+            return True
+        return (not self._offline and
+                time.time() - updated >= self._update_ttl)
+
+    @property
+    def offline(self):
+        return self._offline
+
     @contextlib.contextmanager
     def archive(self, cache_dir):
-        try:
-            apt_cache = self._setup_apt(cache_dir)
-            apt_cache.open()
-
+        # Parts can be fetched concurrently, only one of them can use the
+        # same cache at a time.
+        os.makedirs(cache_dir, exist_ok=True)
+        with open(os.path.join(cache_dir, 'lock'), 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
             try:
-                yield apt_cache
-            finally:
-                apt_cache.close()
-        except Exception as e:
-            logger.debug('Exception occured: {!r}'.format(e))
-            raise e
+                apt_cache = self._setup_apt(cache_dir)
+                apt_cache.open()
+
+                try:
+                    yield apt_cache
+                finally:
+                    apt_cache.close()
+            except Exception as e:
+                logger.debug('Exception occured: {!r}'.format(e))
+                raise e
 
     def sources_digest(self):
-        return hashlib.sha384(self._collected_sources_list().encode(
-            sys.getfilesystemencoding())).hexdigest()
+        return get_sources_digest(self._collected_sources_list())
 
     def _collected_sources_list(self):
-        if self._use_geoip or self._sources_list:
+        # Offline, the mirror cannot be looked up.
+        use_geoip = self._use_geoip and not self._offline
+        if use_geoip or self._sources_list:
             release = platform.linux_distribution()[2]
             return _format_sources_list(
                 self._sources_list, deb_arch=self._deb_arch,
-                use_geoip=self._use_geoip, release=release)
+                use_geoip=use_geoip, release=release)
 
         return _get_local_sources_list()
 
 
+def _get_index_update_time(cache_dir):
+    """Return when the package index in cache_dir was last updated.
+
+    :returns: the time of the update, None if the index was never updated.
+    """
+    with contextlib.suppress(FileNotFoundError):
+        return os.path.getmtime(os.path.join(cache_dir, 'update-stamp'))
+
+    # Indexes updated before the stamp was written have none, the lists
+    # directory is only written to when updating.
+    lists_dir = os.path.join(cache_dir, 'var', 'lib', 'apt', 'lists')
+    with contextlib.suppress(FileNotFoundError):
+        if set(os.listdir(lists_dir)) - {'partial', 'lock'}:
+            return os.path.getmtime(lists_dir)
+
+    return None
+
+
 class Ubuntu(BaseRepo):
 
     @classmethod
@@ -237,7 +292,9 @@ class Ubuntu(BaseRepo):
 
         self._apt = _AptCache(
             project_options.deb_arch, sources_list=sources,
-            use_geoip=project_options.use_geoip)
+            use_geoip=project_options.use_geoip,
+            update_ttl=project_options.apt_update_ttl,
+            offline=project_options.offline)
 
         self._cache = cache.AptStagePackageCache(
             sources_digest=self._apt.sources_digest())
@@ -313,6 +370,10 @@ class Ubuntu(BaseRepo):
         pkg_list = []
         for package in apt_cache.get_changes():
             pkg_list.append(str(package.candidate))
+            if self._apt.offline and not os.path.exists(os.path.join(
+                    self._cache.packages_dir,
+                    os.path.basename(package.candidate.filename))):
+                raise errors.PackageNotCachedError(str(package.candidate))
             source = package.candidate.fetch_binary(
                 self._cache.packages_dir, progress=self._apt.progress)
             destination = os.path.join(
@@ -347,6 +408,15 @@ class Ubuntu(BaseRepo):
         return manifest_dep_names
 
 
+def get_sources_digest(sources):
+    """Return the digest stage-packages fetched with sources are cached by.
+
+    :param str sources: the apt sources, as in a sources.list.
+    """
+    return hashlib.sha384(
+        sources.encode(sys.getfilesystemencoding())).hexdigest()
+
+
 def _get_local_sources_list():
     sources_list = glob.glob('/etc/apt/sources.list.d/*.list')
     sources_list.append('/etc/apt/sources.list')
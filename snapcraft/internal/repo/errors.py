@@ -46,6 +46,25 @@ class PackageNotFoundError(Exception):
         self.package_name = package_name
 
 
+class PackageIndexNotCachedError(Exception):
+
+    @property
+    def message(self):
+        return ('The package index is not cached yet, run once without '
+                '--offline to fetch it.')
+
+
+class PackageNotCachedError(Exception):
+
+    @property
+    def message(self):
+        return ('The package {!r} is not cached, run once without --offline '
+                'to fetch it.'.format(self.package_name))
+
+    def __init__(self, package_name):
+        self.package_name = package_name
+
+
 class UnpackError(Exception):
 
     @property
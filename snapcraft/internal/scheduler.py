@@ -0,0 +1,166 @@
+# -*- Mode:Python; indent-tabs-mode:nil; tab-width:4 -*-
+#
+# Copyright (C) 2017 Canonical Ltd
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Run a graph of jobs, bounding how many run concurrently.
+
+Jobs assigned to a pool run in forked processes, jobs without a pool run
+in the calling process. Forking keeps the global state snapcraft relies
+upon (e.g. common.env) private to each job.
+"""
+
+import collections
+import multiprocessing
+import multiprocessing.connection
+
+
+_Job = collections.namedtuple(
+    '_Job', ['job_id', 'function', 'requires', 'pool', 'on_done'])
+
+
+class Scheduler:
+
+    def __init__(self, limits):
+        """Create a scheduler.
+
+        :param dict limits: maximum number of concurrent jobs per pool name.
+        """
+        self._limits = limits
+        self._jobs = collections.OrderedDict()
+        self._context = multiprocessing.get_context('fork')
+
+    def add(self, job_id, function, *, requires=(), pool=None, on_done=None):
+        """Add a job to run.
+
+        :param job_id: a hashable identifying the job.
+        :param function: a callable taking no arguments.
+        :param requires: ids of jobs that need to finish first. Ids that
+                         were never added are considered to be done.
+        :param str pool: the pool to run the job on in a child process, or
+                         None to run it in this process.
+        :param on_done: a callable run in this process once the job
+                        succeeds, it receives what the job returned.
+        """
+        if pool is not None and pool not in self._limits:
+            raise ValueError('Unknown pool {!r}'.format(pool))
+        self._jobs[job_id] = _Job(job_id, function, set(requires), pool,
+                                  on_done)
+
+    def __contains__(self, job_id):
+        return job_id in self._jobs
+
+    def run(self):
+        """Run all the jobs, raising the first error found.
+
+        Once a job or its on_done fails no new jobs are started, the ones
+        already running are waited upon.
+        """
+        pending = collections.OrderedDict(self._jobs)
+        done = set()
+        running = {}
+        error = None
+
+        while True:
+            if error is None:
+                error = self._start_ready_jobs(pending, done, running)
+            if not running:
+                break
+            for connection in multiprocessing.connection.wait(list(running)):
+                job, process = running.pop(connection)
+                job_error, result = _receive(connection, process, job)
+                if job_error is None:
+                    job_error = self._job_done(job, done, result)
+                if error is None:
+                    error = job_error
+
+        if error is not None:
+            raise error
+        if pending:
+            raise RuntimeError(
+                'Unable to schedule {}: unsatisfiable requirements'.format(
+                    ', '.join(repr(j) for j in pending)))
+
+    def _start_ready_jobs(self, pending, done, running):
+        progress = True
+        while progress:
+            progress = False
+            busy = collections.Counter(j.pool for j, _ in running.values())
+            for job in list(pending.values()):
+                requires = {r for r in job.requires if r in self._jobs}
+                if not requires.issubset(done):
+                    continue
+                if job.pool is None:
+                    del pending[job.job_id]
+                    try:
+                        result = job.function()
+                    except Exception as e:
+                        return e
+                    error = self._job_done(job, done, result)
+                    if error is not None:
+                        return error
+                    # Finishing this job may have unblocked earlier ones.
+                    progress = True
+                    break
+                if busy[job.pool] < self._limits[job.pool]:
+                    del pending[job.job_id]
+                    busy[job.pool] += 1
+                    connection, process = self._start(job)
+                    running[connection] = (job, process)
+        return None
+
+    def _job_done(self, job, done, result):
+        """Mark job as done, return what its on_done raised if anything."""
+        if job.on_done:
+            try:
+                job.on_done(result)
+            except Exception as e:
+                return e
+        done.add(job.job_id)
+        return None
+
+    def _start(self, job):
+        reader, writer = self._context.Pipe(duplex=False)
+        process = self._context.Process(
+            target=_run_child, args=(job.function, writer))
+        process.start()
+        writer.close()
+        return reader, process
+
+
+def _receive(connection, process, job):
+    try:
+        job_error, result = connection.recv()
+    except EOFError:
+        job_error = RuntimeError(
+            'Job {!r} exited unexpectedly'.format(job.job_id))
+        result = None
+    process.join()
+    connection.close()
+    return job_error, result
+
+
+def _run_child(function, connection):
+    job_error = None
+    result = None
+    try:
+        result = function()
+    except BaseException as e:
+        job_error = e
+    try:
+        connection.send((job_error, result))
+    except Exception:
+        # The exception could not be pickled, keep its message at least.
+        connection.send((RuntimeError(str(job_error)), None))
+    connection.close()
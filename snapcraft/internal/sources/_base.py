@@ -16,9 +16,9 @@
 
 import os
 import requests
-import shutil
 
 import snapcraft.internal.common
+from snapcraft import file_utils
 from snapcraft.internal.indicators import (
     download_requests_stream,
     download_urllib_source
@@ -47,7 +47,7 @@ class FileBase(Base):
         if snapcraft.internal.common.isurl(self.source):
             self.download()
         else:
-            shutil.copy2(self.source, self.source_dir)
+            file_utils.reflink_or_copy(self.source, self.source_dir)
 
         self.provision(self.source_dir)
 
@@ -52,11 +52,17 @@ class Tar(FileBase):
             sources.verify_checksum(self.source_checksum, tarball)
 
         if clean_target:
-            tmp_tarball = tempfile.NamedTemporaryFile().name
-            shutil.move(tarball, tmp_tarball)
-            shutil.rmtree(dst)
-            os.makedirs(dst)
-            shutil.move(tmp_tarball, tarball)
+            # Keep the tarball on the same filesystem so that moving it
+            # around is a rename rather than a copy.
+            tmp_dir = tempfile.mkdtemp(dir=os.path.dirname(dst))
+            tmp_tarball = os.path.join(tmp_dir, os.path.basename(tarball))
+            try:
+                shutil.move(tarball, tmp_tarball)
+                shutil.rmtree(dst)
+                os.makedirs(dst)
+                shutil.move(tmp_tarball, tarball)
+            finally:
+                shutil.rmtree(tmp_dir, ignore_errors=True)
 
         self._extract(tarball, dst)
 
@@ -0,0 +1,224 @@
+# -*- Mode:Python; indent-tabs-mode:nil; tab-width:4 -*-
+#
+# Copyright (C) 2017 Canonical Ltd
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""How snaps are packed with mksquashfs."""
+
+import collections
+import contextlib
+import json
+import os
+import re
+import subprocess
+
+from snapcraft.internal import errors
+
+Profile = collections.namedtuple('Profile', ['description', 'options'])
+
+# The release profile needs to match the review tools:
+# http://bazaar.launchpad.net/~click-reviewers/click-reviewers-tools/trunk/view/head:/clickreviews/common.py#L38
+PROFILES = collections.OrderedDict([
+    ('release', Profile('xz, as required by the store', ['-comp', 'xz'])),
+    # gzip is supported by every kernel snapd runs on, at its lowest level
+    # it packs many times faster than xz.
+    ('dev', Profile('gzip at its fastest, for local testing only',
+                    ['-comp', 'gzip', '-Xcompression-level', '1'])),
+])
+
+DEFAULT_PROFILE = 'release'
+
+_BLOCK_SIZE = re.compile(r'^([0-9]+)([KM]?)$', re.IGNORECASE)
+_BLOCK_SIZE_UNITS = {'': 1, 'k': 1024, 'm': 1024 * 1024}
+_MIN_BLOCK_SIZE = 4 * 1024
+_MAX_BLOCK_SIZE = 1024 * 1024
+
+# The first version able to set the time of every file, and to pack in the
+# same order whatever the number of processors used.
+_REPRODUCIBLE_VERSION = (4, 4)
+
+_VERSION = re.compile(r'^mksquashfs version ([0-9]+(\.[0-9]+)*)')
+
+# Bumped whenever what is stored in a packing order file changes.
+_ORDER_VERSION = 1
+
+# The highest priority of a sort file, files are packed by decreasing
+# priority and those not listed have a priority of 0.
+_MAX_PRIORITY = 32767
+
+
+def get_mksquashfs_version():
+    """Return the version of mksquashfs as a tuple of ints, () if unknown."""
+    try:
+        output = subprocess.check_output(
+            ['mksquashfs', '-version'], stderr=subprocess.STDOUT)
+    except (OSError, subprocess.CalledProcessError):
+        return ()
+    match = _VERSION.match(output.decode('utf-8', errors='replace'))
+    if not match:
+        return ()
+    return tuple(int(n) for n in match.group(1).split('.'))
+
+
+def get_source_date_epoch():
+    """Return the time reproducible snaps are packed with.
+
+    That is SOURCE_DATE_EPOCH, see
+    https://reproducible-builds.org/specs/source-date-epoch/, or 0 if it is
+    not set.
+
+    :raises snapcraft.internal.errors.InvalidSourceDateEpochError: if it is
+        not a number of seconds.
+    """
+    value = os.environ.get('SOURCE_DATE_EPOCH', '0')
+    if not re.match(r'^[0-9]+$', value):
+        raise errors.InvalidSourceDateEpochError(value=value)
+    return int(value)
+
+
+def get_mksquashfs_args(*, profile=DEFAULT_PROFILE, snap_type='app',
+                        processors=None, block_size=None, timestamp=None,
+                        sort_file=None, version=None):
+    """Return the mksquashfs options to pack a snap.
+
+    :param str profile: one of PROFILES.
+    :param str snap_type: the type of the snap, os snaps keep the owners of
+                          their files.
+    :param int processors: the number of processors mksquashfs uses, all of
+                           them if None.
+    :param str block_size: the size of the blocks compressed, in bytes or
+                           with a K or M suffix, the mksquashfs default if
+                           None.
+    :param int timestamp: if set, the snap is packed reproducibly with this
+                          time as that of its creation and of every file.
+    :param str sort_file: the -sort file setting the order files are
+                          packed in, see PackingOrder.
+    :param tuple version: the version of mksquashfs the options are for, as
+                          returned by get_mksquashfs_version(), a recent one
+                          if None. Older ones can't pack as reproducibly.
+    :raises snapcraft.internal.errors.InvalidPackingProfileError: if
+        profile is unknown.
+    :raises snapcraft.internal.errors.InvalidBlockSizeError: if block_size
+        is not usable by mksquashfs.
+    """
+    if profile not in PROFILES:
+        raise errors.InvalidPackingProfileError(
+            profile=profile, profiles=', '.join(PROFILES))
+
+    args = ['-noappend'] + PROFILES[profile].options + ['-no-xattrs']
+    if snap_type != 'os':
+        args.append('-all-root')
+    if timestamp is not None:
+        if version is None or is_reproducible(version):
+            args.extend(['-reproducible', '-mkfs-time', str(timestamp),
+                         '-all-time', str(timestamp)])
+        else:
+            # Fragments are packed in the order processors finish them.
+            processors = 1
+    if sort_file:
+        args.extend(['-sort', sort_file])
+    if processors:
+        args.extend(['-processors', str(processors)])
+    if block_size:
+        args.extend(['-b', str(_parse_block_size(block_size))])
+    return args
+
+
+def _parse_block_size(block_size):
+    match = _BLOCK_SIZE.match(str(block_size))
+    if match:
+        size = (int(match.group(1)) *
+                _BLOCK_SIZE_UNITS[match.group(2).lower()])
+        # mksquashfs only takes powers of 2.
+        if (_MIN_BLOCK_SIZE <= size <= _MAX_BLOCK_SIZE and
+                not size & (size - 1)):
+            return size
+    raise errors.InvalidBlockSizeError(block_size=block_size)
+
+
+def is_reproducible(version):
+    """Return whether mksquashfs version packs reproducibly."""
+    return version >= _REPRODUCIBLE_VERSION
+
+
+class PackingOrder:
+    """The order files are packed in, kept from one snap to the next.
+
+    Files first packed together are given the same priority in the -sort
+    file, lower than that of files packed before them. The data of files
+    that are still there stays in the same order when files are added, so
+    the snaps differ little more than the files do and deltas between them
+    are small.
+    """
+
+    def __init__(self, order_file):
+        self._order_file = order_file
+        self._generations = None
+
+    def _load(self):
+        if self._generations is not None:
+            return
+        self._generations = {}
+        with contextlib.suppress(FileNotFoundError, ValueError):
+            with open(self._order_file) as f:
+                order = json.load(f)
+            if order.get('version') == _ORDER_VERSION:
+                self._generations = order['generations']
+
+    def write_sort_file(self, directory, sort_file):
+        """Write the -sort file to pack the files in directory in order.
+
+        Files new to this order are packed after the others.
+        """
+        self._load()
+        paths = _get_sortable_files(directory)
+        generations = {p: g for p, g in self._generations.items()
+                       if p in paths}
+        new_paths = paths.difference(generations)
+        if new_paths:
+            generation = max(generations.values(), default=-1) + 1
+            if generation > _MAX_PRIORITY:
+                # Out of priorities, start over keeping the current order.
+                generations = dict.fromkeys(generations, 0)
+                generation = 1
+            generations.update(dict.fromkeys(new_paths, generation))
+        self._generations = generations
+
+        with open(sort_file, 'w') as f:
+            for path in sorted(paths):
+                f.write('{} {}\n'.format(
+                    path, _MAX_PRIORITY - generations[path]))
+
+    def save(self):
+        self._load()
+        os.makedirs(os.path.dirname(self._order_file), exist_ok=True)
+        temp_file = '{}.partial'.format(self._order_file)
+        with open(temp_file, 'w') as f:
+            json.dump({'version': _ORDER_VERSION,
+                       'generations': self._generations}, f)
+        os.replace(temp_file, self._order_file)
+
+
+def _get_sortable_files(directory):
+    # Only regular files have data to order. mksquashfs reads a path and a
+    # priority separated by spaces, paths with whitespace are left out.
+    paths = set()
+    for root, _, files in os.walk(directory):
+        for name in files:
+            path = os.path.join(root, name)
+            relative_path = os.path.relpath(path, directory)
+            if (os.path.isfile(path) and not os.path.islink(path) and
+                    not re.search(r'\s', relative_path)):
+                paths.add(relative_path)
+    return paths
@@ -0,0 +1,232 @@
+# -*- Mode:Python; indent-tabs-mode:nil; tab-width:4 -*-
+#
+# Copyright (C) 2017 Canonical Ltd
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import contextlib
+import functools
+import json
+import os
+
+import yaml
+
+from snapcraft.internal import common
+
+# Marks a step known to have run but whose state hasn't been read yet.
+_NOT_LOADED = object()
+
+# Bumped whenever the layout of the file lists changes.
+_FILE_LISTS_VERSION = 1
+
+# The C loader and dumper are used if PyYAML was built with them, they are
+# much faster with big states. The tags of the states are registered with
+# the pure Python ones, they are copied when first needed.
+_yaml_classes = {}
+
+
+def _get_yaml_class(name, c_name):
+    if name not in _yaml_classes:
+        base = getattr(yaml, name)
+        attributes = {}
+        for registry in ('yaml_constructors', 'yaml_multi_constructors',
+                         'yaml_representers', 'yaml_multi_representers'):
+            if hasattr(base, registry):
+                attributes[registry] = dict(getattr(base, registry))
+        yaml_class = type('_State' + name, (getattr(yaml, c_name, base),),
+                          attributes)
+        if hasattr(yaml_class, 'yaml_representers'):
+            for cls in list(yaml_class.yaml_representers):
+                if getattr(cls, 'file_lists', None):
+                    yaml_class.add_representer(cls, _represent_state)
+        _yaml_classes[name] = yaml_class
+    return _yaml_classes[name]
+
+
+def _deferred_name(step):
+    return '{}.deferred'.format(step)
+
+
+def _represent_state(dumper, state):
+    # The file lists are written next to the state, see PartStates.set().
+    fields = state.__getstate__()
+    for name in state.file_lists:
+        fields.pop(name, None)
+    return dumper.represent_mapping(state.yaml_tag, fields)
+
+
+class PartStates:
+    """The states of the steps of a part, kept in memory.
+
+    The state directory is listed once, the state of a step is read the
+    first time it's asked for. Changes are written through to the state
+    directory, one file per step, so states written by older versions of
+    snapcraft are read as they are. The manifest of the files of a step,
+    if its state has one, is written next to it as JSON.
+
+    The lists of files and directories of a state are also written next to
+    it, as JSON lines, and only read when used: a header followed by one
+    list per line.
+    """
+
+    def __init__(self, statedir):
+        self._statedir = statedir
+        self._states = None
+
+    def _load(self):
+        if self._states is None:
+            self._states = {}
+            if os.path.isdir(self._statedir):
+                for step in os.listdir(self._statedir):
+                    if step in common.COMMAND_ORDER:
+                        self._states[step] = _NOT_LOADED
+
+        return self._states
+
+    def reload(self):
+        """Forget what is in memory, e.g. if another process ran a step."""
+
+        self._states = None
+
+    def has_run(self, step):
+        return step in self._load()
+
+    def get(self, step):
+        states = self._load()
+        state = states.get(step)
+        if state is _NOT_LOADED:
+            state = self._read(step)
+            states[step] = state
+
+        return state
+
+    def get_deferred(self, step):
+        """Return the state step had when set aside by defer(), or None."""
+
+        name = _deferred_name(step)
+        if not os.path.exists(self._state_file(name)):
+            return None
+        return self._read(name)
+
+    def _read(self, name):
+        with open(self._state_file(name), 'r') as f:
+            state = yaml.load(f.read(),
+                              Loader=_get_yaml_class('Loader', 'CLoader'))
+        file_lists = getattr(state, 'file_lists', ())
+        # States written by older versions of snapcraft have them.
+        if file_lists and file_lists[0] not in vars(state):
+            state.defer_file_lists(
+                functools.partial(self._read_file_lists, name))
+        if hasattr(state, 'manifest'):
+            with contextlib.suppress(FileNotFoundError):
+                with open(self._manifest_file(name)) as f:
+                    state.manifest = json.load(f)
+        return state
+
+    def set(self, step, state):
+        states = self._load()
+        manifest = getattr(state, 'manifest', None)
+        if manifest is None:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(self._manifest_file(step))
+        else:
+            with open(self._manifest_file(step), 'w') as f:
+                json.dump(manifest, f)
+        file_lists = getattr(state, 'file_lists', ())
+        if file_lists:
+            self._write_file_lists(step, state, file_lists)
+        else:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(self._file_lists_file(step))
+        with open(self._state_file(step), 'w') as f:
+            f.write(yaml.dump(state,
+                              Dumper=_get_yaml_class('Dumper', 'CDumper')))
+        # Read it back when needed, so that it's the same as what another
+        # invocation would get.
+        states[step] = _NOT_LOADED
+
+    def remove(self, step):
+        states = self._load()
+        self._load_file_lists(states.get(step))
+        for path in self._files(step):
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(path)
+        states.pop(step, None)
+        self._remove_statedir_if_empty()
+
+    def defer(self, step):
+        """Set the state of step aside, the step is then clean.
+
+        What it describes is still in place, its files are either used when
+        the step runs again, see get_deferred(), or removed along with it,
+        see remove_deferred(). The files of the state directory are renamed,
+        so that this holds across invocations.
+        """
+        states = self._load()
+        self._load_file_lists(states.get(step))
+        for path, deferred_path in zip(self._files(step),
+                                       self._files(_deferred_name(step))):
+            try:
+                os.replace(path, deferred_path)
+            except FileNotFoundError:
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(deferred_path)
+        states.pop(step, None)
+
+    def remove_deferred(self, step):
+        for path in self._files(_deferred_name(step)):
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(path)
+        self._remove_statedir_if_empty()
+
+    def _load_file_lists(self, state):
+        if state is not _NOT_LOADED and hasattr(state, 'load_file_lists'):
+            # It may still be used, e.g. to clean what it describes.
+            state.load_file_lists()
+
+    def _remove_statedir_if_empty(self):
+        if os.path.isdir(self._statedir) and not os.listdir(self._statedir):
+            os.rmdir(self._statedir)
+
+    def _files(self, name):
+        return (self._state_file(name), self._manifest_file(name),
+                self._file_lists_file(name))
+
+    def _state_file(self, step):
+        return os.path.join(self._statedir, step)
+
+    def _manifest_file(self, step):
+        return os.path.join(self._statedir, '{}.manifest.json'.format(step))
+
+    def _file_lists_file(self, step):
+        return os.path.join(self._statedir, '{}.files'.format(step))
+
+    def _write_file_lists(self, step, state, file_lists):
+        with open(self._file_lists_file(step), 'w') as f:
+            f.write(json.dumps({'version': _FILE_LISTS_VERSION,
+                                'lists': list(file_lists)}) + '\n')
+            for name in file_lists:
+                f.write(json.dumps(sorted(getattr(state, name))) + '\n')
+
+    def _read_file_lists(self, step):
+        # Nothing is returned if they can't be read, the state is then
+        # missing them like a state too old to be used.
+        try:
+            with open(self._file_lists_file(step)) as f:
+                header = json.loads(f.readline())
+                if header.get('version') != _FILE_LISTS_VERSION:
+                    return {}
+                return {name: set(json.loads(f.readline()))
+                        for name in header['lists']}
+        except (OSError, ValueError):
+            return {}
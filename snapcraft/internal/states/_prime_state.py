@@ -28,13 +28,19 @@ yaml.add_constructor(u'!PrimeState', _prime_state_constructor)
 
 class PrimeState(State):
     yaml_tag = u'!PrimeState'
+    file_lists = ('files', 'directories')
+    # States written by older versions of snapcraft don't have one.
+    manifest = None
 
     def __init__(self, files, directories, dependency_paths=None,
-                 part_properties=None, project=None):
+                 part_properties=None, project=None, manifest=None):
         super().__init__(part_properties, project)
 
         self.files = files
         self.directories = directories
+        if manifest is not None:
+            # The size, modification time and inode of each file when primed.
+            self.manifest = manifest
         self.dependency_paths = set()
 
         if dependency_paths:
@@ -28,12 +28,19 @@ yaml.add_constructor(u'!StageState', _stage_state_constructor)
 
 class StageState(State):
     yaml_tag = u'!StageState'
+    file_lists = ('files', 'directories')
+    # States written by older versions of snapcraft don't have one.
+    manifest = None
 
-    def __init__(self, files, directories, part_properties=None, project=None):
+    def __init__(self, files, directories, part_properties=None, project=None,
+                 manifest=None):
         super().__init__(part_properties, project)
 
         self.files = files
         self.directories = directories
+        if manifest is not None:
+            # The size, modification time and inode of each file when staged.
+            self.manifest = manifest
 
     def properties_of_interest(self, part_properties):
         """Extract the properties concerning this step from part_properties.
@@ -18,6 +18,10 @@ import yaml
 
 
 class State(yaml.YAMLObject):
+    # Attributes holding lists of paths. PartStates keeps them out of the
+    # YAML, they are read the first time they are used.
+    file_lists = ()
+
     def __init__(self, part_properties, project):
         if not part_properties:
             part_properties = {}
@@ -51,8 +55,43 @@ class State(yaml.YAMLObject):
             self.project_options, self.project_options_of_interest(
                 other_project_options))
 
+    def __getattr__(self, name):
+        # Only called for attributes that aren't set, such as file lists
+        # not read yet.
+        loader = self.__dict__.get('_file_lists_loader')
+        if loader and name in self.file_lists:
+            self.load_file_lists()
+            if name in self.__dict__:
+                return self.__dict__[name]
+        raise AttributeError(
+            '{!r} object has no attribute {!r}'.format(
+                self.__class__.__name__, name))
+
+    def defer_file_lists(self, loader):
+        """Read the file lists with loader when they are first used.
+
+        :param callable loader: returns a dict of each file list.
+        """
+        self._file_lists_loader = loader
+
+    def load_file_lists(self):
+        """Read the file lists now if they were deferred."""
+        loader = self.__dict__.pop('_file_lists_loader', None)
+        if loader:
+            self.__dict__.update(loader())
+
+    def _fields(self):
+        self.load_file_lists()
+        return self.__dict__
+
+    def __getstate__(self):
+        # The manifest of files is big, PartStates keeps it out of the YAML.
+        state = self._fields().copy()
+        state.pop('manifest', None)
+        return state
+
     def __repr__(self):
-        items = sorted(self.__dict__.items())
+        items = sorted(self._fields().items())
         strings = (': '.join((key, repr(value))) for key, value in items)
         representation = ', '.join(strings)
 
@@ -60,7 +99,7 @@ class State(yaml.YAMLObject):
 
     def __eq__(self, other):
         if type(other) is type(self):
-            return self.__dict__ == other.__dict__
+            return self._fields() == other._fields()
 
         return False
 
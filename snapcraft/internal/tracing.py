@@ -0,0 +1,153 @@
+# -*- Mode:Python; indent-tabs-mode:nil; tab-width:4 -*-
+#
+# Copyright (C) 2017 Canonical Ltd
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Record a timeline of what snapcraft does in the trace event format.
+
+The result can be loaded in chrome://tracing or https://ui.perfetto.dev.
+While tracing, events are appended as JSON lines to a temporary file so
+that processes forked to run parts concurrently can record theirs too,
+the process that started tracing turns them into the final trace when
+stopping.
+"""
+
+import contextlib
+import json
+import os
+import resource
+import threading
+import time
+
+# Set while tracing: the trace file, the file events are appended to, its
+# descriptor and the process that started tracing.
+_trace = None
+
+
+class _Trace:
+
+    def __init__(self, path):
+        self.path = path
+        self.events_path = '{}.events'.format(path)
+        self.fd = os.open(self.events_path,
+                          os.O_WRONLY | os.O_CREAT | os.O_TRUNC | os.O_APPEND,
+                          0o644)
+        self.pid = os.getpid()
+
+
+def start(path):
+    """Start recording a trace into path."""
+    global _trace
+
+    stop()
+    _trace = _Trace(path)
+    _record(dict(name='process_name', ph='M', tid=0,
+                 args=dict(name='snapcraft')))
+
+
+def stop():
+    """Stop tracing and write the trace file.
+
+    Processes forked while tracing only stop recording events.
+    """
+    global _trace
+
+    trace = _trace
+    _trace = None
+    if not trace:
+        return
+
+    os.close(trace.fd)
+    if trace.pid != os.getpid():
+        return
+
+    with open(trace.events_path) as f:
+        events = [json.loads(line) for line in f if line.strip()]
+    os.remove(trace.events_path)
+    with open(trace.path, 'w') as f:
+        json.dump(dict(traceEvents=events, displayTimeUnit='ms'), f)
+
+
+def is_enabled():
+    return _trace is not None
+
+
+@contextlib.contextmanager
+def span(name, category='snapcraft', **args):
+    """Record the time spent running the body of the with statement.
+
+    :param str name: the name shown for the span.
+    :param str category: a comma separated list of categories.
+    :param args: additional information shown with the span.
+    """
+    if not _trace:
+        yield
+        return
+
+    start_time = _now()
+    try:
+        yield
+    finally:
+        _record(dict(name=name, cat=category, ph='X', ts=start_time,
+                     dur=_now() - start_time, args=args))
+
+
+@contextlib.contextmanager
+def process(command):
+    """Record a span for running command, along with its resource usage.
+
+    The resources used by the child processes that were waited upon while
+    running the body are recorded: CPU time and bytes read and written from
+    and to disk.
+
+    :param list command: the command being run.
+    """
+    if not _trace:
+        yield
+        return
+
+    start_time = _now()
+    before = resource.getrusage(resource.RUSAGE_CHILDREN)
+    try:
+        yield
+    finally:
+        after = resource.getrusage(resource.RUSAGE_CHILDREN)
+        args = _usage(before, after)
+        args['command'] = ' '.join(str(c) for c in command)
+        _record(dict(name=os.path.basename(str(command[0])),
+                     cat='process', ph='X', ts=start_time,
+                     dur=_now() - start_time, args=args))
+
+
+def _usage(before, after):
+    # Block counts are in 512 byte units.
+    return dict(
+        user_time=round(after.ru_utime - before.ru_utime, 6),
+        system_time=round(after.ru_stime - before.ru_stime, 6),
+        bytes_read=(after.ru_inblock - before.ru_inblock) * 512,
+        bytes_written=(after.ru_oublock - before.ru_oublock) * 512,
+    )
+
+
+def _now():
+    # The monotonic clock is shared by forked processes, so the spans they
+    # record line up.
+    return int(time.monotonic() * 1000000)
+
+
+def _record(event):
+    event.update(pid=os.getpid(), tid=event.get('tid', threading.get_ident()))
+    # A single write to a file opened for appending is not interleaved
+    # with those from other processes.
+    os.write(_trace.fd, (json.dumps(event, default=str) + '\n').encode())
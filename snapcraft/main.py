@@ -26,9 +26,9 @@ Usage:
   snapcraft [options] stage [<part> ...]
   snapcraft [options] prime [<part> ...]
   snapcraft [options] strip [<part> ...]
-  snapcraft [options] clean [<part> ...] [--step <step>]
+  snapcraft [options] clean [<part> ...] [--step <step> --from-scratch]
   snapcraft [options] snap [<directory> --output <snap-file>]
-  snapcraft [options] cleanbuild [--remote=<remote>]
+  snapcraft [options] cleanbuild [--remote=<remote> --cached-image]
   snapcraft [options] login
   snapcraft [options] logout
   snapcraft [options] list-registered
@@ -70,29 +70,79 @@ Options:
   --target-arch ARCH                    EXPERIMENTAL: sets the target
                                         architecture. Very few plugins support
                                         this.
+  --trace <trace-file>                  record a timeline of the steps run
+                                        for each part and of the commands
+                                        they run into <trace-file>, to be
+                                        loaded in chrome://tracing.
 
 Options specific to cleanbuild:
   --remote <remote> Use a specific lxd remote to run the cleanbuild on.
                     This requires prior setup which is described on:
                     https://linuxcontainers.org/lxd/getting-started-cli/#multiple-hosts
+  --cached-image    Build from an image with snapcraft and the build
+                    packages installed, published on the remote by the
+                    first cleanbuild using it and prepared again once a
+                    week old. Delete it with `lxc image delete` to
+                    prepare it sooner.
 
 Options specific to pulling:
   --enable-geoip         enables geoip for the pull step if stage-packages
                          are used.
+  --apt-update-ttl <s>   reuse the package index stage-packages are fetched
+                         with for <s> seconds before updating it again, it
+                         is updated at most once per run
+                         [default: {DEFAULT_APT_UPDATE_TTL}].
+  --offline              fetch stage-packages from the cached package index
+                         and packages only, without updating the index. It
+                         cannot be used with --enable-geoip.
 
 Options specific to building:
   --no-parallel-build                   use only a single build job per part
                                         (the default number of jobs per part is
                                         equal to the number of CPUs)
+  -j <jobs>, --jobs <jobs>              number of parts to build
+                                        concurrently, parts are still staged
+                                        before the parts that come after
+                                        them [default: 1].
+  --fetch-jobs <jobs>                   when there is more than one part to
+                                        pull, number of sources and
+                                        stage-packages to download at the
+                                        same time [default: 4].
+  --enable-build-cache                  reuse the result of building a part
+                                        with the same sources, properties and
+                                        dependencies from a local cache
+                                        instead of building it again.
 
 Options specific to cleaning:
   -s <step>, --step <step>              only clean the specified step and those
                                         that depend upon it. <step> can be one
                                         of: pull, build, stage or prime.
+  --from-scratch                        when cleaning the build step, remove
+                                        what was built instead of building
+                                        upon it, and everything staged and
+                                        primed instead of only migrating
+                                        what changed.
 
 Options specific to snapping:
   -o <snap-file>, --output <snap-file>  used in case you want to rename the
                                         snap.
+  --profile <profile>                   how to pack the snap: release, with
+                                        the compression the store requires,
+                                        or dev, many times faster to pack
+                                        for local testing [default: release].
+  --processors <n>                      number of processors used to pack
+                                        the snap (default is all of them).
+  --block-size <size>                   size of the blocks compressed when
+                                        packing the snap, a power of 2 from
+                                        4K to 1M (default is 128K).
+  --compression-report                  pack the snap with each profile and
+                                        report their size and time taken,
+                                        instead of snapping.
+  --reproducible                        pack the same snap from the same
+                                        files, with times set from
+                                        SOURCE_DATE_EPOCH (default is 0) and
+                                        files kept in the order they were
+                                        first packed in.
 
 Options specific to store interaction:
   --release <channels>  Comma separated list of channels to release to.
@@ -164,18 +214,17 @@ import sys
 from docopt import docopt
 
 import snapcraft
-from snapcraft.integrations import enable_ci
 from snapcraft.internal import (
     deprecations,
-    lifecycle,
     log,
-    parts,
+    tracing,
 )
 from snapcraft.internal.common import (
+    DEFAULT_APT_UPDATE_TTL,
+    DEFAULT_SERIES,
     format_output_in_columns,
     get_terminal_width,
     get_tourdir)
-from snapcraft.storeapi.constants import DEFAULT_SERIES
 
 
 logger = logging.getLogger(__name__)
@@ -227,12 +276,47 @@ def _get_project_options(args):
     options['parallel_builds'] = not args['--no-parallel-build']
     options['target_deb_arch'] = args['--target-arch']
     options['debug'] = args['--debug']
+    options['parallel_part_count'] = _get_jobs(args, '--jobs')
+    options['parallel_fetch_count'] = _get_jobs(args, '--fetch-jobs')
+    options['use_build_cache'] = args['--enable-build-cache']
+    options['apt_update_ttl'] = _get_apt_update_ttl(args)
+    options['offline'] = args['--offline']
+    if options['offline'] and options['use_geoip']:
+        # The mirror geoip picks is looked up on the network.
+        raise SystemExit('--offline cannot be used with --enable-geoip')
 
     return snapcraft.ProjectOptions(**options)
 
 
+def _get_apt_update_ttl(args):
+    try:
+        ttl = int(args['--apt-update-ttl'])
+    except ValueError:
+        ttl = -1
+    if ttl < 0:
+        raise SystemExit(
+            '--apt-update-ttl needs to be a number of seconds, '
+            'not {!r}'.format(args['--apt-update-ttl']))
+
+    return ttl
+
+
+def _get_jobs(args, option):
+    try:
+        jobs = int(args[option])
+    except ValueError:
+        jobs = 0
+    if jobs < 1:
+        raise SystemExit(
+            '{} needs to be a positive integer, not {!r}'.format(
+                option, args[option]))
+
+    return jobs
+
+
 def main(argv=None):
-    doc = __doc__.format(DEFAULT_SERIES=DEFAULT_SERIES)
+    doc = __doc__.format(DEFAULT_SERIES=DEFAULT_SERIES,
+                         DEFAULT_APT_UPDATE_TTL=DEFAULT_APT_UPDATE_TTL)
     args = docopt(doc, version=snapcraft.__version__, argv=argv)
 
     # Default log level is INFO unless --debug is specified
@@ -249,6 +333,8 @@ def main(argv=None):
     if args['strip']:
         logger.warning("DEPRECATED: use 'prime' instead of 'strip'")
         args['prime'] = True
+    if args['--trace']:
+        tracing.start(args['--trace'])
     try:
         return run(args, project_options)
     except Exception as e:
@@ -257,6 +343,8 @@ def main(argv=None):
 
         logger.error(str(e))
         sys.exit(1)
+    finally:
+        tracing.stop()
 
 
 def _get_lifecycle_command(args):
@@ -267,9 +355,14 @@ def _get_lifecycle_command(args):
     return lifecycle_command[0]
 
 
+def _init():
+    from snapcraft.internal import lifecycle
+    lifecycle.init()
+
+
 def _get_command_from_arg(args):
     functions = {
-        'init': lifecycle.init,
+        'init': _init,
         'login': snapcraft.login,
         'logout': snapcraft.logout,
         'list-plugins': _list_plugins,
@@ -282,9 +375,12 @@ def _get_command_from_arg(args):
 
 
 def run(args, project_options):  # noqa
+    # The lifecycle and parts modules bring in most of snapcraft and its
+    # dependencies, they are only imported by the commands needing them.
     lifecycle_command = _get_lifecycle_command(args)
     argless_command = _get_command_from_arg(args)
     if lifecycle_command:
+        from snapcraft.internal import lifecycle
         lifecycle.execute(
             lifecycle_command, project_options, args['<part>'])
     elif argless_command:
@@ -292,7 +388,9 @@ def run(args, project_options):  # noqa
     elif args['clean']:
         _run_clean(args, project_options)
     elif args['cleanbuild']:
-        lifecycle.cleanbuild(project_options, remote=args['--remote']),
+        from snapcraft.internal import lifecycle
+        lifecycle.cleanbuild(project_options, remote=args['--remote'],
+                             cached_image=args['--cached-image'])
     elif _is_store_command(args):
         _run_store_command(args)
     elif args['tour']:
@@ -301,26 +399,49 @@ def run(args, project_options):  # noqa
         snapcraft.topic_help(args['<topic>'] or args['<plugin>'],
                              args['--devel'], args['topics'])
     elif args['enable-ci']:
+        from snapcraft.integrations import enable_ci
         enable_ci(args['<ci-system>'], args['--refresh'])
     elif args['update']:
+        from snapcraft.internal import parts
         parts.update()
     elif args['define']:
+        from snapcraft.internal import parts
         parts.define(args['<part-name>'])
     elif args['search']:
+        from snapcraft.internal import parts
         parts.search(' '.join(args['<query>']))
     else:  # snap by default:
-        lifecycle.snap(project_options, args['<directory>'], args['--output'])
+        _run_snap(args, project_options)
 
     return project_options
 
 
+def _run_snap(args, project_options):
+    from snapcraft.internal import lifecycle
+    processors = None
+    if args['--processors']:
+        processors = _get_jobs(args, '--processors')
+    if args['--compression-report']:
+        lifecycle.compression_report(
+            project_options, args['<directory>'], processors=processors,
+            block_size=args['--block-size'])
+    else:
+        lifecycle.snap(
+            project_options, args['<directory>'], args['--output'],
+            profile=args['--profile'], processors=processors,
+            block_size=args['--block-size'],
+            reproducible=args['--reproducible'])
+
+
 def _run_clean(args, project_options):
     step = args['--step']
     if step == 'strip':
         logger.warning('DEPRECATED: Use `prime` instead of `strip` '
                        'as the step to clean')
         step = 'prime'
-    lifecycle.clean(project_options, args['<part>'], step)
+    from snapcraft.internal import lifecycle
+    lifecycle.clean(project_options, args['<part>'], step,
+                    from_scratch=args['--from-scratch'])
 
 
 def _is_store_command(args):
@@ -15,10 +15,9 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 from __future__ import absolute_import, unicode_literals
 
+# Defined along the CLI so that it does not need the store to start.
+from snapcraft.internal.common import DEFAULT_SERIES  # noqa
 
-# FIXME: snapcraft targets the '16' series, hardcode it until more choices
-# become available server side -- vila 2016-04-22
-DEFAULT_SERIES = '16'
 SCAN_STATUS_POLL_DELAY = 5
 SCAN_STATUS_POLL_RETRIES = 5
 UBUNTU_SSO_API_ROOT_URL = 'https://login.ubuntu.com/api/v2/'
@@ -0,0 +1,126 @@
+# -*- Mode:Python; indent-tabs-mode:nil; tab-width:4 -*-
+#
+# Copyright (C) 2017 Canonical Ltd
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+
+from testtools.matchers import FileContains
+
+from snapcraft import tests
+from snapcraft.internal import cache, states
+
+
+class BuildCacheTestCase(tests.TestCase):
+
+    def setUp(self):
+        super().setUp()
+
+        self.installdir = os.path.join(self.path, 'install')
+        os.makedirs(os.path.join(self.installdir, 'bin'))
+        with open(os.path.join(self.installdir, 'bin', 'foo'), 'w') as f:
+            f.write('foo')
+        os.symlink('foo', os.path.join(self.installdir, 'bin', 'bar'))
+
+        self.state = states.BuildState([], {}, None)
+        self.build_cache = cache.BuildCache()
+
+    def test_get_missing_entry(self):
+        self.assertIsNone(self.build_cache.get(fingerprint='missing'))
+
+    def test_cache_and_restore(self):
+        self.build_cache.cache(fingerprint='fingerprint',
+                               installdir=self.installdir, state=self.state)
+
+        self.assertEqual(
+            self.state, self.build_cache.get(fingerprint='fingerprint'))
+
+        restored = os.path.join(self.path, 'restored')
+        self.build_cache.restore(fingerprint='fingerprint',
+                                 installdir=restored)
+
+        self.assertThat(os.path.join(restored, 'bin', 'foo'),
+                        FileContains('foo'))
+        self.assertEqual(
+            'foo', os.readlink(os.path.join(restored, 'bin', 'bar')))
+
+    def test_cache_copies_and_restore_links(self):
+        entry = self.build_cache.cache(
+            fingerprint='fingerprint', installdir=self.installdir,
+            state=self.state)
+        cached_file = os.path.join(entry, 'install', 'bin', 'foo')
+        restored = os.path.join(self.path, 'restored')
+
+        self.build_cache.restore(fingerprint='fingerprint',
+                                 installdir=restored)
+
+        self.assertNotEqual(
+            os.stat(os.path.join(self.installdir, 'bin', 'foo')).st_ino,
+            os.stat(cached_file).st_ino)
+        self.assertEqual(
+            os.stat(os.path.join(restored, 'bin', 'foo')).st_ino,
+            os.stat(cached_file).st_ino)
+
+    def test_restore_replaces_installdir(self):
+        self.build_cache.cache(fingerprint='fingerprint',
+                               installdir=self.installdir, state=self.state)
+        open(os.path.join(self.installdir, 'stale'), 'w').close()
+
+        self.build_cache.restore(fingerprint='fingerprint',
+                                 installdir=self.installdir)
+
+        self.assertFalse(
+            os.path.exists(os.path.join(self.installdir, 'stale')))
+
+    def test_prune(self):
+        for fingerprint in ('keep', 'remove'):
+            self.build_cache.cache(fingerprint=fingerprint,
+                                   installdir=self.installdir,
+                                   state=self.state)
+
+        pruned = self.build_cache.prune(keep_fingerprints=['keep'])
+
+        self.assertEqual(
+            [os.path.join(self.build_cache.build_cache_root, 'remove')],
+            pruned)
+        self.assertIsNotNone(self.build_cache.get(fingerprint='keep'))
+
+    def test_prune_by_age(self):
+        for fingerprint in ('keep', 'old', 'recent'):
+            self.build_cache.cache(fingerprint=fingerprint,
+                                   installdir=self.installdir,
+                                   state=self.state)
+        for fingerprint in ('keep', 'old'):
+            os.utime(os.path.join(
+                self.build_cache.build_cache_root, fingerprint), (0, 0))
+
+        pruned = self.build_cache.prune(keep_fingerprints=['keep'],
+                                        max_age=60)
+
+        self.assertEqual(
+            [os.path.join(self.build_cache.build_cache_root, 'old')],
+            pruned)
+        self.assertIsNotNone(self.build_cache.get(fingerprint='keep'))
+        self.assertIsNotNone(self.build_cache.get(fingerprint='recent'))
+
+    def test_get_marks_the_entry_used(self):
+        entry = self.build_cache.cache(fingerprint='fingerprint',
+                                       installdir=self.installdir,
+                                       state=self.state)
+        os.utime(entry, (0, 0))
+
+        self.build_cache.get(fingerprint='fingerprint')
+
+        self.assertEqual(
+            [], self.build_cache.prune(max_age=60))
@@ -0,0 +1,60 @@
+# -*- Mode:Python; indent-tabs-mode:nil; tab-width:4 -*-
+#
+# Copyright (C) 2017 Canonical Ltd
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+
+from snapcraft import tests
+from snapcraft.internal import cache
+
+
+class SchemaCacheTestCase(tests.TestCase):
+
+    def setUp(self):
+        super().setUp()
+
+        self.schema_file = os.path.join(self.path, 'schema.yaml')
+        with open(self.schema_file, 'w') as f:
+            f.write('properties: {}\n')
+        self.schema = {'properties': {'name': {'type': 'string'}}}
+        self.schema_cache = cache.SchemaCache()
+
+    def test_get_missing_entry(self):
+        self.assertIsNone(self.schema_cache.get(schema_file=self.schema_file))
+
+    def test_cache_and_get(self):
+        self.schema_cache.cache(schema_file=self.schema_file,
+                                schema=self.schema)
+
+        self.assertEqual(
+            self.schema, self.schema_cache.get(schema_file=self.schema_file))
+
+    def test_get_after_schema_file_changed(self):
+        self.schema_cache.cache(schema_file=self.schema_file,
+                                schema=self.schema)
+        with open(self.schema_file, 'a') as f:
+            f.write('definitions: {}\n')
+
+        self.assertIsNone(self.schema_cache.get(schema_file=self.schema_file))
+
+    def test_cache_failure_is_ignored(self):
+        # A file where the cache directory should be.
+        os.makedirs(self.schema_cache.cache_root)
+        open(self.schema_cache.schema_cache_root, 'w').close()
+
+        self.schema_cache.cache(schema_file=self.schema_file,
+                                schema=self.schema)
+
+        self.assertIsNone(self.schema_cache.get(schema_file=self.schema_file))
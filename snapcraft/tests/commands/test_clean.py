@@ -20,14 +20,13 @@ import shutil
 
 import fixtures
 from unittest import mock
-from testtools.matchers import FileExists, MatchesRegex, Not
+from testtools.matchers import Equals, FileExists, MatchesRegex, Not
 
 
 from snapcraft.main import main
 from snapcraft.internal import (
     pluginhandler,
     project_loader,
-    states,
 )
 from snapcraft import tests
 
@@ -167,20 +166,29 @@ parts:
 
         main(['clean', '--step=foo'])
 
-        expected_staged_state = {
-            'clean0': states.StageState({'clean0'}, set()),
-            'clean1': states.StageState({'clean1'}, set()),
-            'clean2': states.StageState({'clean2'}, set()),
-        }
+        mock_clean.assert_called_with(step='foo', deferred=False)
+        # What the parts staged and primed before is indexed from their state.
+        for step in ('stage', 'prime'):
+            index = pluginhandler.OwnershipIndex(self.parts_dir, step)
+            self.assertThat(
+                index.release('clean0', {'clean0', 'clean1'}, set()),
+                Equals(({'clean0'}, set())))
 
-        expected_primed_state = {
-            'clean0': states.PrimeState({'clean0'}, set()),
-            'clean1': states.PrimeState({'clean1'}, set()),
-            'clean2': states.PrimeState({'clean2'}, set()),
-        }
+    @mock.patch.object(pluginhandler.PluginHandler, 'clean')
+    def test_build_cleaning_is_deferred(self, mock_clean):
+        self.make_snapcraft_yaml(n=3)
+
+        main(['clean', '--step=build'])
+
+        mock_clean.assert_called_with(step='build', deferred=True)
+
+    @mock.patch.object(pluginhandler.PluginHandler, 'clean')
+    def test_build_cleaning_from_scratch(self, mock_clean):
+        self.make_snapcraft_yaml(n=3)
+
+        main(['clean', '--step=build', '--from-scratch'])
 
-        mock_clean.assert_called_with(
-            expected_staged_state, expected_primed_state, 'foo')
+        mock_clean.assert_called_with(step='build', deferred=False)
 
     def test_cleaning_with_strip_does_prime_and_warns(self):
         fake_logger = fixtures.FakeLogger(level=logging.WARNING)
@@ -16,15 +16,16 @@
 
 import logging
 import os
-import tarfile
-from testtools.matchers import Contains
 from unittest import mock
 
 import fixtures
 
 from snapcraft.main import main
 from snapcraft import tests
-from snapcraft.tests.test_lxd import check_output_side_effect
+from snapcraft.tests.test_lxd import (
+    check_output_side_effect,
+    FakeContainerPopen,
+)
 
 
 class CleanBuildCommandTestCase(tests.TestCase):
@@ -57,6 +58,13 @@ parts:
         patcher.start()
         self.addCleanup(patcher.stop)
 
+        self.container_root = os.path.join(self.path, 'container', 'root')
+        patcher = mock.patch(
+            'snapcraft.internal.lxd.Popen',
+            FakeContainerPopen(os.path.join(self.path, 'container')))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
     def make_snapcraft_yaml(self, n=1):
         super().make_snapcraft_yaml(self.yaml_template)
         self.state_dir = os.path.join(self.parts_dir, 'part1', 'state')
@@ -73,10 +81,13 @@ parts:
             self.stage_dir,
             self.prime_dir,
             os.path.join(self.parts_dir, 'plugins'),
+            'vendor',
         ]
         files_tar = [
             os.path.join(self.parts_dir, 'plugins', 'x-plugin.py'),
             'main.c',
+            'other_1.0_source.tar.bz2',
+            os.path.join('vendor', 'snap-test_1.0_source.tar.bz2'),
         ]
         files_no_tar = [
             os.path.join(self.stage_dir, 'binary'),
@@ -99,23 +110,22 @@ parts:
             'Retrieved snap-test_1.0_amd64.snap\n',
             fake_logger.output)
 
-        with tarfile.open('snap-test_1.0_source.tar.bz2') as tar:
-            tar_members = tar.getnames()
-
         for f in files_no_tar:
             f = os.path.relpath(f)
-            self.assertFalse('./{}'.format(f) in tar_members,
-                             '{} should not be in {}'.format(f, tar_members))
+            self.assertFalse(
+                os.path.exists(os.path.join(self.container_root, f)),
+                '{} should not be in the container'.format(f))
         for f in files_tar:
             f = os.path.relpath(f)
-            self.assertTrue('./{}'.format(f) in tar_members,
-                            '{} should be in {}'.format(f, tar_members))
-
-        # Also assert that the snapcraft.yaml made it into the cleanbuild tar
-        self.assertThat(
-            tar_members,
-            Contains(os.path.join('.', 'snap', 'snapcraft.yaml')),
-            'snap/snapcraft unexpectedly excluded from tarball')
+            self.assertTrue(
+                os.path.exists(os.path.join(self.container_root, f)),
+                '{} should be in the container'.format(f))
+
+        # Also assert that the snapcraft.yaml made it into the container
+        self.assertTrue(
+            os.path.exists(os.path.join(
+                self.container_root, 'snap', 'snapcraft.yaml')),
+            'snap/snapcraft unexpectedly excluded from the project')
 
     def test_no_lxd(self):
         fake_logger = fixtures.FakeLogger(level=logging.ERROR)
@@ -213,6 +213,26 @@ architectures: [amd64, armhf]
 
         self.assertThat('my_snap_99_multi.snap', FileExists())
 
+    def test_snap_from_dir_with_dev_profile(self):
+        meta_dir = os.path.join('mysnap', 'meta')
+        os.makedirs(meta_dir)
+        with open(os.path.join(meta_dir, 'snap.yaml'), 'w') as f:
+            f.write("""name: my_snap
+version: 99
+architectures: [amd64]
+""")
+
+        main(['snap', 'mysnap', '--profile', 'dev', '--processors', '2',
+              '--block-size', '256K'])
+
+        self.popen_spy.assert_called_once_with([
+            'mksquashfs', os.path.abspath('mysnap'), 'my_snap_99_amd64.snap',
+            '-noappend', '-comp', 'gzip', '-Xcompression-level', '1',
+            '-no-xattrs', '-all-root', '-processors', '2', '-b', '262144'],
+            stderr=subprocess.STDOUT, stdout=subprocess.PIPE)
+
+        self.assertThat('my_snap_99_amd64.snap', FileExists())
+
     def test_snap_from_dir_with_no_arch(self):
         fake_logger = fixtures.FakeLogger(level=logging.INFO)
         self.useFixture(fake_logger)
@@ -17,6 +17,7 @@
 from functools import partial
 import io
 import os
+import struct
 import sys
 import threading
 from types import ModuleType
@@ -372,3 +373,75 @@ class FakePlugin(fixtures.Fixture):
 
     def _remove_module(self):
         del sys.modules[self._import_name]
+
+
+class FakeElf(fixtures.Fixture):
+    """Write a minimal dynamically linked ELF file.
+
+    Only what snapcraft.internal.elf reads is written: the program headers
+    and the dynamic section, with the string table in a loaded segment.
+    """
+
+    def __init__(self, path, *, needed=(), interp=None, soname=None,
+                 rpath=None, runpath=None, elf_class=64, machine=62):
+        super().__init__()
+        self.path = path
+        self._needed = needed
+        self._interp = interp
+        self._soname = soname
+        self._rpath = rpath
+        self._runpath = runpath
+        self._elf_class = elf_class
+        self._machine = machine
+
+    def _setUp(self):
+        if self._elf_class == 64:
+            header_format, program_format = '<HHIQQQIHHHHHH', '<IIQQQQQQ'
+            dynamic_format = '<qQ'
+        else:
+            header_format, program_format = '<HHIIIIIHHHHHH', '<IIIIIIII'
+            dynamic_format = '<iI'
+        header_size = 16 + struct.calcsize(header_format)
+        program_size = struct.calcsize(program_format)
+
+        strtab = b'\0'
+        dynamic = []
+        tags = [(1, n) for n in self._needed]
+        for tag, value in ((14, self._soname), (15, self._rpath),
+                           (29, self._runpath)):
+            if value is not None:
+                tags.append((tag, value))
+        for tag, value in tags:
+            dynamic.append((tag, len(strtab)))
+            strtab += value.encode() + b'\0'
+        interp = self._interp.encode() + b'\0' if self._interp else b''
+
+        segments = 3 if interp else 2
+        strtab_offset = header_size + segments * program_size
+        interp_offset = strtab_offset + len(strtab)
+        dynamic_offset = interp_offset + len(interp)
+        dynamic += [(5, strtab_offset), (10, len(strtab)), (0, 0)]
+        dynamic = b''.join(struct.pack(dynamic_format, *d) for d in dynamic)
+        size = dynamic_offset + len(dynamic)
+
+        def program_header(p_type, offset, filesz):
+            if self._elf_class == 64:
+                return struct.pack(program_format, p_type, 4, offset,
+                                   offset, offset, filesz, filesz, 8)
+            return struct.pack(program_format, p_type, offset, offset,
+                               offset, filesz, filesz, 4, 4)
+
+        contents = b'\x7fELF' + bytes(
+            [1 if self._elf_class == 32 else 2, 1, 1]) + bytes(9)
+        contents += struct.pack(
+            header_format, 3, self._machine, 1, 0, header_size, 0, 0,
+            header_size, program_size, segments, 0, 0, 0)
+        contents += program_header(1, 0, size)
+        if interp:
+            contents += program_header(3, interp_offset, len(interp))
+        contents += program_header(2, dynamic_offset, len(dynamic))
+        contents += strtab + interp + dynamic
+
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        with open(self.path, 'wb') as f:
+            f.write(contents)
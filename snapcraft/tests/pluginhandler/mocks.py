@@ -55,9 +55,12 @@ def loadplugin(part_name, plugin_name=None, part_properties=None,
     validator = project_loader.Validator()
     schema = validator.part_schema
     definitions_schema = validator.definitions_schema
-    return pluginhandler.load_plugin(part_name=part_name,
-                                     plugin_name=plugin_name,
-                                     part_properties=properties,
-                                     project_options=project_options,
-                                     part_schema=schema,
-                                     definitions_schema=definitions_schema)
+    handler = pluginhandler.load_plugin(part_name=part_name,
+                                        plugin_name=plugin_name,
+                                        part_properties=properties,
+                                        project_options=project_options,
+                                        part_schema=schema,
+                                        definitions_schema=definitions_schema)
+    # Load the plugin code right away, as running a step would.
+    handler.code
+    return handler
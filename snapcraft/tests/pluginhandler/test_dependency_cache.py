@@ -0,0 +1,123 @@
+# -*- Mode:Python; indent-tabs-mode:nil; tab-width:4 -*-
+#
+# Copyright (C) 2017 Canonical Ltd
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+from unittest import mock
+
+from testtools.matchers import Equals
+
+from snapcraft import tests
+from snapcraft.internal.pluginhandler import DependencyCache
+
+
+class DependencyCacheTestCase(tests.TestCase):
+
+    def setUp(self):
+        super().setUp()
+
+        os.makedirs('lib')
+        for path in ('app', 'script', os.path.join('lib', 'libfoo.so.1')):
+            with open(path, 'w') as f:
+                f.write(path)
+        self.libraries = [os.path.abspath(os.path.join('lib', 'libfoo.so.1'))]
+        self.resolver = mock.Mock(arch_triplet='x86_64-linux-gnu',
+                                  search_path=('lib', 'missing'))
+
+    def _cache(self):
+        return DependencyCache(
+            os.path.join('part', 'dependency-cache.json'), self.resolver)
+
+    def _store(self):
+        cache = self._cache()
+        cache.set('app', os.lstat('app'), self.libraries)
+        cache.set('script', os.lstat('script'), None)
+        cache.save()
+
+    def test_entries_are_kept(self):
+        self._store()
+
+        cache = self._cache()
+        self.assertThat(cache.get('app', os.lstat('app')),
+                        Equals(self.libraries))
+        self.assertIsNone(cache.get('script', os.lstat('script')))
+        self.assertIs(cache.get('unknown', os.lstat('app')), False)
+
+    def test_changed_file_invalidates_its_entry(self):
+        self._store()
+        with open('app', 'a') as f:
+            f.write('changed')
+
+        cache = self._cache()
+        self.assertIs(cache.get('app', os.lstat('app')), False)
+        self.assertIsNone(cache.get('script', os.lstat('script')))
+
+    def test_changed_library_invalidates_entry(self):
+        self._store()
+        with open(self.libraries[0], 'a') as f:
+            f.write('changed')
+
+        self.assertIs(self._cache().get('app', os.lstat('app')), False)
+
+    def test_new_library_invalidates_cache(self):
+        self._store()
+        open(os.path.join('lib', 'libbar.so.1'), 'w').close()
+
+        self.assertIs(self._cache().get('script', os.lstat('script')), False)
+
+    def test_new_library_in_searched_directory_invalidates_entry(self):
+        os.makedirs('private')
+        cache = self._cache()
+        cache.set('app', os.lstat('app'), self.libraries, {'private'})
+        cache.set('script', os.lstat('script'), None)
+        cache.save()
+        open(os.path.join('private', 'libfoo.so.1'), 'w').close()
+
+        cache = self._cache()
+        self.assertIs(cache.get('app', os.lstat('app')), False)
+        self.assertIsNone(cache.get('script', os.lstat('script')))
+
+    def test_relinked_library_keeps_cache(self):
+        self._store()
+        os.link(self.libraries[0], 'libfoo.so.1')
+        os.remove(self.libraries[0])
+        os.link('libfoo.so.1', self.libraries[0])
+
+        self.assertThat(self._cache().get('app', os.lstat('app')),
+                        Equals(self.libraries))
+
+    def test_other_architecture_invalidates_cache(self):
+        self._store()
+        self.resolver.arch_triplet = 'arm-linux-gnueabihf'
+
+        self.assertIs(self._cache().get('script', os.lstat('script')), False)
+
+    def test_missing_libraries_are_not_cached(self):
+        cache = self._cache()
+        cache.set('app', os.lstat('app'), ['/missing/libfoo.so.1'])
+
+        self.assertIs(cache.get('app', os.lstat('app')), False)
+
+    def test_prune(self):
+        self._store()
+
+        cache = self._cache()
+        cache.prune({'app'})
+        cache.save()
+
+        cache = self._cache()
+        self.assertThat(cache.get('app', os.lstat('app')),
+                        Equals(self.libraries))
+        self.assertIs(cache.get('script', os.lstat('script')), False)
@@ -0,0 +1,116 @@
+# -*- Mode:Python; indent-tabs-mode:nil; tab-width:4 -*-
+#
+# Copyright (C) 2017 Canonical Ltd
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+from unittest import mock
+
+from testtools.matchers import Equals
+
+from snapcraft import file_utils
+from snapcraft import tests
+from snapcraft.internal.pluginhandler import FileIndex
+
+
+class FileIndexTestCase(tests.TestCase):
+
+    def setUp(self):
+        super().setUp()
+
+        os.makedirs(os.path.join('install1', 'dir'))
+        os.makedirs('install2')
+        self._write('install1', 'dir/file', 'contents')
+        self._write('install2', 'dir/file', 'contents')
+        self.index1 = self._index(1)
+        self.index2 = self._index(2)
+
+    def _index(self, number):
+        index_file = os.path.join(self.path, 'index{}.json'.format(number))
+        return FileIndex('install{}'.format(number), index_file)
+
+    def _write(self, root, path, contents):
+        path = os.path.join(root, path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as f:
+            f.write(contents)
+
+    def test_entry_for_missing_or_non_regular_files(self):
+        os.symlink('file', os.path.join('install1', 'dir', 'link'))
+
+        self.assertIsNone(self.index1.entry('missing'))
+        self.assertIsNone(self.index1.entry('dir'))
+        self.assertIsNone(self.index1.entry('dir/link'))
+
+    def test_same_contents(self):
+        self.assertTrue(self.index1.same_contents('dir/file', self.index2))
+
+    def test_different_contents_same_size(self):
+        self._write('install2', 'dir/file', 'CONTENTS')
+
+        self.assertFalse(self.index1.same_contents('dir/file', self.index2))
+
+    def test_different_sizes_are_not_read(self):
+        self._write('install2', 'dir/file', 'other contents')
+
+        with mock.patch('snapcraft.file_utils.calculate_sha3_384') as digest:
+            self.assertFalse(
+                self.index1.same_contents('dir/file', self.index2))
+        digest.assert_not_called()
+
+    def test_hard_links_are_not_read(self):
+        os.remove(os.path.join('install2', 'dir', 'file'))
+        os.link(os.path.join('install1', 'dir', 'file'),
+                os.path.join('install2', 'dir', 'file'))
+
+        with mock.patch('snapcraft.file_utils.calculate_sha3_384') as digest:
+            self.assertTrue(
+                self.index1.same_contents('dir/file', self.index2))
+        digest.assert_not_called()
+
+    def test_saved_digests_are_reused(self):
+        self.index1.same_contents('dir/file', self.index2)
+        self.index1.save()
+        self.index2.save()
+
+        index1 = self._index(1)
+        index2 = self._index(2)
+        with mock.patch('snapcraft.file_utils.calculate_sha3_384') as digest:
+            self.assertTrue(index1.same_contents('dir/file', index2))
+        digest.assert_not_called()
+
+    def test_changed_files_are_digested_again(self):
+        self.index1.same_contents('dir/file', self.index2)
+        self.index1.save()
+        self._write('install1', 'dir/file', 'CONTENTS')
+        # Make sure the modification time changes.
+        os.utime(os.path.join('install1', 'dir', 'file'), ns=(0, 0))
+
+        index1 = self._index(1)
+        self.assertThat(
+            index1.digest('dir/file'),
+            Equals(file_utils.calculate_sha3_384(
+                os.path.join('install1', 'dir', 'file'))))
+        self.assertFalse(index1.same_contents('dir/file', self.index2))
+
+    def test_refresh_drops_removed_files(self):
+        self._write('install1', 'other', 'other')
+        self.index1.refresh()
+        os.remove(os.path.join('install1', 'other'))
+
+        self.index1.refresh()
+
+        index1 = self._index(1)
+        index1._load()
+        self.assertThat(sorted(index1._entries), Equals(['dir/file']))
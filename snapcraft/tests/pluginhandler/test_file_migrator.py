@@ -0,0 +1,120 @@
+# -*- Mode:Python; indent-tabs-mode:nil; tab-width:4 -*-
+#
+# Copyright (C) 2017 Canonical Ltd
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import errno
+import os
+from unittest import mock
+
+from testtools.matchers import Equals
+
+from snapcraft import file_utils
+from snapcraft import tests
+from snapcraft.internal.pluginhandler._file_migrator import (
+    FileMigrator,
+    MigrationReport,
+)
+
+
+class FileMigratorTestCase(tests.TestCase):
+
+    def setUp(self):
+        super().setUp()
+
+        self.files = {'1', 'a/2', 'a/b/3'}
+        for path in self.files:
+            self._write(os.path.join('install', path), path)
+        self.migrator = FileMigrator('install', 'stage')
+
+    def _write(self, path, contents):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as f:
+            f.write(contents)
+
+    def assert_linked(self, path):
+        self.assertTrue(os.path.samefile(os.path.join('install', path),
+                                         os.path.join('stage', path)))
+
+    def test_files_are_linked(self):
+        report = self.migrator.migrate(self.files, {'a', 'a/b'})
+
+        self.assertThat(report, Equals(MigrationReport(
+            directories=3, linked=3, copied=0, bytes_copied=0)))
+        for path in self.files:
+            self.assert_linked(path)
+
+    def test_directories_are_created_once(self):
+        with mock.patch('snapcraft.file_utils.create_similar_directory',
+                        wraps=file_utils.create_similar_directory) as create:
+            self.migrator.migrate(self.files, {'a', 'a/b'})
+
+        self.assertThat(
+            [c[0][1] for c in create.call_args_list],
+            Equals([os.path.join('stage', d) for d in ('', 'a', 'a/b')]))
+
+    def test_cross_device_link_is_only_tried_once(self):
+        with mock.patch('os.link', side_effect=OSError(errno.EXDEV, '')) \
+                as link:
+            report = self.migrator.migrate(self.files, set())
+
+        link.assert_called_once_with(mock.ANY, mock.ANY,
+                                     follow_symlinks=False)
+        self.assertThat(report, Equals(MigrationReport(
+            directories=3, linked=0, copied=3, bytes_copied=9)))
+        with open(os.path.join('stage', 'a', 'b', '3')) as f:
+            self.assertThat(f.read(), Equals('a/b/3'))
+
+    def test_existing_files_are_replaced(self):
+        self._write(os.path.join('stage', '1'), 'staged')
+
+        self.migrator.migrate({'1'}, set())
+
+        self.assert_linked('1')
+
+    def test_existing_symlinks_are_left_alone(self):
+        os.makedirs('stage')
+        os.symlink('a/2', os.path.join('stage', '1'))
+
+        report = self.migrator.migrate({'1'}, set())
+
+        self.assertThat(report.linked, Equals(0))
+        self.assertThat(os.readlink(os.path.join('stage', '1')),
+                        Equals('a/2'))
+
+    def test_pkg_config_files_are_copied(self):
+        self._write(os.path.join('install', 'foo.pc'), 'prefix=/usr\n')
+        fixup_func = mock.Mock()
+        migrator = FileMigrator('install', 'stage', fixup_func=fixup_func)
+
+        report = migrator.migrate({'foo.pc'}, set())
+
+        self.assertThat(report, Equals(MigrationReport(
+            directories=1, linked=0, copied=1, bytes_copied=12)))
+        self.assertFalse(os.path.samefile(os.path.join('install', 'foo.pc'),
+                                          os.path.join('stage', 'foo.pc')))
+        fixup_func.assert_called_once_with(os.path.join('stage', 'foo.pc'))
+
+    def test_batches_are_migrated_concurrently(self):
+        files = {'many/{}'.format(i) for i in range(1000)}
+        os.makedirs(os.path.join('install', 'many'))
+        for path in files:
+            open(os.path.join('install', path), 'w').close()
+        migrator = FileMigrator('install', 'stage', workers=4)
+
+        report = migrator.migrate(files, set())
+
+        self.assertThat(report.linked, Equals(1000))
+        for path in files:
+            self.assert_linked(path)
@@ -0,0 +1,103 @@
+# -*- Mode:Python; indent-tabs-mode:nil; tab-width:4 -*-
+#
+# Copyright (C) 2017 Canonical Ltd
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+from unittest import mock
+
+from testtools.matchers import Equals
+
+from snapcraft import tests
+from snapcraft.internal.pluginhandler import FilesetMatcher
+
+
+class FilesetMatcherTestCase(tests.TestCase):
+
+    def setUp(self):
+        super().setUp()
+
+        for path in ('.hidden', 'bin/app', 'lib/libfoo.so', 'lib/libfoo.a',
+                     'lib/.hidden/libbar.so', 'lib/sub/libbaz.so'):
+            path = os.path.join('install', path)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            open(path, 'w').close()
+
+    def _match(self, includes, excludes=()):
+        return FilesetMatcher(includes, excludes).match('install')
+
+    def test_wildcards_do_not_match_hidden_names(self):
+        files, dirs = self._match(['*'])
+
+        self.assertThat(files, Equals({
+            'bin/app', 'lib/libfoo.so', 'lib/libfoo.a',
+            'lib/.hidden/libbar.so', 'lib/sub/libbaz.so'}))
+        self.assertThat(dirs, Equals({'bin', 'lib', 'lib/.hidden',
+                                      'lib/sub'}))
+
+    def test_hidden_wildcard(self):
+        files, dirs = self._match(['.*'])
+
+        self.assertThat(files, Equals({'.hidden'}))
+        self.assertThat(dirs, Equals(set()))
+
+    def test_recursive_wildcard(self):
+        files, dirs = self._match(['**/*.so'])
+
+        self.assertThat(files, Equals({'lib/libfoo.so', 'lib/sub/libbaz.so'}))
+        self.assertThat(dirs, Equals({'lib', 'lib/sub'}))
+
+    def test_trailing_slash_only_matches_directories(self):
+        files, dirs = self._match(['*/'])
+
+        self.assertThat(files, Equals({
+            'bin/app', 'lib/libfoo.so', 'lib/libfoo.a',
+            'lib/.hidden/libbar.so', 'lib/sub/libbaz.so'}))
+        self.assertThat(self._match(['lib/*.so/']), Equals((set(), set())))
+
+    def test_excludes(self):
+        files, dirs = self._match(['*'], ['bin', 'lib/*.a', 'lib/*/'])
+
+        self.assertThat(files, Equals({'lib/libfoo.so',
+                                       'lib/.hidden/libbar.so'}))
+        self.assertThat(dirs, Equals({'lib', 'lib/.hidden'}))
+
+    def test_excluded_directories_are_not_walked(self):
+        with mock.patch('os.scandir', wraps=os.scandir) as scandir:
+            self._match(['*'], ['lib'])
+
+        self.assertThat(
+            sorted(c[0][0] for c in scandir.call_args_list),
+            Equals(['install', os.path.join('install', 'bin')]))
+
+    def test_literal_includes(self):
+        files, dirs = self._match(['lib/sub', 'missing/file', 'b?n'])
+
+        self.assertThat(files, Equals({'lib/sub/libbaz.so', 'missing/file',
+                                       'b?n'}))
+        self.assertThat(dirs, Equals({'lib', 'lib/sub', 'missing'}))
+
+    def test_missing_literal_include_in_excluded_directory(self):
+        files, dirs = self._match(['lib/missing'], ['lib'])
+
+        self.assertThat(files, Equals(set()))
+        self.assertThat(dirs, Equals(set()))
+
+    def test_symlinked_directories_are_not_expanded(self):
+        os.symlink('lib', os.path.join('install', 'lib64'))
+
+        files, dirs = self._match(['lib64'])
+
+        self.assertThat(files, Equals({'lib64'}))
+        self.assertThat(dirs, Equals(set()))
@@ -0,0 +1,87 @@
+# -*- Mode:Python; indent-tabs-mode:nil; tab-width:4 -*-
+#
+# Copyright (C) 2017 Canonical Ltd
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+
+from testtools.matchers import Equals
+
+from snapcraft import tests
+from snapcraft.internal import states
+from snapcraft.internal.pluginhandler import OwnershipIndex
+
+
+class OwnershipIndexTestCase(tests.TestCase):
+
+    def _index(self):
+        return OwnershipIndex('parts', 'stage')
+
+    def _store(self):
+        index = self._index()
+        index.add('part1', {'bin/1', 'bin/common'}, {'bin'})
+        index.add('part2', {'bin/2', 'bin/common'}, {'bin'})
+        index.save()
+
+    def test_missing_index(self):
+        index = self._index()
+
+        self.assertFalse(index.exists())
+        self.assertThat(index.release('part1', {'bin/1'}, {'bin'}),
+                        Equals(({'bin/1'}, {'bin'})))
+
+    def test_release_returns_paths_no_longer_owned(self):
+        self._store()
+
+        index = self._index()
+        self.assertTrue(index.exists())
+        self.assertThat(
+            index.release('part1', {'bin/1', 'bin/common'}, {'bin'}),
+            Equals(({'bin/1'}, set())))
+        index.save()
+
+        self.assertThat(
+            self._index().release('part2', {'bin/2', 'bin/common'}, {'bin'}),
+            Equals(({'bin/2', 'bin/common'}, {'bin'})))
+
+    def test_unsaved_changes_are_not_kept(self):
+        self._store()
+
+        self._index().release('part1', {'bin/1', 'bin/common'}, {'bin'})
+
+        self.assertThat(
+            self._index().release('part2', {'bin/common'}, set()),
+            Equals((set(), set())))
+
+    def test_seed(self):
+        index = self._index()
+        index.seed({
+            'part1': states.StageState({'bin/1', 'bin/common'}, {'bin'}),
+            'part2': states.StageState({'bin/common'}, {'bin'}),
+            'part3': None,
+        })
+        index.save()
+
+        self.assertThat(
+            self._index().release('part1', {'bin/1', 'bin/common'}, {'bin'}),
+            Equals(({'bin/1'}, set())))
+
+    def test_clear(self):
+        self._store()
+
+        self._index().clear()
+
+        self.assertFalse(os.path.exists(os.path.join('parts',
+                                                     '.stage-owners.json')))
+        self.assertFalse(self._index().exists())
@@ -20,9 +20,9 @@ import logging
 import os
 import shutil
 import stat
-import sys
 import tempfile
 from unittest.mock import (
+    ANY,
     call,
     Mock,
     MagicMock,
@@ -30,7 +30,7 @@ from unittest.mock import (
 )
 
 import fixtures
-from testtools.matchers import Equals
+from testtools.matchers import Equals, FileContains
 
 import snapcraft
 from . import mocks
@@ -39,7 +39,9 @@ from snapcraft.internal.errors import (
     SnapcraftPartConflictError,
 )
 from snapcraft.internal import (
+    cache,
     common,
+    elf,
     lifecycle,
     pluginhandler,
     repo,
@@ -449,6 +451,33 @@ class PluginTestCase(tests.TestCase):
         self.useFixture(fixture_setup.FakePlugin('plugin', Plugin))
         mocks.loadplugin('fake-part', 'plugin')
 
+    def test_plugin_schema_merged_once_for_all_parts(self):
+        class Plugin(snapcraft.BasePlugin):
+            @classmethod
+            def schema(cls):
+                schema = super().schema()
+                schema['properties']['foo'] = {
+                    'type': 'string',
+                }
+
+                return schema
+
+        self.useFixture(fixture_setup.FakePlugin('plugin', Plugin))
+        merged_schemas = pluginhandler._merged_part_and_plugin_schemas
+        with patch('snapcraft.internal.pluginhandler.'
+                   '_merged_part_and_plugin_schemas',
+                   wraps=merged_schemas) as merge_mock:
+            part1 = mocks.loadplugin('part1', 'plugin', {'foo': 'bar'})
+            part2 = mocks.loadplugin('part2', 'plugin', {'foo': 'baz'})
+            # The schema is reused, but each part is still validated.
+            self.assertRaises(
+                pluginhandler.PluginError,
+                mocks.loadplugin, 'part3', 'plugin', {'foo': 1})
+
+        self.assertThat(merge_mock.call_count, Equals(1))
+        self.assertThat(part1.code.options.foo, Equals('bar'))
+        self.assertThat(part2.code.options.foo, Equals('baz'))
+
     def test_plugin_schema_invalid_pull_hint(self):
         class Plugin(snapcraft.BasePlugin):
             @classmethod
@@ -1219,8 +1248,8 @@ class StateTestCase(StateBaseTestCase):
         self.handler.prime()
 
         self.assertEqual('prime', self.handler.last_step())
-        mock_find_dependencies.assert_called_once_with(self.handler.snapdir,
-                                                       {'bin/1', 'bin/2'})
+        mock_find_dependencies.assert_called_once_with(
+            self.handler.snapdir, {'bin/1', 'bin/2'}, ANY, ANY)
         self.assertFalse(mock_copy.called)
 
         state = self.handler.get_state('prime')
@@ -1263,8 +1292,8 @@ class StateTestCase(StateBaseTestCase):
         self.assertEqual('prime', self.handler.last_step())
         # bin/2 shouldn't be in this list as it was already primed by another
         # part.
-        mock_find_dependencies.assert_called_once_with(self.handler.snapdir,
-                                                       {'bin/1'})
+        mock_find_dependencies.assert_called_once_with(
+            self.handler.snapdir, {'bin/1'}, ANY, ANY)
         self.assertFalse(mock_copy.called)
 
         state = self.handler.get_state('prime')
@@ -1307,7 +1336,7 @@ class StateTestCase(StateBaseTestCase):
 
         self.assertEqual('prime', self.handler.last_step())
         mock_find_dependencies.assert_called_once_with(
-            self.handler.snapdir, {'bin/1', 'bin/2'})
+            self.handler.snapdir, {'bin/1', 'bin/2'}, ANY, ANY)
         mock_migrate_files.assert_has_calls([
             call({'bin/1', 'bin/2'}, {'bin'}, self.handler.stagedir,
                  self.handler.snapdir),
@@ -1366,7 +1395,7 @@ class StateTestCase(StateBaseTestCase):
 
         self.assertEqual('prime', self.handler.last_step())
         mock_find_dependencies.assert_called_once_with(
-            self.handler.snapdir, {'bin/file'})
+            self.handler.snapdir, {'bin/file'}, ANY, ANY)
         # Verify that only the part's files were migrated-- not the system
         # dependency.
         mock_migrate_files.assert_called_once_with(
@@ -1408,7 +1437,7 @@ class StateTestCase(StateBaseTestCase):
 
         self.assertEqual('prime', self.handler.last_step())
         mock_find_dependencies.assert_called_once_with(
-            self.handler.snapdir, {'bin/1', 'foo/bar/baz'})
+            self.handler.snapdir, {'bin/1', 'foo/bar/baz'}, ANY, ANY)
         mock_migrate_files.assert_called_once_with(
             {'bin/1', 'foo/bar/baz'}, {'bin', 'foo', 'foo/bar'},
             self.handler.stagedir, self.handler.snapdir)
@@ -1439,8 +1468,8 @@ class StateTestCase(StateBaseTestCase):
         self.handler.prime()
 
         self.assertEqual('prime', self.handler.last_step())
-        mock_find_dependencies.assert_called_once_with(self.handler.snapdir,
-                                                       {'bin/1'})
+        mock_find_dependencies.assert_called_once_with(
+            self.handler.snapdir, {'bin/1'}, ANY, ANY)
         self.assertFalse(mock_copy.called)
 
         state = self.handler.get_state('prime')
@@ -1936,6 +1965,31 @@ class CleanTestCase(CleanBaseTestCase):
             os.path.exists(os.path.join(self.stage_dir, 'bin', '2')),
             "Expected part2's staged files to be untouched")
 
+    def test_clean_stage_keeps_files_staged_by_other_parts(self):
+        handlers = []
+        for part_name in ('part1', 'part2'):
+            handler = mocks.loadplugin(part_name)
+            handler.makedirs()
+            bindir = os.path.join(handler.code.installdir, 'bin')
+            os.makedirs(bindir)
+            open(os.path.join(bindir, 'common'), 'w').close()
+            open(os.path.join(bindir, part_name), 'w').close()
+            handler.mark_done('build')
+            handler.stage()
+            handlers.append(handler)
+
+        # No project state is needed, the parts owning each file are indexed
+        # when staging.
+        handlers[0].clean_stage({})
+
+        bindir = os.path.join(self.stage_dir, 'bin')
+        self.assertThat(sorted(os.listdir(bindir)),
+                        Equals(['common', 'part2']))
+
+        handlers[1].clean_stage({})
+
+        self.assertFalse(os.path.exists(bindir))
+
     def test_clean_stage_after_fileset_change(self):
         # Create part1 and get it through the "build" step.
         handler = mocks.loadplugin('part1')
@@ -2088,6 +2142,123 @@ class CleanStageTestCase(CleanBaseTestCase):
                          'Expected snapdir to be completely cleaned')
 
 
+class DeferredCleanTestCase(tests.TestCase):
+
+    def setUp(self):
+        super().setUp()
+
+        self.handler = mocks.loadplugin('test_part')
+        self.handler.makedirs()
+        for name in ('1', '2', '3'):
+            self._install(name)
+        self.handler.mark_done('pull')
+        self.handler.mark_done('build')
+        self.handler.stage()
+        self.handler.prime()
+
+    def _install(self, name):
+        path = os.path.join(self.handler.installdir, 'bin', name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as f:
+            f.write(name)
+
+    def _change_install(self):
+        os.remove(os.path.join(self.handler.installdir, 'bin', '3'))
+        os.remove(os.path.join(self.handler.installdir, 'bin', '2'))
+        self._install('2')
+
+    def test_only_changes_are_migrated(self):
+        self.handler.clean(step='stage', deferred=True)
+        self.assertTrue(self.handler.is_clean('stage'))
+        self.assertTrue(
+            os.path.exists(os.path.join(self.stage_dir, 'bin', '3')))
+        self._change_install()
+
+        with patch('snapcraft.internal.pluginhandler._migrate_files',
+                   wraps=pluginhandler._migrate_files) as mock_migrate_files:
+            self.handler.stage()
+            self.handler.prime()
+
+        mock_migrate_files.assert_has_calls([
+            call({'bin/2'}, set(), self.handler.installdir,
+                 self.stage_dir, fixup_func=ANY),
+            call({'bin/2'}, set(), self.stage_dir, self.prime_dir),
+        ])
+        for directory in (self.stage_dir, self.prime_dir):
+            self.assertFalse(
+                os.path.exists(os.path.join(directory, 'bin', '3')))
+            self.assertTrue(os.path.samefile(
+                os.path.join(self.handler.installdir, 'bin', '2'),
+                os.path.join(directory, 'bin', '2')))
+        self.assertEqual(self.handler.get_state('prime').files,
+                         {'bin/1', 'bin/2'})
+
+    def test_deferred_clean_is_kept_across_runs(self):
+        self.handler.clean(step='stage', deferred=True)
+        self._change_install()
+
+        handler = mocks.loadplugin('test_part')
+        with patch('snapcraft.internal.pluginhandler._migrate_files',
+                   wraps=pluginhandler._migrate_files) as mock_migrate_files:
+            handler.stage()
+
+        mock_migrate_files.assert_called_once_with(
+            {'bin/2'}, set(), handler.installdir, self.stage_dir,
+            fixup_func=ANY)
+        self.assertFalse(
+            os.path.exists(os.path.join(self.stage_dir, 'bin', '3')))
+        self.assertIsNone(handler._states.get_deferred('stage'))
+
+    def test_files_removed_since_are_migrated_again(self):
+        self.handler.clean(step='stage', deferred=True)
+        os.remove(os.path.join(self.stage_dir, 'bin', '1'))
+
+        with patch('snapcraft.internal.pluginhandler._migrate_files',
+                   wraps=pluginhandler._migrate_files) as mock_migrate_files:
+            self.handler.stage()
+
+        mock_migrate_files.assert_called_once_with(
+            {'bin/1'}, set(), self.handler.installdir, self.stage_dir,
+            fixup_func=ANY)
+
+    def test_files_are_removed_if_steps_do_not_run(self):
+        self.handler.clean(step='stage', deferred=True)
+
+        self.handler.clean_deferred()
+
+        self.assertFalse(os.path.exists(os.path.join(self.stage_dir, 'bin')))
+        self.assertFalse(os.path.exists(os.path.join(self.prime_dir, 'bin')))
+
+    def test_clean_removes_deferred_files(self):
+        self.handler.clean(step='prime', deferred=True)
+
+        self.handler.clean(step='prime')
+
+        self.assertFalse(os.path.exists(os.path.join(self.prime_dir, 'bin')))
+        self.assertTrue(os.path.exists(os.path.join(self.stage_dir, 'bin')))
+
+    def test_everything_is_migrated_after_an_explicit_clean(self):
+        # Only a deferred clean leaves files behind to compare with.
+        self.handler.clean(step='stage')
+
+        with patch('snapcraft.internal.pluginhandler._migrate_files',
+                   wraps=pluginhandler._migrate_files) as mock_migrate_files:
+            self.handler.stage()
+
+        mock_migrate_files.assert_called_once_with(
+            {'bin/1', 'bin/2', 'bin/3'}, {'bin'}, self.handler.installdir,
+            self.stage_dir, fixup_func=ANY)
+
+    def test_states_without_manifest_are_cleaned_right_away(self):
+        state = self.handler.get_state('prime')
+        self.handler.mark_prime_done(state.files, state.directories,
+                                     state.dependency_paths)
+
+        self.handler.clean(step='prime', deferred=True)
+
+        self.assertFalse(os.path.exists(os.path.join(self.prime_dir, 'bin')))
+
+
 class PerStepCleanTestCase(tests.TestCase):
 
     def setUp(self):
@@ -2119,9 +2290,9 @@ class PerStepCleanTestCase(tests.TestCase):
         # Verify the step cleaning order
         self.assertEqual(4, len(self.manager_mock.mock_calls))
         self.manager_mock.assert_has_calls([
-            call.clean_prime({}, 'foo'),
-            call.clean_stage({}, 'foo'),
-            call.clean_build('foo'),
+            call.clean_prime({}, 'foo', False),
+            call.clean_stage({}, 'foo', False),
+            call.clean_build('foo', False),
             call.clean_pull('foo'),
         ])
 
@@ -2131,9 +2302,9 @@ class PerStepCleanTestCase(tests.TestCase):
         # Verify the step cleaning order
         self.assertEqual(4, len(self.manager_mock.mock_calls))
         self.manager_mock.assert_has_calls([
-            call.clean_prime({}, ''),
-            call.clean_stage({}, ''),
-            call.clean_build(''),
+            call.clean_prime({}, '', False),
+            call.clean_stage({}, '', False),
+            call.clean_build('', False),
             call.clean_pull(''),
         ])
 
@@ -2143,9 +2314,9 @@ class PerStepCleanTestCase(tests.TestCase):
         # Verify the step cleaning order
         self.assertEqual(3, len(self.manager_mock.mock_calls))
         self.manager_mock.assert_has_calls([
-            call.clean_prime({}, ''),
-            call.clean_stage({}, ''),
-            call.clean_build(''),
+            call.clean_prime({}, '', False),
+            call.clean_stage({}, '', False),
+            call.clean_build('', False),
         ])
 
     def test_clean_stage_order(self):
@@ -2154,8 +2325,8 @@ class PerStepCleanTestCase(tests.TestCase):
         # Verify the step cleaning order
         self.assertEqual(2, len(self.manager_mock.mock_calls))
         self.manager_mock.assert_has_calls([
-            call.clean_prime({}, ''),
-            call.clean_stage({}, ''),
+            call.clean_prime({}, '', False),
+            call.clean_stage({}, '', False),
         ])
 
     def test_clean_prime_order(self):
@@ -2164,7 +2335,7 @@ class PerStepCleanTestCase(tests.TestCase):
         # Verify the step cleaning order
         self.assertEqual(1, len(self.manager_mock.mock_calls))
         self.manager_mock.assert_has_calls([
-            call.clean_prime({}, ''),
+            call.clean_prime({}, '', False),
         ])
 
 
@@ -2245,6 +2416,39 @@ class CollisionTestCase(tests.TestCase):
             "common which have different contents:\n    file.pc",
             raised.__str__())
 
+    def test_no_collisions_compares_files_once(self):
+        with open(self.part2.installdir + '/a/1', mode='w') as f:
+            f.write('')
+        pluginhandler.check_for_collisions([self.part1, self.part2])
+
+        # Even for other handlers of the same parts, as in a later run.
+        part1 = mocks.loadplugin('part1')
+        part1.code.installdir = self.part1.installdir
+        part2 = mocks.loadplugin('part2')
+        part2.code.installdir = self.part2.installdir
+        with patch('snapcraft.file_utils.calculate_sha3_384') as mock_digest:
+            pluginhandler.check_for_collisions([part1, part2])
+        mock_digest.assert_not_called()
+
+    def test_collisions_after_a_file_changed(self):
+        with open(self.part2.installdir + '/a/1', mode='w') as f:
+            f.write('')
+        pluginhandler.check_for_collisions([self.part1, self.part2])
+        with open(self.part2.installdir + '/a/1', mode='w') as f:
+            f.write('1')
+
+        part2 = mocks.loadplugin('part2')
+        part2.code.installdir = self.part2.installdir
+        raised = self.assertRaises(
+            SnapcraftPartConflictError,
+            pluginhandler.check_for_collisions,
+            [self.part1, part2])
+
+        self.assertIn(
+            "Parts 'part1' and 'part2' have the following file paths in "
+            "common which have different contents:\n    a/1",
+            raised.__str__())
+
 
 class StagePackagesTestCase(tests.TestCase):
 
@@ -2271,157 +2475,232 @@ class StagePackagesTestCase(tests.TestCase):
             "The package 'non-existing' was not found.")
 
 
-class FindDependenciesTestCase(tests.TestCase):
+class PrefetchTestCase(tests.TestCase):
 
-    @patch('magic.open')
-    @patch('snapcraft.internal.libraries.get_dependencies')
-    def test_find_dependencies(self, mock_dependencies, mock_magic):
-        workdir = os.path.join(os.getcwd(), 'workdir')
-        os.makedirs(workdir)
+    def setUp(self):
+        super().setUp()
 
-        linked_elf_path = os.path.join(workdir, 'linked')
-        open(linked_elf_path, 'w').close()
+        patcher = patch.object(snapcraft.internal.repo.Repo, 'get')
+        self.get_mock = patcher.start()
+        self.get_mock.return_value = ['fake-package=1.0']
+        self.addCleanup(patcher.stop)
 
-        linked_elf_path_b = linked_elf_path.encode(sys.getfilesystemencoding())
+        patcher = patch.object(snapcraft.internal.repo.Repo, 'unpack')
+        patcher.start()
+        self.addCleanup(patcher.stop)
 
-        mock_ms = Mock()
-        mock_magic.return_value = mock_ms
-        mock_ms.load.return_value = 0
-        mock_ms.file.return_value = (
-            'ELF 64-bit LSB executable, x86-64, version 1 (SYSV), '
-            'dynamically linked interpreter /lib64/ld-linux-x86-64.so.2, '
-            'for GNU/Linux 2.6.32, BuildID[sha1]=XYZ, stripped')
+        self.part = mocks.loadplugin(
+            'test-part', part_properties={
+                'source': '.', 'stage-packages': ['fake-package']})
 
-        mock_dependencies.return_value = ['/usr/lib/libDepends.so']
+    def test_prefetch_fetches_source_and_stage_packages(self):
+        open('file', 'w').close()
 
-        dependencies = pluginhandler._find_dependencies(workdir, {'linked'})
+        self.assertEqual(['fake-package=1.0'], self.part.prefetch())
 
-        mock_ms.file.assert_called_once_with(linked_elf_path_b)
-        self.assertEqual(dependencies, {'/usr/lib/libDepends.so'})
+        self.get_mock.assert_called_once_with({'fake-package'})
+        self.assertTrue(
+            os.path.exists(os.path.join(self.part.sourcedir, 'file')))
 
-    @patch('magic.open')
-    @patch('snapcraft.internal.libraries.get_dependencies')
-    def test_find_dependencies_skip_object_files(self, mock_dependencies,
-                                                 mock_magic):
-        workdir = os.path.join(os.getcwd(), 'workdir')
-        os.makedirs(workdir)
-        open(os.path.join(workdir, 'object_file.o'), 'w').close()
+    def test_pull_after_prefetch_does_not_fetch_again(self):
+        self.part.mark_prefetched(['fake-package=1.0'])
 
-        mock_ms = Mock()
-        mock_magic.return_value = mock_ms
-        mock_ms.load.return_value = 0
-        mock_ms.file.return_value = (
-            'ELF 64-bit LSB executable, x86-64, version 1 (SYSV), '
-            'dynamically linked interpreter /lib64/ld-linux-x86-64.so.2, '
-            'for GNU/Linux 2.6.32, BuildID[sha1]=XYZ, stripped')
+        with patch.object(self.part.source_handler, 'pull') as pull_mock:
+            self.part.prepare_pull()
+            self.part.pull()
 
-        mock_dependencies.return_value = ['/usr/lib/libDepends.so']
+        self.assertFalse(self.get_mock.called)
+        self.assertFalse(pull_mock.called)
+        self.assertEqual(['fake-package=1.0'],
+                         self.part.get_state('pull').assets['stage-packages'])
 
-        dependencies = pluginhandler._find_dependencies(
-            workdir, {'object_file.o'})
+    def test_clean_pull_forgets_prefetch(self):
+        self.part.mark_prefetched(['fake-package=1.0'])
+        self.part.pull()
+        self.part.clean_pull()
 
-        self.assertFalse(mock_ms.file.called,
-                         'Expected object file to be skipped')
-        self.assertEqual(dependencies, set())
+        self.part.prepare_pull()
+
+        self.get_mock.assert_called_once_with({'fake-package'})
+
+
+class FindDependenciesTestCase(tests.TestCase):
+
+    def setUp(self):
+        super().setUp()
 
-    @patch('magic.open')
-    @patch('snapcraft.internal.libraries.get_dependencies')
-    def test_no_find_dependencies_of_non_dynamically_linked(
-            self, mock_dependencies, mock_magic):
-        workdir = os.path.join(os.getcwd(), 'workdir')
-        os.makedirs(workdir)
+        self.workdir = os.path.join(os.getcwd(), 'workdir')
+        os.makedirs(self.workdir)
+        self.resolver = Mock()
 
-        statically_linked_elf_path = os.path.join(workdir, 'statically-linked')
-        open(statically_linked_elf_path, 'w').close()
+        patcher = patch('snapcraft.internal.libraries.get_dependencies')
+        self.mock_dependencies = patcher.start()
+        self.mock_dependencies.return_value = ['/usr/lib/libDepends.so']
+        self.addCleanup(patcher.stop)
 
-        statically_linked_elf_path_b = statically_linked_elf_path.encode(
-            sys.getfilesystemencoding())
+    def test_find_dependencies(self):
+        linked_elf_path = os.path.join(self.workdir, 'linked')
+        self.useFixture(fixture_setup.FakeElf(
+            linked_elf_path, needed=['libDepends.so'],
+            interp='/lib64/ld-linux-x86-64.so.2'))
 
-        mock_ms = Mock()
-        mock_magic.return_value = mock_ms
-        mock_ms.load.return_value = 0
-        mock_ms.file.return_value = (
-            'ELF 64-bit LSB executable, x86-64, version 1 (SYSV), '
-            'statically linked, for GNU/Linux 2.6.32, '
-            'BuildID[sha1]=XYZ, stripped')
+        dependencies = pluginhandler._find_dependencies(
+            self.workdir, {'linked'}, self.resolver)
+
+        self.mock_dependencies.assert_called_once_with(
+            ANY, self.resolver, None)
+        elf_file = self.mock_dependencies.call_args[0][0]
+        self.assertEqual(elf_file.path, linked_elf_path)
+        self.assertEqual(elf_file.needed, ['libDepends.so'])
+        self.assertEqual(dependencies, {'/usr/lib/libDepends.so'})
+
+    def test_find_dependencies_cached(self):
+        library = os.path.join(self.workdir, 'libDepends.so')
+        open(library, 'w').close()
+        self.mock_dependencies.return_value = [library]
+        self.resolver = Mock(arch_triplet='x86_64-linux-gnu', search_path=())
+        cache_file = os.path.join(self.path, 'dependency-cache.json')
+        self.useFixture(fixture_setup.FakeElf(
+            os.path.join(self.workdir, 'linked'), needed=['libDepends.so']))
+        self.useFixture(fixture_setup.FakeElf(
+            os.path.join(self.workdir, 'other'), needed=['libDepends.so']))
+
+        def find_dependencies():
+            return pluginhandler._find_dependencies(
+                self.workdir, {'linked', 'other'}, self.resolver,
+                pluginhandler.DependencyCache(cache_file, self.resolver))
+
+        self.assertEqual(find_dependencies(), {library})
+        self.assertEqual(self.mock_dependencies.call_count, 2)
+
+        # Nothing changed, nothing is read again.
+        self.mock_dependencies.reset_mock()
+        self.assertEqual(find_dependencies(), {library})
+        self.assertFalse(self.mock_dependencies.called)
+
+        # Only what changed is read again.
+        os.remove(os.path.join(self.workdir, 'linked'))
+        self.useFixture(fixture_setup.FakeElf(
+            os.path.join(self.workdir, 'linked'),
+            needed=['libDepends.so', 'libOther.so']))
+        self.assertEqual(find_dependencies(), {library})
+        self.mock_dependencies.assert_called_once_with(
+            ANY, self.resolver, set())
+        self.assertEqual(self.mock_dependencies.call_args[0][0].needed,
+                         ['libDepends.so', 'libOther.so'])
+
+    def test_find_dependencies_cached_with_new_library_in_runpath(self):
+        with open('ld.so.conf', 'w') as f:
+            f.write('# no system paths\n')
+        self.mock_dependencies.side_effect = (
+            lambda elf_file, resolver, searched:
+            resolver.get_dependencies(elf_file, searched))
+        cache_file = os.path.join(self.path, 'dependency-cache.json')
+        self.useFixture(fixture_setup.FakeElf(
+            os.path.join(self.workdir, 'bin', 'app'),
+            needed=['libfake-a.so.1'], runpath='$ORIGIN/../private'))
+
+        def find_dependencies():
+            # Like prime, with a new resolver each time.
+            resolver = elf.LibraryResolver(
+                arch_triplet='x86_64-linux-gnu', ld_so_conf='ld.so.conf')
+            return pluginhandler._find_dependencies(
+                self.workdir, {'bin/app'}, resolver,
+                pluginhandler.DependencyCache(cache_file, resolver))
+
+        self.assertEqual(find_dependencies(), set())
+        self.useFixture(fixture_setup.FakeElf(
+            os.path.join(self.workdir, 'private', 'libfake-a.so.1')))
+
+        self.assertEqual(find_dependencies(), {
+            os.path.join(self.workdir, 'bin', '..', 'private',
+                         'libfake-a.so.1')})
+
+    def test_find_dependencies_skip_object_files(self):
+        self.useFixture(fixture_setup.FakeElf(
+            os.path.join(self.workdir, 'object_file.o'),
+            needed=['libDepends.so']))
 
         dependencies = pluginhandler._find_dependencies(
-            workdir, {'statically-linked'})
+            self.workdir, {'object_file.o'}, self.resolver)
+
+        self.assertFalse(self.mock_dependencies.called,
+                         'Expected object file to be skipped')
+        self.assertEqual(dependencies, set())
 
-        mock_ms.file.assert_called_once_with(statically_linked_elf_path_b)
+    def test_no_find_dependencies_of_non_dynamically_linked(self):
+        self.useFixture(fixture_setup.FakeElf(
+            os.path.join(self.workdir, 'statically-linked')))
+
+        dependencies = pluginhandler._find_dependencies(
+            self.workdir, {'statically-linked'}, self.resolver)
 
         self.assertFalse(
-            mock_dependencies.called,
+            self.mock_dependencies.called,
             'statically linked files should not have library dependencies')
 
         self.assertFalse(dependencies)
 
-    @patch('magic.open')
-    @patch('snapcraft.internal.libraries.get_dependencies')
-    def test_no_find_dependencies_of_non_elf_files(
-            self, mock_dependencies, mock_magic):
-        workdir = os.path.join(os.getcwd(), 'workdir')
-        os.makedirs(workdir)
+    @patch('snapcraft.internal.elf.read_elf_file')
+    def test_no_find_dependencies_of_unreadable_files(self, mock_read):
+        mock_read.side_effect = PermissionError(13, 'Permission denied')
+        self.useFixture(fixture_setup.FakeElf(
+            os.path.join(self.workdir, 'unreadable'),
+            needed=['libDepends.so']))
 
-        non_elf_path = os.path.join(workdir, 'non-elf')
-        open(non_elf_path, 'w').close()
-
-        non_elf_path_b = non_elf_path.encode(sys.getfilesystemencoding())
+        dependencies = pluginhandler._find_dependencies(
+            self.workdir, {'unreadable'}, self.resolver)
 
-        mock_ms = Mock()
-        mock_magic.return_value = mock_ms
-        mock_ms.load.return_value = 0
-        mock_ms.file.return_value = 'JPEG image data, Exif standard: ...'
+        self.assertFalse(self.mock_dependencies.called)
+        self.assertFalse(dependencies)
 
-        dependencies = pluginhandler._find_dependencies(workdir, {'non-elf'})
+    def test_no_find_dependencies_of_non_elf_files(self):
+        with open(os.path.join(self.workdir, 'non-elf'), 'wb') as f:
+            f.write(b'\xff\xd8\xff\xe1 JPEG image data, Exif standard')
 
-        mock_ms.file.assert_called_once_with(non_elf_path_b)
+        dependencies = pluginhandler._find_dependencies(
+            self.workdir, {'non-elf'}, self.resolver)
 
         self.assertFalse(
-            mock_dependencies.called,
+            self.mock_dependencies.called,
             'non elf files should not have library dependencies')
 
         self.assertFalse(
             dependencies,
             'non elf files should not have library dependencies')
 
-    @patch('magic.open')
-    @patch('snapcraft.internal.libraries.get_dependencies')
-    def test_no_find_dependencies_of_symlinks(
-            self, mock_dependencies, mock_magic):
-        workdir = os.path.join(os.getcwd(), 'workdir')
-        os.makedirs(workdir)
-
-        symlinked_path = os.path.join(workdir, 'symlinked')
-        os.symlink('/bin/dash', symlinked_path)
-
-        mock_ms = Mock()
-        mock_magic.return_value = mock_ms
-        mock_ms.load.return_value = 0
-
-        dependencies = pluginhandler._find_dependencies(workdir, {'symlinked'})
+    def test_no_find_dependencies_of_symlinks(self):
+        self.useFixture(fixture_setup.FakeElf(
+            os.path.join(self.workdir, 'linked'), needed=['libDepends.so']))
+        os.symlink('linked', os.path.join(self.workdir, 'symlinked'))
 
-        self.assertFalse(
-            mock_ms.file.called, 'magic is not needed for symlinks')
+        dependencies = pluginhandler._find_dependencies(
+            self.workdir, {'symlinked'}, self.resolver)
 
         self.assertFalse(
-            mock_dependencies.called,
-            'statically linked files should not have library dependencies')
+            self.mock_dependencies.called,
+            'symlinks should not have library dependencies')
 
         self.assertFalse(
             dependencies,
-            'statically linked files should not have library dependencies')
+            'symlinks should not have library dependencies')
 
-    @patch('magic.open')
-    def test_fail_to_load_magic_raises_exception(self, mock_magic):
-        mock_magic.return_value.load.return_value = 1
+    def test_corrupted_elf_file_logs_warning(self):
+        fake_logger = fixtures.FakeLogger(level=logging.WARNING)
+        self.useFixture(fake_logger)
+        corrupted_path = os.path.join(self.workdir, 'corrupted')
+        with open(corrupted_path, 'wb') as f:
+            f.write(b'\x7fELF\x02\x01\x01' + bytes(9) + b'\x02\x00')
 
-        raised = self.assertRaises(
-            RuntimeError,
-            pluginhandler._find_dependencies, '.', set())
+        dependencies = pluginhandler._find_dependencies(
+            self.workdir, {'corrupted'}, self.resolver)
 
-        self.assertEqual(
-            raised.__str__(), 'Cannot load magic header detection')
+        self.assertFalse(self.mock_dependencies.called)
+        self.assertFalse(dependencies)
+        self.assertIn(
+            'Unable to determine library dependencies for {!r}'.format(
+                corrupted_path),
+            fake_logger.output)
 
     def test__combine_filesets_explicit_wildcard(self):
         fileset_1 = ['a', 'b']
@@ -2578,6 +2857,235 @@ class CleanPullTestCase(tests.TestCase):
         self.assertFalse(os.path.exists(handler.sourcedir))
         self.assertTrue(os.path.isdir(real_source_directory))
 
+    def test_clean_pull_removes_dependency_cache(self):
+        handler = mocks.loadplugin('test-part')
+
+        handler.pull()
+        handler.build()
+        open(os.path.join(handler.installdir, 'file'), 'w').close()
+        handler.stage()
+        handler.prime()
+        cache_file = os.path.join(self.parts_dir, 'test-part',
+                                  'dependency-cache.json')
+        self.assertTrue(os.path.exists(cache_file))
+
+        handler.clean_prime({})
+        handler.clean_build()
+        self.assertTrue(os.path.exists(cache_file))
+
+        handler.clean_pull()
+        self.assertFalse(os.path.exists(cache_file))
+
+
+class BuildCacheTestCase(tests.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.project_options = snapcraft.ProjectOptions(use_build_cache=True)
+
+        patcher = patch('snapcraft.plugins.nil.NilPlugin.build')
+        self.build_mock = patcher.start()
+        self.build_mock.side_effect = self._fake_build
+        self.addCleanup(patcher.stop)
+
+    def _load(self, part_properties=None):
+        properties = {'source': 'src'}
+        if part_properties:
+            properties.update(part_properties)
+        handler = mocks.loadplugin(
+            'test-part', part_properties=properties,
+            project_options=self.project_options)
+        self.handler = handler
+        return handler
+
+    def _fake_build(self):
+        with open(os.path.join(self.handler.installdir, 'built'), 'w') as f:
+            f.write('built')
+
+    def _build_clean_build(self, handler):
+        handler.pull()
+        handler.build()
+        handler.clean_build()
+        handler.build()
+
+    def test_unchanged_part_is_restored(self):
+        os.mkdir('src')
+        handler = self._load()
+
+        self._build_clean_build(handler)
+
+        self.assertEqual(1, self.build_mock.call_count)
+        self.assertThat(os.path.join(handler.installdir, 'built'),
+                        FileContains('built'))
+        self.assertEqual('build', handler.last_step())
+
+    def test_source_change_builds_again(self):
+        os.mkdir('src')
+        handler = self._load()
+        handler.pull()
+        handler.build()
+        handler.clean()
+
+        with open(os.path.join('src', 'new'), 'w') as f:
+            f.write('new')
+        handler.pull()
+        handler.build()
+
+        self.assertEqual(2, self.build_mock.call_count)
+
+    def test_property_change_builds_again(self):
+        os.mkdir('src')
+        self._build_clean_build(self._load())
+
+        handler = self._load({'build-attributes': ['no-system-libraries']})
+        handler.build()
+
+        self.assertEqual(2, self.build_mock.call_count)
+
+    def test_deb_arch_change_builds_again(self):
+        os.mkdir('src')
+        self._build_clean_build(self._load())
+
+        self.project_options = snapcraft.ProjectOptions(
+            use_build_cache=True, target_deb_arch='armhf')
+        handler = self._load()
+        handler.clean_build()
+        handler.build()
+
+        self.assertEqual(2, self.build_mock.call_count)
+
+    def test_staged_dependency_change_builds_again(self):
+        os.mkdir('src')
+        dependency = mocks.loadplugin('dependency')
+        dependency.makedirs()
+        with open(os.path.join(dependency.installdir, 'lib'), 'w') as f:
+            f.write('1')
+        dependency.stage()
+        handler = self._load()
+        handler.deps = [dependency]
+        self._build_clean_build(handler)
+        self.assertEqual(1, self.build_mock.call_count)
+
+        dependency.clean_stage({})
+        with open(os.path.join(dependency.installdir, 'lib'), 'w') as f:
+            f.write('2')
+        dependency.stage()
+        handler.clean_build()
+        handler.build()
+
+        self.assertEqual(2, self.build_mock.call_count)
+
+    def test_other_project_dir_builds_again(self):
+        os.mkdir('src')
+        self._build_clean_build(self._load())
+
+        os.makedirs(os.path.join('other', 'src'))
+        os.chdir('other')
+        self.project_options = snapcraft.ProjectOptions(use_build_cache=True)
+        handler = self._load()
+        handler.pull()
+        handler.build()
+
+        self.assertEqual(2, self.build_mock.call_count)
+
+    def test_unused_entries_are_pruned(self):
+        os.mkdir('src')
+        os.mkdir('unused')
+        build_cache = cache.BuildCache()
+        build_cache.cache(
+            fingerprint='unused', installdir='unused',
+            state=states.BuildState([], {}, None))
+        os.utime(os.path.join(build_cache.build_cache_root, 'unused'),
+                 (0, 0))
+
+        handler = self._load()
+        handler.pull()
+        handler.build()
+
+        self.assertEqual(
+            [handler._build_fingerprint()],
+            os.listdir(build_cache.build_cache_root))
+
+    def test_cache_disabled_by_default(self):
+        os.mkdir('src')
+        self.project_options = snapcraft.ProjectOptions()
+
+        self._build_clean_build(self._load())
+
+        self.assertEqual(2, self.build_mock.call_count)
+
+
+class IncrementalBuildDirTestCase(tests.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        patcher = patch('snapcraft.plugins.nil.NilPlugin.build')
+        self.build_mock = patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.handler = mocks.loadplugin('test-part')
+        self.handler.makedirs()
+        with open(os.path.join(self.handler.sourcedir, 'source'), 'w') as f:
+            f.write('1')
+
+    def _fail_build(self):
+        self.build_mock.side_effect = RuntimeError('build failed')
+        self.assertRaises(RuntimeError, self.handler.build)
+        self.build_mock.side_effect = None
+
+    def test_unfinished_build_dir_is_updated(self):
+        self._fail_build()
+        built = os.path.join(self.handler.code.build_basedir, 'built')
+        open(built, 'w').close()
+        source = os.path.join(self.handler.sourcedir, 'source')
+        with open(source, 'w') as f:
+            f.write('2')
+        os.utime(source, ns=(0, 0))
+
+        self.handler.build()
+
+        self.assertTrue(os.path.exists(built))
+        self.assertThat(
+            os.path.join(self.handler.code.build_basedir, 'source'),
+            FileContains('2'))
+
+    def test_clean_build_drops_unfinished_build_dir(self):
+        self._fail_build()
+
+        self.handler.clean_build()
+
+        self.assertFalse(os.path.exists(self.handler.code.build_basedir))
+
+    def test_deferred_clean_keeps_build_dir(self):
+        self.handler.build()
+        built = os.path.join(self.handler.code.build_basedir, 'built')
+        open(built, 'w').close()
+        source = os.path.join(self.handler.sourcedir, 'source')
+        with open(source, 'w') as f:
+            f.write('2')
+        os.utime(source, ns=(0, 0))
+
+        self.handler.clean(step='build', deferred=True)
+        self.handler.build()
+
+        self.assertTrue(os.path.exists(built))
+        self.assertThat(
+            os.path.join(self.handler.code.build_basedir, 'source'),
+            FileContains('2'))
+
+    def test_clean_build_dir_is_copied_again(self):
+        self.handler.build()
+        built = os.path.join(self.handler.code.build_basedir, 'built')
+        open(built, 'w').close()
+
+        self.handler.clean_build()
+        self.handler.build()
+
+        self.assertFalse(os.path.exists(built))
+        self.assertThat(
+            os.path.join(self.handler.code.build_basedir, 'source'),
+            FileContains('1'))
+
 
 class CleanBuildTestCase(tests.TestCase):
 
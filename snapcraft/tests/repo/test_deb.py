@@ -45,9 +45,16 @@ class UbuntuTestCase(RepoBaseTestCase):
 
         self.mock_package = MagicMock()
         self.mock_package.candidate.fetch_binary.side_effect = _fetch_binary
+        self.mock_package.candidate.filename = (
+            'pool/main/f/fake-package/fake-package.deb')
         self.mock_cache.return_value.get_changes.return_value = [
             self.mock_package]
 
+        patcher = patch('snapcraft.internal.repo._deb._updated_cache_dirs',
+                        new=set())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
     def test_get_pkg_name_parts_name_only(self):
         name, version = _deb._get_pkg_name_parts('hello')
         self.assertEqual('hello', name)
@@ -136,6 +143,109 @@ class UbuntuTestCase(RepoBaseTestCase):
             os.path.join(self.tempdir, 'download', 'fake-package.deb'),
             FileExists())
 
+    def _update_calls(self):
+        return [c for c in self.mock_cache.mock_calls
+                if c == call().update(fetch_progress=ANY, sources_list=ANY)]
+
+    @patch('snapcraft.internal.repo._deb.apt.apt_pkg')
+    def test_index_is_updated_once_per_process(self, mock_apt_pkg):
+        for _ in range(2):
+            ubuntu = _deb.Ubuntu(self.tempdir)
+            ubuntu.is_valid('fake-package')
+            ubuntu.get(['fake-package'])
+
+        self.assertEqual(1, len(self._update_calls()))
+
+    @patch('snapcraft.internal.repo._deb.apt.apt_pkg')
+    def test_index_is_reused_until_it_expires(self, mock_apt_pkg):
+        project_options = snapcraft.ProjectOptions(apt_update_ttl=3600)
+        ubuntu = _deb.Ubuntu(self.tempdir, project_options=project_options)
+        stamp = os.path.join(ubuntu._cache.base_dir, 'update-stamp')
+        open(stamp, 'w').close()
+
+        ubuntu.get(['fake-package'])
+        self.assertEqual(0, len(self._update_calls()))
+
+        os.utime(stamp, (0, 0))
+        ubuntu.get(['fake-package'])
+        self.assertEqual(1, len(self._update_calls()))
+
+    @patch('snapcraft.internal.repo._deb.apt.apt_pkg')
+    def test_index_without_stamp_is_reused_until_it_expires(
+            self, mock_apt_pkg):
+        # Updated by a snapcraft not writing the stamp.
+        ubuntu = _deb.Ubuntu(self.tempdir)
+        lists_dir = os.path.join(
+            ubuntu._cache.base_dir, 'var', 'lib', 'apt', 'lists')
+        os.makedirs(os.path.join(lists_dir, 'partial'))
+        open(os.path.join(lists_dir, 'archive_Packages'), 'w').close()
+
+        ubuntu.get(['fake-package'])
+        self.assertEqual(0, len(self._update_calls()))
+
+        os.utime(lists_dir, (0, 0))
+        ubuntu.get(['fake-package'])
+        self.assertEqual(1, len(self._update_calls()))
+
+    @patch('snapcraft.internal.repo._deb.apt.apt_pkg')
+    def test_empty_lists_need_an_update(self, mock_apt_pkg):
+        ubuntu = _deb.Ubuntu(self.tempdir)
+        os.makedirs(os.path.join(
+            ubuntu._cache.base_dir, 'var', 'lib', 'apt', 'lists', 'partial'))
+
+        ubuntu.get(['fake-package'])
+
+        self.assertEqual(1, len(self._update_calls()))
+
+    @patch('snapcraft.internal.repo._deb.apt.apt_pkg')
+    def test_offline_uses_the_cached_index_and_packages(self, mock_apt_pkg):
+        project_options = snapcraft.ProjectOptions(offline=True)
+        ubuntu = _deb.Ubuntu(self.tempdir, project_options=project_options)
+        open(os.path.join(ubuntu._cache.base_dir, 'update-stamp'),
+             'w').close()
+        os.utime(os.path.join(ubuntu._cache.base_dir, 'update-stamp'),
+                 (0, 0))
+        open(os.path.join(ubuntu._cache.packages_dir, 'fake-package.deb'),
+             'w').close()
+
+        ubuntu.get(['fake-package'])
+
+        self.assertEqual(0, len(self._update_calls()))
+        self.assertThat(
+            os.path.join(self.tempdir, 'download', 'fake-package.deb'),
+            FileExists())
+
+    @patch('snapcraft.internal.repo._deb.apt.apt_pkg')
+    def test_offline_without_an_index(self, mock_apt_pkg):
+        project_options = snapcraft.ProjectOptions(offline=True)
+        ubuntu = _deb.Ubuntu(self.tempdir, project_options=project_options)
+
+        self.assertRaises(
+            errors.PackageIndexNotCachedError,
+            ubuntu.get, ['fake-package'])
+        self.assertEqual(0, len(self._update_calls()))
+
+    @patch('snapcraft.internal.repo._deb.apt.apt_pkg')
+    def test_offline_with_a_package_not_cached(self, mock_apt_pkg):
+        project_options = snapcraft.ProjectOptions(offline=True)
+        ubuntu = _deb.Ubuntu(self.tempdir, project_options=project_options)
+        open(os.path.join(ubuntu._cache.base_dir, 'update-stamp'),
+             'w').close()
+
+        self.assertRaises(
+            errors.PackageNotCachedError,
+            ubuntu.get, ['fake-package'])
+        self.assertFalse(self.mock_package.candidate.fetch_binary.called)
+
+    @patch('snapcraft.repo._deb._get_geoip_country_code_prefix')
+    def test_offline_does_not_look_up_geoip(self, mock_cc):
+        project_options = snapcraft.ProjectOptions(use_geoip=True,
+                                                   offline=True)
+
+        _deb.Ubuntu(self.tempdir, project_options=project_options)
+
+        self.assertFalse(mock_cc.called)
+
     @patch('snapcraft.repo._deb._get_geoip_country_code_prefix')
     def test_sources_is_none_uses_default(self, mock_cc):
         mock_cc.return_value = 'ar'
@@ -37,12 +37,12 @@ class TestFileBase(tests.TestCase):
         mock_download.assert_called_once_with()
         file_src.provision.assert_called_once_with(file_src.source_dir)
 
-    @mock.patch('shutil.copy2')
-    def test_pull_copy(self, mock_shutil_copy2):
+    @mock.patch('snapcraft.file_utils.reflink_or_copy')
+    def test_pull_copy(self, mock_reflink_or_copy):
         file_src = self.get_mock_file_base('snapcraft.yaml', 'dir')
         file_src.pull()
 
-        mock_shutil_copy2.assert_called_once_with(
+        mock_reflink_or_copy.assert_called_once_with(
             file_src.source, file_src.source_dir)
         file_src.provision.assert_called_once_with(file_src.source_dir)
 
@@ -0,0 +1,190 @@
+# -*- Mode:Python; indent-tabs-mode:nil; tab-width:4 -*-
+#
+# Copyright (C) 2017 Canonical Ltd
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+from unittest import mock
+
+import yaml
+
+import snapcraft.internal
+from snapcraft import tests
+
+
+class PartStatesTestCase(tests.TestCase):
+
+    def setUp(self):
+        super().setUp()
+
+        class Project:
+            def __init__(self):
+                self.deb_arch = 'amd64'
+
+        self.statedir = os.path.join('parts', 'part', 'state')
+        self.state = snapcraft.internal.states.BuildState(
+            ['foo'], {'foo': 'bar'}, Project())
+        self.part_states = snapcraft.internal.states.PartStates(
+            self.statedir)
+
+    def test_no_statedir(self):
+        self.assertFalse(self.part_states.has_run('pull'))
+        self.assertIsNone(self.part_states.get('pull'))
+
+    def test_reads_existing_state_files(self):
+        os.makedirs(self.statedir)
+        with open(os.path.join(self.statedir, 'build'), 'w') as f:
+            f.write(yaml.dump(self.state))
+
+        self.assertTrue(self.part_states.has_run('build'))
+        self.assertFalse(self.part_states.has_run('stage'))
+        self.assertEqual(self.state, self.part_states.get('build'))
+
+    def test_states_are_read_once(self):
+        os.makedirs(self.statedir)
+        self.part_states.set('build', self.state)
+
+        with mock.patch('os.listdir') as listdir_mock:
+            with mock.patch('yaml.load', wraps=yaml.load) as load_mock:
+                for _ in range(3):
+                    self.assertTrue(self.part_states.has_run('build'))
+                    self.assertEqual(
+                        self.state, self.part_states.get('build'))
+
+        self.assertFalse(listdir_mock.called)
+        self.assertEqual(1, load_mock.call_count)
+
+    def test_set_writes_through(self):
+        os.makedirs(self.statedir)
+
+        self.part_states.set('build', self.state)
+
+        with open(os.path.join(self.statedir, 'build')) as f:
+            self.assertEqual(self.state, yaml.load(f))
+
+    def test_remove_deletes_file_and_empty_statedir(self):
+        os.makedirs(self.statedir)
+        self.part_states.set('build', self.state)
+
+        self.part_states.remove('build')
+
+        self.assertFalse(self.part_states.has_run('build'))
+        self.assertFalse(os.path.exists(self.statedir))
+
+    def test_reload_picks_up_changes_from_elsewhere(self):
+        os.makedirs(self.statedir)
+        self.assertFalse(self.part_states.has_run('build'))
+        with open(os.path.join(self.statedir, 'build'), 'w') as f:
+            f.write(yaml.dump(self.state))
+
+        self.part_states.reload()
+
+        self.assertEqual(self.state, self.part_states.get('build'))
+
+    def test_manifest_is_kept_next_to_the_state(self):
+        os.makedirs(self.statedir)
+        manifest = {'foo': [3, 1500000000000000000, 42]}
+        state = snapcraft.internal.states.StageState(
+            {'foo'}, set(), manifest=manifest)
+
+        self.part_states.set('stage', state)
+
+        with open(os.path.join(self.statedir, 'stage')) as f:
+            self.assertNotIn('manifest', f.read())
+        self.part_states.reload()
+        self.assertEqual(manifest, self.part_states.get('stage').manifest)
+
+        self.part_states.remove('stage')
+        self.assertFalse(os.path.exists(self.statedir))
+
+    def test_file_lists_are_kept_next_to_the_state(self):
+        os.makedirs(self.statedir)
+        state = snapcraft.internal.states.StageState({'bin/foo'}, {'bin'})
+
+        self.part_states.set('stage', state)
+
+        with open(os.path.join(self.statedir, 'stage')) as f:
+            contents = f.read()
+        self.assertNotIn('bin/foo', contents)
+        self.part_states.reload()
+        loaded_state = self.part_states.get('stage')
+        self.assertNotIn('files', vars(loaded_state))
+        self.assertEqual({'bin/foo'}, loaded_state.files)
+        self.assertEqual(state, loaded_state)
+
+        self.part_states.remove('stage')
+        self.assertFalse(os.path.exists(self.statedir))
+
+    def test_file_lists_in_state_files_are_read(self):
+        # As written by older versions of snapcraft.
+        os.makedirs(self.statedir)
+        state = snapcraft.internal.states.StageState({'bin/foo'}, {'bin'})
+        with open(os.path.join(self.statedir, 'stage'), 'w') as f:
+            f.write(yaml.dump(state))
+
+        self.assertEqual(state, self.part_states.get('stage'))
+
+    def test_missing_file_lists(self):
+        os.makedirs(self.statedir)
+        self.part_states.set(
+            'stage', snapcraft.internal.states.StageState({'foo'}, set()))
+        os.remove(os.path.join(self.statedir, 'stage.files'))
+        self.part_states.reload()
+
+        state = self.part_states.get('stage')
+
+        self.assertRaises(AttributeError, getattr, state, 'files')
+
+    def test_file_lists_are_read_before_removing_them(self):
+        os.makedirs(self.statedir)
+        self.part_states.set(
+            'stage', snapcraft.internal.states.StageState({'foo'}, set()))
+        state = self.part_states.get('stage')
+
+        self.part_states.remove('stage')
+
+        self.assertEqual({'foo'}, state.files)
+
+    def test_deferred_state_is_set_aside(self):
+        os.makedirs(self.statedir)
+        manifest = {'foo': [3, 1500000000000000000, 42]}
+        state = snapcraft.internal.states.StageState(
+            {'foo'}, set(), manifest=manifest)
+        self.part_states.set('stage', state)
+
+        self.part_states.defer('stage')
+
+        self.assertFalse(self.part_states.has_run('stage'))
+        self.part_states = snapcraft.internal.states.PartStates(
+            self.statedir)
+        self.assertFalse(self.part_states.has_run('stage'))
+        deferred_state = self.part_states.get_deferred('stage')
+        self.assertEqual(state, deferred_state)
+        self.assertEqual({'foo'}, deferred_state.files)
+        self.assertEqual(manifest, deferred_state.manifest)
+
+        self.part_states.remove_deferred('stage')
+        self.assertIsNone(self.part_states.get_deferred('stage'))
+        self.assertFalse(os.path.exists(self.statedir))
+
+    def test_deferred_state_is_kept_when_the_step_is_removed(self):
+        os.makedirs(self.statedir)
+        self.part_states.set(
+            'stage', snapcraft.internal.states.StageState({'foo'}, set()))
+        self.part_states.defer('stage')
+
+        self.part_states.remove('stage')
+
+        self.assertEqual({'foo'},
+                         self.part_states.get_deferred('stage').files)
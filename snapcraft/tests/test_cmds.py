@@ -14,13 +14,13 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-import logging
 import os
 
-import fixtures
-
 import snapcraft.internal
-from snapcraft.internal import common
+from snapcraft.internal import (
+    common,
+    pluginhandler,
+)
 from snapcraft import tests
 
 
@@ -31,10 +31,7 @@ class TestCommands(tests.TestCase):
         common.set_schemadir(os.path.join(__file__,
                              '..', '..', '..', 'schema'))
 
-    def test_load_config_with_invalid_plugin_exits_with_error(self):
-        fake_logger = fixtures.FakeLogger(level=logging.ERROR)
-        self.useFixture(fake_logger)
-
+    def test_invalid_plugin_fails_when_the_plugin_is_needed(self):
         open('my-icon.png', 'w').close()
         with open('snapcraft.yaml', 'w') as f:
             f.write('''name: test-package
@@ -50,11 +47,10 @@ parts:
     plugin: does-not-exist
 ''')
 
+        # Plugins are only loaded when needed.
+        config = snapcraft.internal.load_config()
+
         raised = self.assertRaises(
-            SystemExit,
-            snapcraft.internal.load_config)
+            pluginhandler.PluginError, getattr, config, 'build_tools')
 
-        self.assertEqual(raised.code, 1, 'Wrong exit code returned.')
-        self.assertIn(
-            'Issue while loading plugin: unknown plugin: does-not-exist\n',
-            fake_logger.output)
+        self.assertEqual('unknown plugin: does-not-exist', str(raised))
@@ -0,0 +1,211 @@
+# -*- Mode:Python; indent-tabs-mode:nil; tab-width:4 -*-
+#
+# Copyright (C) 2017 Canonical Ltd
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+
+from testtools.matchers import Equals
+
+from snapcraft.internal import (
+    elf,
+    errors,
+)
+from snapcraft import tests
+from snapcraft.tests import fixture_setup
+
+
+class ReadElfFileTestCase(tests.TestCase):
+
+    def test_read_elf_file(self):
+        self.useFixture(fixture_setup.FakeElf(
+            'app', needed=['libfoo.so.1', 'libbar.so.2'],
+            interp='/lib64/ld-linux-x86-64.so.2', soname='app.so.1',
+            rpath='/a:/b', runpath='$ORIGIN/lib'))
+
+        elf_file = elf.read_elf_file('app')
+
+        self.assertThat(elf_file.path, Equals('app'))
+        self.assertThat(elf_file.arch, Equals((2, '<', 62)))
+        self.assertThat(elf_file.interp,
+                        Equals('/lib64/ld-linux-x86-64.so.2'))
+        self.assertThat(elf_file.needed,
+                        Equals(['libfoo.so.1', 'libbar.so.2']))
+        self.assertThat(elf_file.soname, Equals('app.so.1'))
+        self.assertThat(elf_file.rpath, Equals(['/a', '/b']))
+        self.assertThat(elf_file.runpath, Equals(['$ORIGIN/lib']))
+
+    def test_read_32bit_elf_file(self):
+        self.useFixture(fixture_setup.FakeElf(
+            'app', needed=['libfoo.so.1'], elf_class=32, machine=40))
+
+        elf_file = elf.read_elf_file('app')
+
+        self.assertThat(elf_file.arch, Equals((1, '<', 40)))
+        self.assertThat(elf_file.needed, Equals(['libfoo.so.1']))
+        self.assertIsNone(elf_file.interp)
+        self.assertIsNone(elf_file.runpath)
+
+    def test_read_non_elf_file(self):
+        with open('script', 'w') as f:
+            f.write('#!/bin/sh\n')
+
+        self.assertIsNone(elf.read_elf_file('script'))
+
+    def test_read_truncated_elf_file(self):
+        self.useFixture(fixture_setup.FakeElf('app', needed=['libfoo.so.1']))
+        with open('app', 'rb') as f:
+            contents = f.read()
+        with open('app', 'wb') as f:
+            f.write(contents[:40])
+
+        raised = self.assertRaises(errors.CorruptedElfFileError,
+                                   elf.read_elf_file, 'app')
+
+        self.assertThat(raised.path, Equals('app'))
+
+
+class LibraryResolverTestCase(tests.TestCase):
+
+    def setUp(self):
+        super().setUp()
+
+        self.root = os.path.abspath('root')
+        with open('ld.so.conf', 'w') as f:
+            f.write('# no system paths\n')
+
+    def _elf(self, path, **kwargs):
+        path = os.path.join(self.root, path)
+        self.useFixture(fixture_setup.FakeElf(path, **kwargs))
+        return path
+
+    def _resolver(self, library_paths=()):
+        return elf.LibraryResolver(
+            arch_triplet='x86_64-linux-gnu',
+            library_paths=[os.path.join(self.root, p) for p in library_paths],
+            ld_so_conf='ld.so.conf')
+
+    def _dependencies(self, path, library_paths=()):
+        resolver = self._resolver(library_paths)
+        return resolver.get_dependencies(elf.read_elf_file(path))
+
+    def test_library_paths(self):
+        app = self._elf('bin/app', needed=['libfake-a.so.1'])
+        lib = self._elf('lib/libfake-a.so.1')
+
+        self.assertThat(self._dependencies(app, ['missing', 'lib']),
+                        Equals([lib]))
+
+    def test_libraries_not_found_are_omitted(self):
+        app = self._elf('bin/app', needed=['libfake-missing.so.1'])
+
+        self.assertThat(self._dependencies(app, ['lib']), Equals([]))
+
+    def test_dependencies_are_transitive(self):
+        app = self._elf('bin/app', needed=['libfake-a.so.1'])
+        lib_a = self._elf('lib/libfake-a.so.1', needed=['libfake-b.so.1'])
+        lib_b = self._elf('lib/libfake-b.so.1', needed=['libfake-a.so.1'])
+
+        self.assertThat(self._dependencies(app, ['lib']),
+                        Equals([lib_a, lib_b]))
+
+    def test_rpath_comes_before_library_paths(self):
+        app = self._elf('bin/app', needed=['libfake-a.so.1'],
+                        rpath=os.path.join(self.root, 'rpath'))
+        self._elf('lib/libfake-a.so.1')
+        lib = self._elf('rpath/libfake-a.so.1')
+
+        self.assertThat(self._dependencies(app, ['lib']), Equals([lib]))
+
+    def test_runpath_comes_after_library_paths(self):
+        app = self._elf('bin/app', needed=['libfake-a.so.1'],
+                        runpath=os.path.join(self.root, 'runpath'))
+        lib = self._elf('lib/libfake-a.so.1')
+        self._elf('runpath/libfake-a.so.1')
+
+        self.assertThat(self._dependencies(app, ['lib']), Equals([lib]))
+
+    def test_rpath_is_ignored_with_runpath(self):
+        app = self._elf('bin/app', needed=['libfake-a.so.1'],
+                        rpath=os.path.join(self.root, 'rpath'),
+                        runpath=os.path.join(self.root, 'runpath'))
+        self._elf('rpath/libfake-a.so.1')
+        lib = self._elf('runpath/libfake-a.so.1')
+
+        self.assertThat(self._dependencies(app), Equals([lib]))
+
+    def test_origin_is_expanded(self):
+        app = self._elf('bin/app', needed=['libfake-a.so.1'],
+                        runpath='$ORIGIN/../lib')
+        self._elf('lib/libfake-a.so.1')
+
+        # Like ldd, the path is not normalized.
+        self.assertThat(self._dependencies(app), Equals([
+            os.path.join(self.root, 'bin', '..', 'lib', 'libfake-a.so.1')]))
+
+    def test_rpath_of_loaders_is_searched(self):
+        app = self._elf('bin/app', needed=['libfake-a.so.1'],
+                        rpath='${ORIGIN}/../private')
+        lib_a = self._elf('lib/libfake-a.so.1', needed=['libfake-b.so.1'])
+        self._elf('private/libfake-b.so.1')
+
+        self.assertThat(self._dependencies(app, ['lib']), Equals([
+            lib_a,
+            os.path.join(self.root, 'bin', '..', 'private', 'libfake-b.so.1'),
+        ]))
+
+    def test_searched_directories(self):
+        app = self._elf('bin/app', needed=['libfake-a.so.1'],
+                        rpath='${ORIGIN}/../private')
+        self._elf('lib/libfake-a.so.1', needed=['libfake-b.so.1'],
+                  runpath='$ORIGIN/../runpath')
+        searched = set()
+
+        self._resolver(['lib']).get_dependencies(
+            elf.read_elf_file(app), searched)
+
+        self.assertThat(searched, Equals({
+            os.path.join(self.root, 'bin', '..', 'private'),
+            os.path.join(self.root, 'lib', '..', 'runpath'),
+        }))
+
+    def test_libraries_of_other_architectures_are_skipped(self):
+        app = self._elf('bin/app', needed=['libfake-a.so.1'])
+        self._elf('lib32/libfake-a.so.1', elf_class=32, machine=3)
+        self._elf('armhf/libfake-a.so.1', machine=40)
+        lib = self._elf('lib/libfake-a.so.1')
+
+        self.assertThat(
+            self._dependencies(app, ['lib32', 'armhf', 'lib']),
+            Equals([lib]))
+
+    def test_ld_so_conf(self):
+        os.makedirs('ld.so.conf.d')
+        with open('ld.so.conf', 'w') as f:
+            f.write('include ld.so.conf.d/*.conf\n')
+        with open(os.path.join('ld.so.conf.d', 'fake.conf'), 'w') as f:
+            f.write('# fake libraries\n{}\n'.format(
+                os.path.join(self.root, 'lib')))
+        app = self._elf('bin/app', needed=['libfake-a.so.1'])
+        lib = self._elf('lib/libfake-a.so.1')
+
+        self.assertThat(self._dependencies(app), Equals([lib]))
+
+    def test_dynamic_linker_is_skipped(self):
+        app = self._elf('bin/app', needed=['libfake-a.so.1', 'ld-fake.so.2'],
+                        interp=os.path.join(self.root, 'lib', 'ld-fake.so.2'))
+        lib = self._elf('lib/libfake-a.so.1')
+        self._elf('lib/ld-fake.so.2')
+
+        self.assertThat(self._dependencies(app, ['lib']), Equals([lib]))
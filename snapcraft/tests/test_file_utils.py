@@ -14,8 +14,10 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import errno
 import os
 import re
+import shutil
 import subprocess
 from unittest import mock
 
@@ -166,6 +168,90 @@ class TestLinkOrCopy(tests.TestCase):
         self.assertTrue(os.path.isfile('foo2/bar/baz/4'))
 
 
+class ReflinkOrCopyTestCase(tests.TestCase):
+
+    def setUp(self):
+        super().setUp()
+
+        patcher = mock.patch.object(file_utils, '_reflink_unsupported', set())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        with open('source', 'w') as f:
+            f.write('content')
+        os.chmod('source', 0o755)
+        os.utime('source', ns=(0, 0))
+
+    def _fake_clone(self, destination_fd, request, source_fd):
+        os.write(destination_fd, os.read(source_fd, 1024))
+
+    def assert_copied(self, destination):
+        with open(destination) as f:
+            self.assertEqual('content', f.read())
+        destination_stat = os.stat(destination)
+        self.assertEqual(0o755, destination_stat.st_mode & 0o777)
+        self.assertEqual(0, destination_stat.st_mtime_ns)
+
+    @mock.patch('fcntl.ioctl')
+    def test_clone(self, ioctl_mock):
+        ioctl_mock.side_effect = self._fake_clone
+
+        self.assertEqual(
+            'destination',
+            file_utils.reflink_or_copy('source', 'destination'))
+
+        self.assertEqual(1, ioctl_mock.call_count)
+        self.assertEqual(file_utils._FICLONE, ioctl_mock.call_args[0][1])
+        self.assert_copied('destination')
+
+    @mock.patch('fcntl.ioctl')
+    def test_clone_into_directory(self, ioctl_mock):
+        ioctl_mock.side_effect = self._fake_clone
+        os.mkdir('dir')
+
+        file_utils.reflink_or_copy('source', 'dir')
+
+        self.assert_copied(os.path.join('dir', 'source'))
+
+    @mock.patch('fcntl.ioctl')
+    def test_unsupported_falls_back_to_copy(self, ioctl_mock):
+        ioctl_mock.side_effect = OSError(errno.EOPNOTSUPP, 'not supported')
+
+        file_utils.reflink_or_copy('source', 'destination')
+        file_utils.reflink_or_copy('source', 'destination2')
+
+        self.assert_copied('destination')
+        self.assert_copied('destination2')
+        # Cloning isn't attempted again on the same filesystems.
+        self.assertEqual(1, ioctl_mock.call_count)
+
+    @mock.patch('fcntl.ioctl')
+    def test_other_errors_are_raised(self, ioctl_mock):
+        ioctl_mock.side_effect = OSError(errno.ENOSPC, 'no space left')
+
+        raised = self.assertRaises(
+            OSError, file_utils.reflink_or_copy, 'source', 'destination')
+
+        self.assertEqual(errno.ENOSPC, raised.errno)
+        self.assertFalse(os.path.exists('destination'))
+
+    @mock.patch('fcntl.ioctl')
+    def test_symlinks_are_copied_as_symlinks(self, ioctl_mock):
+        os.symlink('source', 'link')
+
+        file_utils.reflink_or_copy(
+            'link', 'destination', follow_symlinks=False)
+
+        self.assertFalse(ioctl_mock.called)
+        self.assertEqual('source', os.readlink('destination'))
+
+    def test_copy(self):
+        # Whether the filesystem running the tests can clone or not.
+        file_utils.reflink_or_copy('source', 'destination')
+
+        self.assert_copied('destination')
+
+
 class ExecutableExistsTestCase(tests.TestCase):
 
     def test_file_does_not_exist(self):
@@ -302,3 +388,154 @@ class RequiresPathExistsTestCase(tests.TestCase):
             ).__enter__)
 
         self.assertEqual("what? 'foo'", str(raised))
+
+
+class CalculateTreeDigestTestCase(tests.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        os.makedirs(os.path.join('tree', 'dir'))
+        with open(os.path.join('tree', 'dir', 'file'), 'w') as f:
+            f.write('content')
+        os.symlink('file', os.path.join('tree', 'dir', 'link'))
+        self.digest = file_utils.calculate_tree_digest('tree')
+
+    def test_same_tree_same_digest(self):
+        os.utime(os.path.join('tree', 'dir', 'file'), (0, 0))
+
+        self.assertEqual(self.digest, file_utils.calculate_tree_digest('tree'))
+
+    def test_content_change(self):
+        with open(os.path.join('tree', 'dir', 'file'), 'w') as f:
+            f.write('other content')
+
+        self.assertNotEqual(
+            self.digest, file_utils.calculate_tree_digest('tree'))
+
+    def test_executable_change(self):
+        os.chmod(os.path.join('tree', 'dir', 'file'), 0o755)
+
+        self.assertNotEqual(
+            self.digest, file_utils.calculate_tree_digest('tree'))
+
+    def test_symlink_change(self):
+        os.remove(os.path.join('tree', 'dir', 'link'))
+        os.symlink('other', os.path.join('tree', 'dir', 'link'))
+
+        self.assertNotEqual(
+            self.digest, file_utils.calculate_tree_digest('tree'))
+
+    def test_ignore(self):
+        open(os.path.join('tree', 'ignored'), 'w').close()
+
+        def ignore(directory, names):
+            return ['ignored'] if directory == 'tree' else []
+
+        self.assertEqual(
+            self.digest,
+            file_utils.calculate_tree_digest('tree', ignore=ignore))
+
+    def test_paths(self):
+        open(os.path.join('tree', 'other'), 'w').close()
+
+        self.assertEqual(
+            file_utils.calculate_tree_digest('tree', paths=['dir/file']),
+            file_utils.calculate_tree_digest('tree', paths={'dir/file'}))
+        self.assertNotEqual(
+            file_utils.calculate_tree_digest('tree', paths=['dir/file']),
+            file_utils.calculate_tree_digest('tree', paths=['other']))
+
+
+class SyncTreeTestCase(tests.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        os.makedirs(os.path.join('source', 'dir'))
+        self._write(os.path.join('source', 'dir', 'file'), 'content')
+        os.symlink('file', os.path.join('source', 'dir', 'link'))
+        os.symlink('dir', os.path.join('source', 'dirlink'))
+        self.synced = file_utils.sync_tree('source', 'destination')
+
+    def _write(self, path, content):
+        with open(path, 'w') as f:
+            f.write(content)
+
+    def _read(self, path):
+        with open(path) as f:
+            return f.read()
+
+    def test_initial_sync(self):
+        self.assertEqual(
+            {'dir', os.path.join('dir', 'file'), os.path.join('dir', 'link'),
+             'dirlink'},
+            self.synced)
+        self.assertEqual(
+            'content', self._read(os.path.join('destination', 'dir', 'file')))
+        self.assertEqual(
+            'file', os.readlink(os.path.join('destination', 'dir', 'link')))
+        self.assertEqual(
+            'dir', os.readlink(os.path.join('destination', 'dirlink')))
+        self.assertEqual(
+            os.stat(os.path.join('source', 'dir', 'file')).st_mtime_ns,
+            os.stat(os.path.join('destination', 'dir', 'file')).st_mtime_ns)
+
+    def test_unchanged_files_are_not_copied(self):
+        with mock.patch('shutil.copy2') as copy_mock:
+            file_utils.sync_tree('source', 'destination', synced=self.synced)
+
+        self.assertFalse(copy_mock.called)
+
+    def test_changed_files_are_copied(self):
+        path = os.path.join('source', 'dir', 'file')
+        self._write(path, 'new content')
+        os.utime(path, ns=(0, 0))
+
+        file_utils.sync_tree('source', 'destination', synced=self.synced)
+
+        self.assertEqual(
+            'new content',
+            self._read(os.path.join('destination', 'dir', 'file')))
+
+    def test_removed_files_are_removed_others_kept(self):
+        self._write(os.path.join('destination', 'dir', 'built'), 'built')
+        os.remove(os.path.join('source', 'dir', 'link'))
+
+        synced = file_utils.sync_tree(
+            'source', 'destination', synced=self.synced)
+
+        self.assertNotIn(os.path.join('dir', 'link'), synced)
+        self.assertFalse(
+            os.path.lexists(os.path.join('destination', 'dir', 'link')))
+        self.assertTrue(
+            os.path.exists(os.path.join('destination', 'dir', 'built')))
+
+    def test_removed_directories_are_removed(self):
+        shutil.rmtree(os.path.join('source', 'dir'))
+
+        file_utils.sync_tree('source', 'destination', synced=self.synced)
+
+        self.assertFalse(os.path.exists(os.path.join('destination', 'dir')))
+
+    def test_ignore(self):
+        self._write(os.path.join('source', 'ignored'), 'ignored')
+
+        def ignore(directory, names):
+            return ['ignored'] if directory == 'source' else []
+
+        synced = file_utils.sync_tree(
+            'source', 'destination', ignore=ignore, synced=self.synced)
+
+        self.assertNotIn('ignored', synced)
+        self.assertFalse(
+            os.path.exists(os.path.join('destination', 'ignored')))
+
+    def test_hard_linked_destination_is_not_written_to(self):
+        destination = os.path.join('destination', 'dir', 'file')
+        os.link(destination, 'other-link')
+        path = os.path.join('source', 'dir', 'file')
+        self._write(path, 'new content')
+
+        file_utils.sync_tree('source', 'destination', synced=self.synced)
+
+        self.assertEqual('content', self._read('other-link'))
+        self.assertEqual('new content', self._read(destination))
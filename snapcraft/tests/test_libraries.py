@@ -14,15 +14,15 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-import fixtures
-import logging
 import os
-import subprocess
 import tempfile
 
 from unittest import mock
 
-from snapcraft.internal import libraries
+from snapcraft.internal import (
+    elf,
+    libraries,
+)
 from snapcraft import tests
 
 
@@ -53,16 +53,11 @@ class TestGetLibraries(tests.TestCase):
     def setUp(self):
         super().setUp()
 
-        patcher = mock.patch('snapcraft.internal.common.run_output')
-        self.run_output_mock = patcher.start()
-        self.addCleanup(patcher.stop)
-
-        lines = [
-            'foo.so.1 => /lib/foo.so.1 (0xdead)',
-            'bar.so.2 => /usr/lib/bar.so.2 (0xbeef)',
-            '/lib/baz.so.2 (0x1234)',
-        ]
-        self.run_output_mock.return_value = '\t' + '\n\t'.join(lines) + '\n'
+        self.elf_file = elf.ElfFile(path='foo', arch=(2, '<', 62),
+                                    needed=['foo.so.1', 'bar.so.2'])
+        self.resolver = mock.Mock(spec=elf.LibraryResolver)
+        self.resolver.get_dependencies.return_value = [
+            '/lib/foo.so.1', '/usr/lib/bar.so.2']
 
         patcher = mock.patch('snapcraft.internal.libraries._get_system_libs')
         self.get_system_libs_mock = patcher.start()
@@ -70,34 +65,18 @@ class TestGetLibraries(tests.TestCase):
 
         self.get_system_libs_mock.return_value = frozenset()
 
-        patcher = mock.patch('os.path.exists')
-        self.path_exists_mock = patcher.start()
-        self.addCleanup(patcher.stop)
-
-        self.path_exists_mock.return_value = True
-
-        self.fake_logger = fixtures.FakeLogger(level=logging.WARNING)
-        self.useFixture(self.fake_logger)
-
     def test_get_libraries(self):
-        libs = libraries.get_dependencies('foo')
+        libs = libraries.get_dependencies(self.elf_file, self.resolver)
         self.assertEqual(libs, ['/lib/foo.so.1', '/usr/lib/bar.so.2'])
+        self.resolver.get_dependencies.assert_called_once_with(
+            self.elf_file, None)
 
     def test_get_libraries_filtered_by_system_libraries(self):
         self.get_system_libs_mock.return_value = frozenset(['foo.so.1'])
 
-        libs = libraries.get_dependencies('foo')
+        libs = libraries.get_dependencies(self.elf_file, self.resolver)
         self.assertEqual(libs, ['/usr/lib/bar.so.2'])
 
-    def test_get_libraries_ldd_failure_logs_warning(self):
-        self.run_output_mock.side_effect = subprocess.CalledProcessError(
-            1, 'foo', b'bar')
-
-        self.assertEqual(libraries.get_dependencies('foo'), [])
-        self.assertEqual(
-            "Unable to determine library dependencies for 'foo'\n",
-            self.fake_logger.output)
-
 
 class TestSystemLibsOnNewRelease(tests.TestCase):
 
@@ -109,16 +88,16 @@ class TestSystemLibsOnNewRelease(tests.TestCase):
         distro_mock.return_value = ('Ubuntu', '16.05', 'xenial')
         self.addCleanup(patcher.stop)
 
-        patcher = mock.patch('snapcraft.internal.common.run_output')
-        self.run_output_mock = patcher.start()
+        patcher = mock.patch('snapcraft.internal.libraries._libraries', None)
+        patcher.start()
         self.addCleanup(patcher.stop)
 
-        lines = [
-            'foo.so.1 => /lib/foo.so.1 (0xdead)',
-            'bar.so.2 => /usr/lib/bar.so.2 (0xbeef)',
-            '/lib/baz.so.2 (0x1234)',
-        ]
-        self.run_output_mock.return_value = '\t' + '\n\t'.join(lines) + '\n'
+        self.elf_file = elf.ElfFile(path='foo', arch=(2, '<', 62))
+        self.resolver = mock.Mock(spec=elf.LibraryResolver)
+        self.resolver.get_dependencies.return_value = [
+            '/lib/libc.so.6', '/usr/lib/bar.so.2']
 
     def test_fail_gracefully_if_system_libs_not_found(self):
-        self.assertEqual(libraries.get_dependencies('foo'), [])
+        self.assertEqual(
+            libraries.get_dependencies(self.elf_file, self.resolver),
+            ['/usr/lib/bar.so.2'])
@@ -20,10 +20,13 @@ import logging
 import os
 import re
 import shutil
+import time
 from unittest import mock
 
 import fixtures
 from testtools.matchers import (
+    Contains,
+    Equals,
     FileContains,
     FileExists,
     MatchesRegex,
@@ -33,7 +36,7 @@ from testtools.matchers import (
 import snapcraft
 from snapcraft import storeapi
 from snapcraft.file_utils import calculate_sha3_384
-from snapcraft.internal import pluginhandler, lifecycle
+from snapcraft.internal import errors, pluginhandler, lifecycle
 from snapcraft import tests
 
 
@@ -152,22 +155,17 @@ grade: stable
         }
         self.assertEqual(snap_info, expected_snap_info)
 
+        # The parts are pulled and built in child processes, only staging
+        # is logged here.
         self.assertEqual(
-            'Preparing to pull part1 \n'
-            'Pulling part1 \n'
-            '\'part2\' has prerequisites that need to be staged: part1\n'
-            'Preparing to build part1 \n'
-            'Building part1 \n'
             'Staging part1 \n'
-            'Preparing to pull part2 \n'
-            'Pulling part2 \n'
-            '\'part3\' has prerequisites that need to be staged: part2\n'
-            'Preparing to build part2 \n'
-            'Building part2 \n'
-            'Staging part2 \n'
-            'Preparing to pull part3 \n'
-            'Pulling part3 \n',
+            'Staging part2 \n',
             self.fake_logger.output)
+        config = snapcraft.internal.load_config()
+        last_steps = {p.name: p.last_step() for p in config.all_parts}
+        self.assertEqual(
+            {'part1': 'stage', 'part2': 'stage', 'part3': 'pull'},
+            last_steps)
 
     def test_os_type_returned_by_lifecycle(self):
         self.make_snapcraft_yaml("""parts:
@@ -337,6 +335,152 @@ grade: stable
             ],
             part1_output)
 
+    def test_ownership_indexes_are_written_once(self):
+        self.make_snapcraft_yaml("""parts:
+  part1:
+    plugin: nil
+  part2:
+    plugin: nil
+  part3:
+    plugin: nil
+""")
+        written = []
+        save = pluginhandler.OwnershipIndex.save
+
+        def _save(index):
+            if index._dirty:
+                written.append(os.path.basename(index._index_file))
+            save(index)
+
+        with mock.patch.object(pluginhandler.OwnershipIndex, 'save',
+                               autospec=True, side_effect=_save):
+            lifecycle.execute('prime', self.project_options)
+
+        self.assertEqual(['.prime-owners.json', '.stage-owners.json'],
+                         sorted(written))
+        for step in ('stage', 'prime'):
+            self.assertTrue(pluginhandler.OwnershipIndex(
+                self.parts_dir, step).exists())
+
+    def test_dirty_stage_only_migrates_changes(self):
+        self.make_snapcraft_yaml("""parts:
+  part1:
+    plugin: nil
+""")
+
+        lifecycle.execute('prime', self.project_options)
+        installdir = os.path.join(self.parts_dir, 'part1', 'install')
+        open(os.path.join(installdir, 'new'), 'w').close()
+
+        def _fake_dirty_report(self, step):
+            if step == 'stage':
+                return pluginhandler.DirtyReport({'foo'}, {'bar'})
+            return None
+
+        with mock.patch.object(pluginhandler.PluginHandler, 'get_dirty_report',
+                               _fake_dirty_report):
+            with mock.patch.object(
+                    pluginhandler.PluginHandler, 'clean',
+                    autospec=True,
+                    side_effect=pluginhandler.PluginHandler.clean) as clean:
+                lifecycle.execute('prime', self.project_options)
+
+        clean.assert_called_once_with(mock.ANY, step='stage',
+                                      hint='(out of date)', deferred=True)
+        self.assertTrue(os.path.exists(os.path.join(self.prime_dir, 'new')))
+
+    def test_build_clean_only_migrates_changes(self):
+        self.make_snapcraft_yaml("""parts:
+  part1:
+    plugin: nil
+""")
+        installdir = os.path.join(self.parts_dir, 'part1', 'install')
+        installed = {'unchanged': ('same', 1), 'changed': ('old', 1)}
+
+        def _install(*args):
+            os.makedirs(installdir, exist_ok=True)
+            for name, (content, mtime) in installed.items():
+                path = os.path.join(installdir, name)
+                with open(path, 'w') as f:
+                    f.write(content)
+                # Like build tools installing files with their own time.
+                os.utime(path, (mtime, mtime))
+
+        with mock.patch('snapcraft.plugins.nil.NilPlugin.build',
+                        side_effect=_install):
+            lifecycle.execute('prime', self.project_options)
+            lifecycle.clean(self.project_options, ['part1'], 'build')
+            self.assertTrue(
+                os.path.exists(os.path.join(self.prime_dir, 'unchanged')))
+
+            installed['changed'] = ('new', 2)
+            with mock.patch(
+                    'snapcraft.internal.pluginhandler._migrate_files',
+                    wraps=pluginhandler._migrate_files) as migrate_files:
+                lifecycle.execute('prime', self.project_options)
+
+        migrate_files.assert_has_calls([
+            mock.call({'changed'}, set(), installdir, self.stage_dir,
+                      fixup_func=mock.ANY),
+            mock.call({'changed'}, set(), self.stage_dir, self.prime_dir)])
+        with open(os.path.join(self.prime_dir, 'changed')) as f:
+            self.assertEqual('new', f.read())
+
+    def test_build_clean_builds_upon_build_dir(self):
+        self.make_snapcraft_yaml("""parts:
+  part1:
+    plugin: nil
+""")
+        lifecycle.execute('build', self.project_options)
+        built = os.path.join(self.parts_dir, 'part1', 'build', 'built')
+        open(built, 'w').close()
+
+        lifecycle.clean(self.project_options, ['part1'], 'build')
+        lifecycle.execute('build', self.project_options)
+
+        self.assertTrue(os.path.exists(built))
+
+    def test_build_clean_from_scratch(self):
+        self.make_snapcraft_yaml("""parts:
+  part1:
+    plugin: nil
+""")
+        lifecycle.execute('prime', self.project_options)
+        built = os.path.join(self.parts_dir, 'part1', 'build', 'built')
+        open(built, 'w').close()
+
+        lifecycle.clean(self.project_options, ['part1'], 'build',
+                        from_scratch=True)
+
+        self.assertFalse(os.path.exists(built))
+        self.assertFalse(os.path.exists(self.stage_dir))
+        self.assertFalse(os.path.exists(self.prime_dir))
+
+    def test_dirty_stage_not_run_again_is_cleaned(self):
+        self.make_snapcraft_yaml("""parts:
+  part1:
+    plugin: nil
+""")
+
+        installdir = os.path.join(self.parts_dir, 'part1', 'install')
+        os.makedirs(installdir)
+        open(os.path.join(installdir, 'file'), 'w').close()
+        with mock.patch('snapcraft.plugins.nil.NilPlugin.build'):
+            lifecycle.execute('prime', self.project_options)
+        self.assertTrue(os.path.exists(os.path.join(self.stage_dir, 'file')))
+
+        def _fake_dirty_report(self, step):
+            if step == 'stage':
+                return pluginhandler.DirtyReport({'foo'}, {'bar'})
+            return None
+
+        with mock.patch.object(pluginhandler.PluginHandler, 'get_dirty_report',
+                               _fake_dirty_report):
+            lifecycle.execute('build', self.project_options)
+
+        self.assertFalse(os.path.exists(os.path.join(self.stage_dir, 'file')))
+        self.assertFalse(os.path.exists(os.path.join(self.prime_dir, 'file')))
+
     def test_dirty_stage_restages_multiple_parts(self):
         self.make_snapcraft_yaml("""parts:
   part1:
@@ -618,6 +762,237 @@ grade: stable
             "by running: snapcraft clean part1 -s pull\n",
             str(raised))
 
+    @mock.patch('snapcraft.repo.Repo.install_build_packages')
+    def test_build_packages_of_parts_only_installed_to_build(
+            self, mock_install_build_packages):
+        self.make_snapcraft_yaml("""build-packages: [foo]
+
+parts:
+  part1:
+    plugin: nil
+    build-packages: [bar]
+""")
+
+        lifecycle.execute('build', self.project_options)
+        mock_install_build_packages.assert_called_once_with(['foo', 'bar'])
+        mock_install_build_packages.reset_mock()
+
+        lifecycle.execute('build', self.project_options)
+        mock_install_build_packages.assert_called_once_with(['foo'])
+
+
+class ParallelExecutionTestCase(tests.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.useFixture(fixtures.FakeLogger(level=logging.INFO))
+        self.project_options = snapcraft.ProjectOptions(
+            parallel_part_count=4)
+
+        # Steps may run in child processes, record them in a file.
+        self.log = os.path.join(self.path, 'steps.log')
+        mark_done = pluginhandler.PluginHandler.mark_done
+
+        def _mark_done(handler, step, state=None):
+            with open(self.log, 'a') as f:
+                f.write('{} {}\n'.format(handler.name, step))
+            mark_done(handler, step, state)
+
+        patcher = mock.patch.object(
+            pluginhandler.PluginHandler, 'mark_done', _mark_done)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def make_snapcraft_yaml(self, parts):
+        super().make_snapcraft_yaml("""name: test
+version: 0
+summary: test
+description: test
+confinement: strict
+grade: stable
+
+{}
+""".format(parts))
+
+    def _steps_run(self):
+        with open(self.log) as f:
+            return [tuple(line.split()) for line in f]
+
+    def test_prereqs_are_staged_before_dependents_start(self):
+        self.make_snapcraft_yaml("""parts:
+  part1:
+    plugin: nil
+  part2:
+    plugin: nil
+    after: [part1]
+  part3:
+    plugin: nil
+""")
+
+        lifecycle.execute('prime', self.project_options)
+
+        steps_run = self._steps_run()
+        self.assertEqual(12, len(steps_run))
+        self.assertLess(steps_run.index(('part1', 'stage')),
+                        steps_run.index(('part2', 'pull')))
+        last_build = max(steps_run.index((p, 'build'))
+                         for p in ('part1', 'part2', 'part3'))
+        first_prime = min(steps_run.index((p, 'prime'))
+                          for p in ('part1', 'part2', 'part3'))
+        self.assertLess(last_build, steps_run.index(('part3', 'stage')))
+        self.assertLess(steps_run.index(('part2', 'stage')), first_prime)
+        for part in ('part1', 'part2', 'part3'):
+            self.assertThat(
+                os.path.join(self.parts_dir, part, 'state', 'prime'),
+                FileExists())
+
+    def test_prereqs_are_staged_for_earlier_steps(self):
+        self.make_snapcraft_yaml("""parts:
+  part1:
+    plugin: nil
+  part2:
+    plugin: nil
+    after: [part1]
+""")
+
+        lifecycle.execute('pull', self.project_options)
+
+        self.assertEqual(
+            [('part1', 'pull'), ('part1', 'build'), ('part1', 'stage'),
+             ('part2', 'pull')],
+            self._steps_run())
+
+    def test_steps_already_run_are_skipped(self):
+        self.make_snapcraft_yaml("""parts:
+  part1:
+    plugin: nil
+  part2:
+    plugin: nil
+""")
+        lifecycle.execute('build', self.project_options)
+        os.remove(self.log)
+
+        lifecycle.execute('stage', self.project_options)
+
+        self.assertEqual(
+            {('part1', 'stage'), ('part2', 'stage')},
+            set(self._steps_run()))
+
+    def test_exception_when_dependency_is_required(self):
+        self.make_snapcraft_yaml("""parts:
+  part1:
+    plugin: nil
+  part2:
+    plugin: nil
+    after:
+      - part1
+""")
+
+        raised = self.assertRaises(
+            RuntimeError,
+            lifecycle.execute,
+            'build', self.project_options,
+            part_names=['part2'])
+
+        self.assertEqual(
+            "Requested 'build' of 'part2' but there are unsatisfied "
+            "prerequisites: 'part1'",
+            str(raised))
+
+    def test_collisions_are_only_checked_for_built_parts(self):
+        self.make_snapcraft_yaml("""parts:
+  part1:
+    plugin: nil
+  part2:
+    plugin: nil
+    after: [part1]
+  part3:
+    plugin: nil
+""")
+        build = pluginhandler.PluginHandler.build
+
+        def _build(handler):
+            # part1 is staged for part2 while part3 builds.
+            if handler.name == 'part3':
+                time.sleep(1)
+            build(handler)
+
+        checked = []
+        check_for_collisions = pluginhandler.check_for_collisions
+
+        def _check_for_collisions(parts):
+            built = {name for name, step in self._steps_run()
+                     if step == 'build'}
+            checked.append([p.name for p in parts])
+            self.assertTrue({p.name for p in parts}.issubset(built))
+            check_for_collisions(parts)
+
+        with mock.patch.object(pluginhandler.PluginHandler, 'build',
+                               _build), \
+                mock.patch('snapcraft.internal.pluginhandler.'
+                           'check_for_collisions', _check_for_collisions):
+            lifecycle.execute('stage', self.project_options)
+
+        self.assertNotIn('part3', checked[0])
+        self.assertEqual(['part1', 'part2', 'part3'], sorted(checked[-1]))
+
+    def test_sources_are_fetched_concurrently_with_one_job(self):
+        self.project_options = snapcraft.ProjectOptions(
+            parallel_part_count=1)
+        self.make_snapcraft_yaml("""parts:
+  part1:
+    plugin: nil
+  part2:
+    plugin: nil
+""")
+
+        with mock.patch.object(pluginhandler.PluginHandler,
+                               'mark_prefetched',
+                               autospec=True) as mark_prefetched:
+            lifecycle.execute('build', self.project_options)
+
+        self.assertEqual(
+            ['part1', 'part2'],
+            sorted(c[0][0].name for c in mark_prefetched.call_args_list))
+        self.assertEqual({('part1', 'build'), ('part2', 'build')},
+                         {s for s in self._steps_run() if s[1] == 'build'})
+
+    def test_single_part_runs_in_this_process(self):
+        self.project_options = snapcraft.ProjectOptions(
+            parallel_part_count=1)
+        self.make_snapcraft_yaml("""parts:
+  part1:
+    plugin: nil
+""")
+
+        with mock.patch('snapcraft.internal.lifecycle._Executor.'
+                        '_run_parallel') as run_parallel:
+            lifecycle.execute('build', self.project_options)
+
+        self.assertFalse(run_parallel.called)
+        self.assertEqual([('part1', 'pull'), ('part1', 'build')],
+                         self._steps_run())
+
+    def test_build_error_stops_dependents(self):
+        self.make_snapcraft_yaml("""parts:
+  part1:
+    plugin: nil
+  part2:
+    plugin: nil
+    after: [part1]
+""")
+
+        def _fail(handler):
+            raise RuntimeError('{} failed to build'.format(handler.name))
+
+        with mock.patch.object(pluginhandler.PluginHandler, 'build', _fail):
+            raised = self.assertRaises(
+                RuntimeError, lifecycle.execute, 'build',
+                self.project_options)
+
+        self.assertEqual('part1 failed to build', str(raised))
+        self.assertNotIn(('part2', 'pull'), self._steps_run())
+
 
 class CoreSetupTestCase(tests.TestCase):
 
@@ -730,3 +1105,130 @@ class CoreSetupTestCase(tests.TestCase):
             print('description: description', file=f)
 
         return lifecycle.snap(self.project_options, directory=core_path)
+
+
+class SnapTestCase(tests.TestCase):
+
+    def setUp(self):
+        super().setUp()
+
+        os.makedirs(os.path.join('mysnap', 'meta'))
+        with open(os.path.join('mysnap', 'meta', 'snap.yaml'), 'w') as f:
+            f.write('name: my-snap\nversion: 99\narchitectures: [amd64]\n')
+        with open(os.path.join('mysnap', 'data'), 'wb') as f:
+            f.write(b'\0' * 10000)
+
+        # A fake mksquashfs recording its arguments, the snaps it packs are
+        # smaller with gzip than with xz.
+        bin_override = os.path.join(self.path, 'bin')
+        os.mkdir(bin_override)
+        self.witness_path = os.path.join(self.path, 'mksquashfs_witness')
+        with open(os.path.join(bin_override, 'mksquashfs'), 'w') as f:
+            print('#!/bin/sh', file=f)
+            print('if [ "$1" = -version ]; then', file=f)
+            print('    echo "mksquashfs version $MKSQUASHFS_VERSION"', file=f)
+            print('    exit 0', file=f)
+            print('fi', file=f)
+            print('echo "$@" >> {}'.format(self.witness_path), file=f)
+            print('case "$@" in *gzip*) size=2000;; *) size=1000;; esac',
+                  file=f)
+            print('head -c $size /dev/zero > "$2"', file=f)
+            print('head -c 1000000 /dev/zero', file=f)
+        os.chmod(os.path.join(bin_override, 'mksquashfs'), 0o755)
+        self.useFixture(fixtures.EnvironmentVariable(
+            'PATH', '{}:{}'.format(bin_override, os.path.expandvars('$PATH'))))
+        self.useFixture(fixtures.EnvironmentVariable(
+            'MKSQUASHFS_VERSION', '4.4 (2019/08/29)'))
+
+        self.project_options = snapcraft.ProjectOptions()
+
+    def test_snap_with_dev_profile(self):
+        fake_logger = fixtures.FakeLogger(level=logging.WARNING)
+        self.useFixture(fake_logger)
+
+        lifecycle.snap(self.project_options, 'mysnap', profile='dev',
+                       processors=2, block_size='1M')
+
+        self.assertThat(self.witness_path, FileContains(
+            '{} my-snap_99_amd64.snap -noappend -comp gzip '
+            '-Xcompression-level 1 -no-xattrs -all-root -processors 2 '
+            '-b 1048576\n'.format(os.path.abspath('mysnap'))))
+        self.assertThat(fake_logger.output, Contains(
+            "the store only accepts snaps packed with the 'release' one"))
+
+    def test_snap_with_invalid_profile(self):
+        raised = self.assertRaises(
+            errors.InvalidPackingProfileError,
+            lifecycle.snap, self.project_options, 'mysnap', profile='fast')
+
+        self.assertThat(str(raised), Equals(
+            "Unknown packing profile 'fast', it must be one of: release, "
+            "dev"))
+        self.assertThat(self.witness_path, Not(FileExists()))
+
+    def test_snap_reproducibly(self):
+        self.useFixture(fixtures.EnvironmentVariable(
+            'SOURCE_DATE_EPOCH', '1500000000'))
+
+        lifecycle.snap(self.project_options, 'mysnap', reproducible=True)
+
+        self.assertThat(self.witness_path, FileContains(
+            matcher=MatchesRegex(
+                '.* -all-root -reproducible -mkfs-time 1500000000 '
+                '-all-time 1500000000 -sort \\S+\n$')))
+        order_file = os.path.join(
+            self.path, '.cache', 'snapcraft', 'projects', 'my-snap',
+            'packing_order', 'amd64.json')
+        self.assertThat(order_file, FileContains(matcher=Contains('"data"')))
+
+    def test_snap_reproducibly_with_an_old_mksquashfs(self):
+        self.useFixture(fixtures.EnvironmentVariable(
+            'MKSQUASHFS_VERSION', '4.3-git (2014/06/09)'))
+        fake_logger = fixtures.FakeLogger(level=logging.WARNING)
+        self.useFixture(fake_logger)
+
+        lifecycle.snap(self.project_options, 'mysnap', processors=4,
+                       reproducible=True)
+
+        self.assertThat(self.witness_path, FileContains(
+            matcher=MatchesRegex('.* -all-root -sort \\S+ -processors 1\n$')))
+        self.assertThat(fake_logger.output, Contains(
+            'mksquashfs 4.3 cannot set the time of the files it packs'))
+
+    def test_snap_reproducibly_with_invalid_source_date_epoch(self):
+        self.useFixture(fixtures.EnvironmentVariable(
+            'SOURCE_DATE_EPOCH', 'yesterday'))
+
+        self.assertRaises(
+            errors.InvalidSourceDateEpochError,
+            lifecycle.snap, self.project_options, 'mysnap',
+            reproducible=True)
+        self.assertThat(self.witness_path, Not(FileExists()))
+
+    @mock.patch('snapcraft.internal.lifecycle.ProgressBar')
+    @mock.patch('snapcraft.internal.lifecycle.is_dumb_terminal',
+                return_value=False)
+    def test_snap_reads_all_the_output(self, *mocks):
+        # mksquashfs would block writing more than the pipe holds if its
+        # output wasn't read while it runs.
+        lifecycle.snap(self.project_options, 'mysnap')
+
+        self.assertThat('my-snap_99_amd64.snap', FileExists())
+
+    def test_compression_report(self):
+        with mock.patch('builtins.print') as print_mock:
+            report = lifecycle.compression_report(
+                self.project_options, 'mysnap', block_size='64K')
+
+        unpacked_size = sum(
+            os.path.getsize(os.path.join('mysnap', path))
+            for path in ('data', os.path.join('meta', 'snap.yaml')))
+        self.assertThat(
+            [(profile, size, ratio) for profile, _, size, ratio, _ in report],
+            Equals([('release', 1000, 1000 / unpacked_size),
+                    ('dev', 2000, 2000 / unpacked_size)]))
+        self.assertThat(self.witness_path, FileContains(
+            matcher=MatchesRegex(
+                '.* -comp xz .* -b 65536\n.* -comp gzip .* -b 65536\n$')))
+        self.assertTrue(print_mock.called)
+        self.assertThat(os.listdir(), Not(Contains('release.snap')))
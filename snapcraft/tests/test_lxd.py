@@ -14,8 +14,11 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import hashlib
 import os
 import logging
+import subprocess
+import time
 from subprocess import CalledProcessError
 from unittest.mock import (
     call,
@@ -30,10 +33,12 @@ from snapcraft import ProjectOptions
 from snapcraft.internal import (
     cache,
     lxd,
+    repo,
 )
 
 
-def check_output_side_effect(fail_on_remote=False, fail_on_default=False):
+def check_output_side_effect(fail_on_remote=False, fail_on_default=False,
+                             sources='', missing_image=False, image_age=0):
     def call_effect(*args, **kwargs):
         if args[0] == ['lxc', 'remote', 'get-default']:
             if fail_on_default:
@@ -42,11 +47,40 @@ def check_output_side_effect(fail_on_remote=False, fail_on_default=False):
                 return 'local'.encode('utf-8')
         elif args[0] == ['lxc', 'list', 'my-remote:'] and fail_on_remote:
             raise CalledProcessError(returncode=255, cmd=args[0])
+        elif args[0][:3] == ['lxc', 'image', 'info']:
+            if missing_image:
+                raise CalledProcessError(returncode=1, cmd=args[0])
+            created = time.gmtime(time.time() - image_age)
+            return 'Created: {}\n'.format(
+                time.strftime('%Y/%m/%d %H:%M UTC', created)).encode('utf-8')
+        elif args[0][-1] == lxd._LOCAL_SOURCES_COMMAND:
+            return sources.encode('utf-8')
         else:
             return ''.encode('utf-8')
     return call_effect
 
 
+class FakeContainerPopen:
+    """Run the commands streaming into the container locally.
+
+    What tar extracts in the container is extracted under root instead.
+    """
+
+    def __init__(self, root, returncode=0):
+        self.root = root
+        self.returncode = returncode
+        self.commands = []
+
+    def __call__(self, cmd, **kwargs):
+        self.commands.append(cmd)
+        if self.returncode:
+            return subprocess.Popen(
+                ['sh', '-c', 'exit {}'.format(self.returncode)], **kwargs)
+        destination = os.path.join(self.root, cmd[-1].lstrip('/'))
+        os.makedirs(destination, exist_ok=True)
+        return subprocess.Popen(cmd[4:-1] + [destination], **kwargs)
+
+
 class LXDTestCase(tests.TestCase):
 
     def setUp(self):
@@ -65,6 +99,15 @@ class LXDTestCase(tests.TestCase):
             patcher.start()
             self.addCleanup(patcher.stop)
 
+            self.fake_popen = FakeContainerPopen(
+                os.path.join(self.path, 'container'))
+            patcher = patch('snapcraft.internal.lxd.Popen', self.fake_popen)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+            os.mkdir('project')
+            open(os.path.join('project', 'main.c'), 'w').close()
+
     @patch('petname.Generate')
     def test_cleanbuild(self, mock_pet):
         fake_logger = fixtures.FakeLogger(level=logging.INFO)
@@ -73,7 +116,7 @@ class LXDTestCase(tests.TestCase):
         mock_pet.return_value = 'my-pet'
 
         project_options = ProjectOptions()
-        lxd.Cleanbuilder('snap.snap', 'project.tar', project_options).execute()
+        lxd.Cleanbuilder('snap.snap', 'project', project_options).execute()
         expected_arch = project_options.deb_arch
 
         self.assertEqual(
@@ -90,10 +133,6 @@ class LXDTestCase(tests.TestCase):
                   'local:snapcraft-my-pet']),
             call(['lxc', 'config', 'set', 'local:snapcraft-my-pet',
                   'environment.SNAPCRAFT_SETUP_CORE', '1']),
-            call(['lxc', 'file', 'push', 'project.tar',
-                  'local:snapcraft-my-pet//root/project.tar']),
-            call(['lxc', 'exec', 'local:snapcraft-my-pet', '--',
-                  'tar', 'xvf', '/root/project.tar']),
             call(['lxc', 'exec', 'local:snapcraft-my-pet', '--',
                   'python3', '-c',
                   'import urllib.request; '
@@ -119,13 +158,19 @@ class LXDTestCase(tests.TestCase):
 
         mock_pet.return_value = 'my-pet'
 
+        sources = 'deb http://archive.ubuntu.com/ubuntu xenial main\n'
+        self.check_output_mock.side_effect = check_output_side_effect(
+            sources=sources)
         cache_dir = cache.SnapcraftCache().cache_root
         os.makedirs(cache_dir)
         open(os.path.join(cache_dir, 'foo'), 'w').close()
+        for digest in (repo.get_sources_digest(sources), 'other-digest'):
+            packages_dir = cache.AptStagePackageCache(
+                sources_digest=digest).packages_dir
+            open(os.path.join(packages_dir, 'foo.deb'), 'w').close()
 
         project_options = ProjectOptions()
-        lxd.Cleanbuilder('snap.snap', 'project.tar', project_options).execute()
-        expected_arch = project_options.deb_arch
+        lxd.Cleanbuilder('snap.snap', 'project', project_options).execute()
 
         self.assertEqual(
             'Setting up container with project assets\n'
@@ -135,43 +180,212 @@ class LXDTestCase(tests.TestCase):
             'Retrieved snap.snap\n',
             fake_logger.output)
 
+        self.check_output_mock.assert_has_calls([
+            call(['lxc', 'exec', 'local:snapcraft-my-pet', '--',
+                  'python3', '-c', lxd._LOCAL_SOURCES_COMMAND]),
+        ])
+        self.assertEqual(
+            [['lxc', 'exec', 'local:snapcraft-my-pet', '--',
+              'tar', 'xf', '-', '-C', '/root']] * 2,
+            self.fake_popen.commands)
+        self.assertNotIn(
+            'push', [c[0][0][1] for c in self.check_call_mock.call_args_list])
+
+        container_cache = os.path.join(
+            'container', 'root', '.cache', 'snapcraft')
+        container_packages_dir = os.path.join(
+            container_cache, 'stage-packages', 'apt',
+            repo.get_sources_digest(sources), 'var', 'cache', 'apt',
+            'archives')
+        self.assertTrue(
+            os.path.isfile(os.path.join(container_packages_dir, 'foo.deb')))
+        self.assertEqual(
+            ['stage-packages'], os.listdir(container_cache))
+        self.assertEqual(
+            [repo.get_sources_digest(sources)],
+            os.listdir(os.path.join(
+                container_cache, 'stage-packages', 'apt')))
+
+    def test_no_cache_to_copy(self):
+        cb = lxd.Cleanbuilder('snap.snap', 'project', ProjectOptions())
+
+        cb._setup_project()
+
+        self.assertEqual(1, len(self.fake_popen.commands))
+        self.assertFalse(os.path.exists(cache.SnapcraftCache().cache_root))
+
+    @patch('petname.Generate')
+    def test_cleanbuild_streams_the_project(self, mock_pet):
+        mock_pet.return_value = 'my-pet'
+        os.mkdir(os.path.join('project', 'parts'))
+        open(os.path.join('project', 'parts', 'foo'), 'w').close()
+
+        def tar_filter(tarinfo):
+            if tarinfo.name == './parts':
+                return None
+            return tarinfo
+
+        lxd.Cleanbuilder('snap.snap', 'project', ProjectOptions(),
+                         tar_filter=tar_filter).execute()
+
+        self.assertEqual(
+            ['lxc', 'exec', 'local:snapcraft-my-pet', '--',
+             'tar', 'xf', '-', '-C', '/root'],
+            self.fake_popen.commands[0])
+        container_root = os.path.join('container', 'root')
+        self.assertTrue(
+            os.path.isfile(os.path.join(container_root, 'main.c')))
+        self.assertFalse(
+            os.path.exists(os.path.join(container_root, 'parts')))
+        self.assertFalse(
+            any(name.endswith('.tar') for name in os.listdir()))
+
+    def test_failed_project_stream(self):
+        self.fake_popen.returncode = 2
+
+        cb = lxd.Cleanbuilder('snap.snap', 'project', ProjectOptions())
+
+        raised = self.assertRaises(CalledProcessError, cb._setup_project)
+        self.assertEqual(2, raised.returncode)
+
+    def test_project_stream_fails_early(self):
+        # More than fits in the pipe, tar exits before all of it is written.
+        with open(os.path.join('project', 'big'), 'wb') as f:
+            f.write(b'\0' * 1024 * 1024)
+        self.fake_popen.returncode = 2
+
+        cb = lxd.Cleanbuilder('snap.snap', 'project', ProjectOptions())
+
+        raised = self.assertRaises(CalledProcessError, cb._setup_project)
+        self.assertEqual(2, raised.returncode)
+
+    @patch('petname.Generate')
+    def test_cleanbuild_with_cached_image(self, mock_pet):
+        mock_pet.return_value = 'my-pet'
+
+        project_options = ProjectOptions()
+        lxd.Cleanbuilder('snap.snap', 'project', project_options,
+                         cached_image=True,
+                         build_packages=['make', 'gcc', 'make']).execute()
+        image = 'local:snapcraft-devel-xenial-{}-{}'.format(
+            project_options.deb_arch,
+            hashlib.sha256(b'gcc make').hexdigest()[:12])
+
+        self.check_output_mock.assert_has_calls([
+            call(['lxc', 'image', 'info', image])])
         self.check_call_mock.assert_has_calls([
-            call(['lxc', 'launch', '-e',
-                  'ubuntu:xenial/{}'.format(expected_arch),
-                  'local:snapcraft-my-pet']),
+            call(['lxc', 'launch', '-e', image, 'local:snapcraft-my-pet']),
             call(['lxc', 'config', 'set', 'local:snapcraft-my-pet',
                   'environment.SNAPCRAFT_SETUP_CORE', '1']),
-            call(['lxc', 'file', 'push', 'project.tar',
-                  'local:snapcraft-my-pet//root/project.tar']),
             call(['lxc', 'exec', 'local:snapcraft-my-pet', '--',
-                  'tar', 'xvf', '/root/project.tar']),
+                  'python3', '-c', lxd._NETWORK_PROBE_COMMAND]),
             call(['lxc', 'exec', 'local:snapcraft-my-pet', '--',
-                  'mkdir', '-p', '/root/.cache/snapcraft/.']),
-            call(['lxc', 'file', 'push', os.path.join(cache_dir, 'foo'),
-                  'local:snapcraft-my-pet//root/.cache/snapcraft/./foo']),
+                  'snapcraft', 'snap', '--output', 'snap.snap']),
+        ])
+        commands = [c[0][0] for c in self.check_call_mock.call_args_list]
+        self.assertNotIn(
+            ['lxc', 'exec', 'local:snapcraft-my-pet', '--',
+             'apt-get', 'update'], commands)
+
+    @patch('petname.Generate')
+    def test_cleanbuild_publishes_missing_cached_image(self, mock_pet):
+        mock_pet.return_value = 'my-pet'
+        self.check_output_mock.side_effect = check_output_side_effect(
+            missing_image=True)
+
+        project_options = ProjectOptions()
+        lxd.Cleanbuilder('snap.snap', 'project', project_options,
+                         cached_image=True, build_packages=['gcc']).execute()
+        alias = 'snapcraft-devel-xenial-{}-{}'.format(
+            project_options.deb_arch,
+            hashlib.sha256(b'gcc').hexdigest()[:12])
+
+        self.check_call_mock.assert_has_calls([
+            call(['lxc', 'launch',
+                  'ubuntu:xenial/{}'.format(project_options.deb_arch),
+                  'local:snapcraft-my-pet']),
             call(['lxc', 'exec', 'local:snapcraft-my-pet', '--',
-                  'python3', '-c',
-                  'import urllib.request; '
-                  'urllib.request.urlopen('
-                  '"http://start.ubuntu.com/connectivity-check.html", '
-                  'timeout=5)']),
+                  'python3', '-c', lxd._NETWORK_PROBE_COMMAND]),
             call(['lxc', 'exec', 'local:snapcraft-my-pet', '--',
                   'apt-get', 'update']),
             call(['lxc', 'exec', 'local:snapcraft-my-pet', '--',
                   'apt-get', 'install', 'snapcraft', '-y']),
+            call(['lxc', 'exec', 'local:snapcraft-my-pet', '--',
+                  'apt-get', 'install', '-y', 'gcc']),
+            call(['lxc', 'stop', 'local:snapcraft-my-pet']),
+            call(['lxc', 'publish', 'local:snapcraft-my-pet', 'local:',
+                  '--alias', alias]),
+            call(['lxc', 'delete', '-f', 'local:snapcraft-my-pet']),
+            call(['lxc', 'launch', '-e', 'local:{}'.format(alias),
+                  'local:snapcraft-my-pet']),
+        ])
+
+    @patch('petname.Generate')
+    def test_cleanbuild_updates_day_old_cached_image(self, mock_pet):
+        mock_pet.return_value = 'my-pet'
+        self.check_output_mock.side_effect = check_output_side_effect(
+            image_age=2 * 24 * 60 * 60)
+
+        lxd.Cleanbuilder('snap.snap', 'project', ProjectOptions(),
+                         cached_image=True).execute()
+
+        self.check_call_mock.assert_has_calls([
+            call(['lxc', 'exec', 'local:snapcraft-my-pet', '--',
+                  'apt-get', 'update']),
             call(['lxc', 'exec', 'local:snapcraft-my-pet', '--',
                   'snapcraft', 'snap', '--output', 'snap.snap']),
-            call(['lxc', 'file', 'pull',
-                  'local:snapcraft-my-pet//root/snap.snap',
-                  'snap.snap']),
-            call(['lxc', 'stop', '-f', 'local:snapcraft-my-pet']),
         ])
+        commands = [c[0][0] for c in self.check_call_mock.call_args_list]
+        self.assertFalse(any('publish' in c for c in commands))
+
+    @patch('petname.Generate')
+    def test_cleanbuild_publishes_old_cached_image_again(self, mock_pet):
+        mock_pet.return_value = 'my-pet'
+        self.check_output_mock.side_effect = check_output_side_effect(
+            image_age=lxd._IMAGE_MAX_AGE + 60)
+
+        project_options = ProjectOptions()
+        lxd.Cleanbuilder('snap.snap', 'project', project_options,
+                         cached_image=True).execute()
+        alias = 'snapcraft-devel-xenial-{}-{}'.format(
+            project_options.deb_arch, hashlib.sha256(b'').hexdigest()[:12])
+
+        self.assertIn(
+            call(['lxc', 'launch',
+                  'ubuntu:xenial/{}'.format(project_options.deb_arch),
+                  'local:snapcraft-my-pet']),
+            self.check_call_mock.call_args_list)
+        self.check_call_mock.assert_has_calls([
+            call(['lxc', 'stop', 'local:snapcraft-my-pet']),
+            call(['lxc', 'image', 'delete', 'local:{}'.format(alias)]),
+            call(['lxc', 'publish', 'local:snapcraft-my-pet', 'local:',
+                  '--alias', alias]),
+        ])
+        # Freshly published, the package lists are up to date.
+        self.assertEqual(1, self.check_call_mock.call_args_list.count(
+            call(['lxc', 'exec', 'local:snapcraft-my-pet', '--',
+                  'apt-get', 'update'])))
+
+    def test_image_alias_has_snapcraft_version(self):
+        with patch('snapcraft.__version__', '2.34+git1.abc'):
+            alias = lxd._get_image_alias('amd64', [])
+
+        self.assertEqual('snapcraft-2.34-git1.abc-xenial-amd64-{}'.format(
+            hashlib.sha256(b'').hexdigest()[:12]), alias)
+
+    @patch('snapcraft.internal.lxd.sleep')
+    def test_wait_for_network_probes_before_waiting(self, mock_sleep):
+        cb = lxd.Cleanbuilder('snap.snap', 'project', ProjectOptions())
+
+        cb._wait_for_network()
+
+        self.assertFalse(mock_sleep.called)
 
     @patch('snapcraft.internal.lxd.sleep')
     def test_wait_for_network_loops(self, mock_sleep):
         self.check_call_mock.side_effect = CalledProcessError(-1, ['my-cmd'])
 
-        cb = lxd.Cleanbuilder('snap.snap', 'project.tar', 'amd64')
+        cb = lxd.Cleanbuilder('snap.snap', 'project', 'amd64')
 
         raised = self.assertRaises(
             CalledProcessError,
@@ -194,7 +408,7 @@ class LXDTestCase(tests.TestCase):
         mock_run.side_effect = run_effect
 
         project_options = ProjectOptions(debug=True)
-        lxd.Cleanbuilder('snap.snap', 'project.tar', project_options).execute()
+        lxd.Cleanbuilder('snap.snap', 'project', project_options).execute()
 
         self.assertIn(['bash', '-i'], call_list)
 
@@ -214,7 +428,7 @@ class LXDTestCase(tests.TestCase):
         self.assertRaises(
             CalledProcessError,
             lxd.Cleanbuilder(
-                'snap.snap', 'project.tar',
+                'snap.snap', 'project',
                 project_options).execute)
 
         self.assertNotIn(['bash', '-i'], call_list)
@@ -224,7 +438,7 @@ class LXDTestCase(tests.TestCase):
         mock_pet.return_value = 'my-pet'
 
         project_options = ProjectOptions()
-        lxd.Cleanbuilder('snap.snap', 'project.tar', project_options,
+        lxd.Cleanbuilder('snap.snap', 'project', project_options,
                          remote='my-remote').execute()
         expected_arch = project_options.deb_arch
 
@@ -234,10 +448,6 @@ class LXDTestCase(tests.TestCase):
                   'my-remote:snapcraft-my-pet']),
             call(['lxc', 'config', 'set', 'my-remote:snapcraft-my-pet',
                   'environment.SNAPCRAFT_SETUP_CORE', '1']),
-            call(['lxc', 'file', 'push', 'project.tar',
-                  'my-remote:snapcraft-my-pet//root/project.tar']),
-            call(['lxc', 'exec', 'my-remote:snapcraft-my-pet', '--',
-                  'tar', 'xvf', '/root/project.tar']),
             call(['lxc', 'exec', 'my-remote:snapcraft-my-pet', '--',
                   'python3', '-c',
                   'import urllib.request; '
@@ -270,7 +480,7 @@ class LXDTestCase(tests.TestCase):
                 'properly.\n'
                 'Refer to the documentation at '
                 'https://linuxcontainers.org/lxd/getting-started-cli.'):
-            lxd.Cleanbuilder('snap.snap', 'project.tar',
+            lxd.Cleanbuilder('snap.snap', 'project',
                              project_options)
 
     @patch('snapcraft.internal.lxd.Cleanbuilder._container_run')
@@ -282,5 +492,5 @@ class LXDTestCase(tests.TestCase):
         project_options = ProjectOptions(debug=False)
         with ExpectedException(lxd.SnapcraftEnvironmentError,
                                'There are either.*my-remote.*'):
-            lxd.Cleanbuilder('snap.snap', 'project.tar',
+            lxd.Cleanbuilder('snap.snap', 'project',
                              project_options, remote='my-remote')
@@ -14,7 +14,12 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import json
 import logging
+import os
+import subprocess
+import sys
+import unittest
 from unittest import mock
 
 import fixtures
@@ -32,7 +37,9 @@ class TestMain(TestCase):
             snapcraft.main.main([])
             mock_project_options.assert_called_once_with(
                 debug=False, parallel_builds=True, target_deb_arch=None,
-                use_geoip=False)
+                use_geoip=False, parallel_part_count=1,
+                parallel_fetch_count=4, use_build_cache=False,
+                apt_update_ttl=3600, offline=False)
             self.assertTrue(mock_cmd.called, mock_cmd.called)
 
     @mock.patch('snapcraft.internal.lifecycle.snap')
@@ -42,7 +49,9 @@ class TestMain(TestCase):
             self.assertTrue(mock_cmd.called, mock_cmd.called)
             mock_project_options.assert_called_once_with(
                 debug=False, parallel_builds=True, target_deb_arch=None,
-                use_geoip=True)
+                use_geoip=True, parallel_part_count=1,
+                parallel_fetch_count=4, use_build_cache=False,
+                apt_update_ttl=3600, offline=False)
 
     def test_command_error(self):
         fake_logger = fixtures.FakeLogger(level=logging.ERROR)
@@ -87,7 +96,9 @@ class TestMain(TestCase):
             snapcraft.main.main(['--debug'])
             mock_project_options.assert_called_once_with(
                 debug=True, parallel_builds=True, target_deb_arch=None,
-                use_geoip=False)
+                use_geoip=False, parallel_part_count=1,
+                parallel_fetch_count=4, use_build_cache=False,
+                apt_update_ttl=3600, offline=False)
 
     @mock.patch('snapcraft.internal.lifecycle.snap')
     def test_command_with_parallel_builds(self, mock_cmd):
@@ -95,7 +106,9 @@ class TestMain(TestCase):
             snapcraft.main.main([])
             mock_project_options.assert_called_once_with(
                 debug=False, parallel_builds=True, target_deb_arch=None,
-                use_geoip=False)
+                use_geoip=False, parallel_part_count=1,
+                parallel_fetch_count=4, use_build_cache=False,
+                apt_update_ttl=3600, offline=False)
 
     @mock.patch('snapcraft.internal.lifecycle.snap')
     def test_command_disable_parallel_build(self, mock_cmd):
@@ -103,7 +116,85 @@ class TestMain(TestCase):
             snapcraft.main.main(['--no-parallel-build'])
             mock_project_options.assert_called_once_with(
                 debug=False, parallel_builds=False, target_deb_arch=None,
-                use_geoip=False)
+                use_geoip=False, parallel_part_count=1,
+                parallel_fetch_count=4, use_build_cache=False,
+                apt_update_ttl=3600, offline=False)
+
+    @mock.patch('snapcraft.internal.lifecycle.snap')
+    def test_command_with_jobs(self, mock_cmd):
+        with mock.patch('snapcraft.ProjectOptions') as mock_project_options:
+            snapcraft.main.main(['--jobs', '4'])
+            mock_project_options.assert_called_once_with(
+                debug=False, parallel_builds=True, target_deb_arch=None,
+                use_geoip=False, parallel_part_count=4,
+                parallel_fetch_count=4, use_build_cache=False,
+                apt_update_ttl=3600, offline=False)
+
+    @mock.patch('snapcraft.internal.lifecycle.snap')
+    def test_command_with_fetch_jobs(self, mock_cmd):
+        with mock.patch('snapcraft.ProjectOptions') as mock_project_options:
+            snapcraft.main.main(['--jobs', '4', '--fetch-jobs', '8'])
+            mock_project_options.assert_called_once_with(
+                debug=False, parallel_builds=True, target_deb_arch=None,
+                use_geoip=False, parallel_part_count=4,
+                parallel_fetch_count=8, use_build_cache=False,
+                apt_update_ttl=3600, offline=False)
+
+    @mock.patch('snapcraft.internal.lifecycle.snap')
+    def test_command_with_build_cache(self, mock_cmd):
+        with mock.patch('snapcraft.ProjectOptions') as mock_project_options:
+            snapcraft.main.main(['--enable-build-cache'])
+            mock_project_options.assert_called_once_with(
+                debug=False, parallel_builds=True, target_deb_arch=None,
+                use_geoip=False, parallel_part_count=1,
+                parallel_fetch_count=4, use_build_cache=True,
+                apt_update_ttl=3600, offline=False)
+
+    @mock.patch('snapcraft.internal.lifecycle.snap')
+    def test_command_with_apt_update_ttl_and_offline(self, mock_cmd):
+        with mock.patch('snapcraft.ProjectOptions') as mock_project_options:
+            snapcraft.main.main(['--apt-update-ttl', '0', '--offline'])
+            mock_project_options.assert_called_once_with(
+                debug=False, parallel_builds=True, target_deb_arch=None,
+                use_geoip=False, parallel_part_count=1,
+                parallel_fetch_count=4, use_build_cache=False,
+                apt_update_ttl=0, offline=True)
+
+    def test_command_with_offline_and_geoip(self):
+        raised = self.assertRaises(
+            SystemExit, snapcraft.main.main, ['--offline', '--enable-geoip'])
+
+        self.assertEqual(
+            '--offline cannot be used with --enable-geoip', str(raised))
+
+    def test_command_with_invalid_apt_update_ttl(self):
+        raised = self.assertRaises(
+            SystemExit, snapcraft.main.main, ['--apt-update-ttl', '-1'])
+
+        self.assertEqual(
+            "--apt-update-ttl needs to be a number of seconds, not '-1'",
+            str(raised))
+
+    @mock.patch('snapcraft.internal.lifecycle.execute')
+    def test_command_with_trace(self, mock_execute):
+        def execute(*args):
+            with snapcraft.internal.tracing.span('step'):
+                pass
+        mock_execute.side_effect = execute
+
+        snapcraft.main.main(['--trace', 'trace.json', 'pull'])
+
+        with open('trace.json') as f:
+            trace = json.load(f)
+        self.assertIn('step', [e['name'] for e in trace['traceEvents']])
+        self.assertFalse(snapcraft.internal.tracing.is_enabled())
+
+    def test_command_with_invalid_jobs(self):
+        raised = self.assertRaises(
+            SystemExit, snapcraft.main.main, ['--jobs', '0'])
+
+        self.assertEqual(
+            "--jobs needs to be a positive integer, not '0'", str(raised))
 
     @mock.patch('snapcraft.internal.lifecycle.snap')
     def test_command_with_target_deb_arch(self, mock_cmd):
@@ -111,4 +202,67 @@ class TestMain(TestCase):
             snapcraft.main.main(['--target-arch', 'arm64'])
             mock_project_options.assert_called_once_with(
                 debug=False, parallel_builds=True, target_deb_arch='arm64',
-                use_geoip=False)
+                use_geoip=False, parallel_part_count=1,
+                parallel_fetch_count=4, use_build_cache=False,
+                apt_update_ttl=3600, offline=False)
+
+
+class StartupTestCase(TestCase):
+
+    # Dependencies only some of the commands need, importing them would
+    # slow every run of snapcraft down.
+    deferred_modules = [
+        'apt',
+        'jsonschema',
+        'magic',
+        'pkg_resources',
+        'pymacaroons',
+        'requests',
+        'snapcraft._store',
+        'snapcraft.internal.lifecycle',
+        'snapcraft.internal.pluginhandler',
+        'snapcraft.internal.project_loader',
+        'snapcraft.internal.repo',
+        'snapcraft.internal.sources',
+        'snapcraft.storeapi',
+    ]
+
+    def _imported_modules(self, statement):
+        env = os.environ.copy()
+        env['PYTHONPATH'] = os.path.dirname(
+            os.path.dirname(snapcraft.__file__))
+        output = subprocess.check_output(
+            [sys.executable, '-X', 'importtime', '-c', statement],
+            stderr=subprocess.STDOUT, env=env).decode()
+        # Lines look like 'import time:  self [us] | cumulative | module'.
+        return [line.split('|')[-1].strip()
+                for line in output.splitlines()
+                if line.startswith('import time:')]
+
+    @unittest.skipUnless(sys.version_info >= (3, 7),
+                         '-X importtime needs python 3.7')
+    def test_main_defers_heavy_imports(self):
+        modules = self._imported_modules('import snapcraft.main')
+
+        self.assertIn('snapcraft.main', modules)
+        for module in self.deferred_modules:
+            self.assertNotIn(module, modules)
+
+    @unittest.skipUnless(sys.version_info >= (3, 7),
+                         '-X importtime needs python 3.7')
+    def test_help_does_not_import_lifecycle(self):
+        modules = self._imported_modules(
+            'import snapcraft.main; snapcraft.main.main(["help", "topics"])')
+
+        self.assertIn('snapcraft._help', modules)
+        self.assertNotIn('snapcraft.internal.lifecycle', modules)
+        self.assertNotIn('snapcraft.internal.parts', modules)
+
+    @unittest.skipUnless(sys.version_info >= (3, 7),
+                         '-X importtime needs python 3.7')
+    def test_deferred_attributes_are_imported_on_use(self):
+        modules = self._imported_modules(
+            'import snapcraft; snapcraft.login; snapcraft.sources.Git')
+
+        self.assertIn('snapcraft.storeapi', modules)
+        self.assertIn('snapcraft.internal.sources', modules)
@@ -26,7 +26,7 @@ from testtools import ExpectedException
 from testtools.matchers import Equals
 
 import snapcraft
-from snapcraft.internal import dirs, parts
+from snapcraft.internal import dirs, parts, pluginhandler
 from snapcraft.internal import project_loader
 from snapcraft.internal import errors
 from snapcraft import tests
@@ -359,6 +359,36 @@ parts:
         self.assertEqual(config.parts.build_tools,
                          ['gcc-arm-linux-gnueabihf'])
 
+    def test_config_loads_plugins_when_needed(self):
+        self.make_snapcraft_yaml("""name: test
+version: "1"
+summary: test
+description: test
+confinement: strict
+grade: stable
+
+parts:
+  part1:
+    plugin: nil
+    build-packages: [foo]
+  part2:
+    plugin: nil
+    after: [part1]
+""")
+
+        with unittest.mock.patch.object(
+                pluginhandler.PluginHandler, '_load_code') as mock_load_code:
+            config = project_loader.Config()
+
+            self.assertEqual(['part1', 'part2'], config.part_names)
+            self.assertEqual({'part1'}, config.parts.get_prereqs('part2'))
+            self.assertEqual(
+                ['part1'],
+                [p.name for p in config.parts.get_part('part2').deps])
+            self.assertFalse(mock_load_code.called)
+
+        self.assertEqual(['foo'], config.build_tools)
+
     def test_config_has_no_extra_build_tools_when_not_cross_compiling(self):
         class ProjectOptionsFake(snapcraft.ProjectOptions):
             @property
@@ -1781,6 +1811,47 @@ class ValidationBaseTestCase(tests.TestCase):
         }
 
 
+class SchemaLoadingTestCase(tests.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        dirs.setup_dirs()
+
+        self.data = {
+            'name': 'my-package-1',
+            'version': '1.0',
+            'summary': 'my summary',
+            'description': 'my description',
+            'parts': {'part1': {'plugin': 'nil'}},
+        }
+
+    @unittest.mock.patch.dict('snapcraft._schema._schemas', clear=True)
+    def test_schema_is_loaded_once(self):
+        with unittest.mock.patch('yaml.load',
+                                 wraps=snapcraft._schema.yaml.load) as load:
+            validator = project_loader.Validator(self.data)
+            other_validator = project_loader.Validator(self.data)
+            self.assertThat(load.call_count, Equals(1))
+
+        self.assertIs(validator.part_schema, other_validator.part_schema)
+        self.assertIs(validator.definitions_schema,
+                      other_validator.definitions_schema)
+
+    def test_schema_is_loaded_from_the_cache(self):
+        with unittest.mock.patch.dict('snapcraft._schema._schemas',
+                                      clear=True):
+            schema = project_loader.Validator(self.data).schema
+
+        with unittest.mock.patch.dict('snapcraft._schema._schemas',
+                                      clear=True):
+            with unittest.mock.patch('yaml.load') as load:
+                validator = project_loader.Validator(self.data)
+                validator.validate()
+                load.assert_not_called()
+
+        self.assertThat(validator.schema, Equals(schema))
+
+
 class ValidationTestCase(ValidationBaseTestCase):
 
     def test_summary_too_long(self):
@@ -2058,27 +2129,34 @@ parts:
         self.fake_logger = fixtures.FakeLogger(level=logging.ERROR)
         self.useFixture(self.fake_logger)
         self.expected_message_template = (
-            "Issue while loading plugin: properties failed to load for "
-            "part1: Additional properties are not allowed ('{}' was "
-            "unexpected)\n")
+            "properties failed to load for part1: Additional properties are "
+            "not allowed ('{}' was unexpected)")
+
+    def _load_part1_code(self):
+        # The plugin properties are validated when the plugin is loaded,
+        # which is when a step needs it.
+        config = project_loader.load_config()
+        return config.parts.get_part('part1').code
 
     def test_slots_as_properties_should_fail(self):
         self.data += '        slots: [slot1]'
         self.make_snapcraft_yaml(self.data)
 
-        self.assertRaises(SystemExit, project_loader.load_config)
+        raised = self.assertRaises(
+            pluginhandler.PluginError, self._load_part1_code)
 
         expected_message = self.expected_message_template.format('slots')
-        self.assertIn(expected_message, self.fake_logger.output)
+        self.assertEqual(expected_message, str(raised))
 
     def test_plugs_as_properties_should_fail(self):
         self.data += '        plugs: [plug1]'
         self.make_snapcraft_yaml(self.data)
 
-        self.assertRaises(SystemExit, project_loader.load_config)
+        raised = self.assertRaises(
+            pluginhandler.PluginError, self._load_part1_code)
 
         expected_message = self.expected_message_template.format('plugs')
-        self.assertIn(expected_message, self.fake_logger.output)
+        self.assertEqual(expected_message, str(raised))
 
 
 class TestFilesets(tests.TestCase):
@@ -0,0 +1,163 @@
+# -*- Mode:Python; indent-tabs-mode:nil; tab-width:4 -*-
+#
+# Copyright (C) 2017 Canonical Ltd
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import time
+
+from snapcraft.internal import scheduler
+from snapcraft import tests
+
+
+class SchedulerTestCase(tests.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.log = os.path.join(self.path, 'log')
+
+    def _record(self, name):
+        def _write():
+            with open(self.log, 'a') as f:
+                f.write('{} {}\n'.format(name, os.getpid()))
+        return _write
+
+    def _read_log(self):
+        with open(self.log) as f:
+            return [line.split() for line in f]
+
+    def test_requirements_run_first(self):
+        jobs = scheduler.Scheduler({'build': 4})
+        jobs.add('c', self._record('c'), requires={'a', 'b'}, pool='build')
+        jobs.add('a', self._record('a'), pool='build')
+        jobs.add('b', self._record('b'), requires={'a'})
+
+        jobs.run()
+
+        names = [name for name, _ in self._read_log()]
+        self.assertEqual(['a', 'b', 'c'], names)
+
+    def test_pool_jobs_run_in_child_processes(self):
+        jobs = scheduler.Scheduler({'build': 2})
+        jobs.add('child', self._record('child'), pool='build')
+        jobs.add('parent', self._record('parent'))
+
+        jobs.run()
+
+        pids = dict(self._read_log())
+        self.assertNotEqual(str(os.getpid()), pids['child'])
+        self.assertEqual(str(os.getpid()), pids['parent'])
+
+    def test_unknown_requirements_are_done(self):
+        jobs = scheduler.Scheduler({})
+        jobs.add('a', self._record('a'), requires={'unknown'})
+
+        jobs.run()
+
+        self.assertEqual(1, len(self._read_log()))
+
+    def test_on_done_runs_in_parent(self):
+        done = []
+        jobs = scheduler.Scheduler({'build': 1})
+        jobs.add('a', self._record('a'), pool='build',
+                 on_done=done.append)
+
+        jobs.run()
+
+        self.assertEqual([None], done)
+
+    def test_on_done_receives_result(self):
+        done = []
+        jobs = scheduler.Scheduler({'build': 1})
+        jobs.add('child', lambda: ['child'], pool='build', on_done=done.extend)
+        jobs.add('parent', lambda: ['parent'], requires={'child'},
+                 on_done=done.extend)
+
+        jobs.run()
+
+        self.assertEqual(['child', 'parent'], done)
+
+    def test_child_error_is_raised_and_stops_scheduling(self):
+        def _fail():
+            raise RuntimeError('build failed')
+
+        jobs = scheduler.Scheduler({'build': 1})
+        jobs.add('a', _fail, pool='build')
+        jobs.add('b', self._record('b'), requires={'a'}, pool='build')
+
+        raised = self.assertRaises(RuntimeError, jobs.run)
+
+        self.assertEqual('build failed', str(raised))
+        self.assertFalse(os.path.exists(self.log))
+
+    def test_on_done_error_waits_for_running_jobs(self):
+        def _fail(result):
+            raise RuntimeError('marking failed')
+
+        def _slow():
+            time.sleep(0.2)
+            self._record('slow')()
+
+        jobs = scheduler.Scheduler({'build': 2})
+        jobs.add('a', lambda: None, pool='build', on_done=_fail)
+        jobs.add('slow', _slow, pool='build')
+        jobs.add('b', self._record('b'), requires={'a'})
+
+        raised = self.assertRaises(RuntimeError, jobs.run)
+
+        self.assertEqual('marking failed', str(raised))
+        self.assertEqual(['slow'], [name for name, _ in self._read_log()])
+
+    def test_parent_on_done_error_is_raised(self):
+        def _fail(result):
+            raise RuntimeError('marking failed')
+
+        jobs = scheduler.Scheduler({})
+        jobs.add('a', lambda: None, on_done=_fail)
+        jobs.add('b', self._record('b'), requires={'a'})
+
+        raised = self.assertRaises(RuntimeError, jobs.run)
+
+        self.assertEqual('marking failed', str(raised))
+        self.assertFalse(os.path.exists(self.log))
+
+    def test_parent_error_is_raised(self):
+        def _fail():
+            raise RuntimeError('stage failed')
+
+        jobs = scheduler.Scheduler({})
+        jobs.add('a', _fail)
+
+        raised = self.assertRaises(RuntimeError, jobs.run)
+
+        self.assertEqual('stage failed', str(raised))
+
+    def test_unknown_pool(self):
+        jobs = scheduler.Scheduler({'build': 1})
+
+        raised = self.assertRaises(
+            ValueError, jobs.add, 'a', self._record('a'), pool='pull')
+
+        self.assertEqual("Unknown pool 'pull'", str(raised))
+
+    def test_unsatisfiable_requirements(self):
+        jobs = scheduler.Scheduler({})
+        jobs.add('a', self._record('a'), requires={'b'})
+        jobs.add('b', self._record('b'), requires={'a'})
+
+        raised = self.assertRaises(RuntimeError, jobs.run)
+
+        self.assertEqual(
+            "Unable to schedule 'a', 'b': unsatisfiable requirements",
+            str(raised))
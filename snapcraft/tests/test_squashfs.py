@@ -0,0 +1,155 @@
+# -*- Mode:Python; indent-tabs-mode:nil; tab-width:4 -*-
+#
+# Copyright (C) 2017 Canonical Ltd
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+
+import fixtures
+from testtools.matchers import Equals, FileContains
+
+from snapcraft.internal import (
+    errors,
+    squashfs,
+)
+from snapcraft import tests
+
+
+class GetMksquashfsArgsTestCase(tests.TestCase):
+
+    def test_defaults_match_the_review_tools(self):
+        self.assertThat(
+            squashfs.get_mksquashfs_args(),
+            Equals(['-noappend', '-comp', 'xz', '-no-xattrs', '-all-root']))
+
+    def test_os_snaps_keep_owners(self):
+        self.assertThat(
+            squashfs.get_mksquashfs_args(snap_type='os'),
+            Equals(['-noappend', '-comp', 'xz', '-no-xattrs']))
+
+    def test_dev_profile(self):
+        self.assertThat(
+            squashfs.get_mksquashfs_args(profile='dev'),
+            Equals(['-noappend', '-comp', 'gzip', '-Xcompression-level', '1',
+                    '-no-xattrs', '-all-root']))
+
+    def test_processors_and_block_size(self):
+        self.assertThat(
+            squashfs.get_mksquashfs_args(processors=4, block_size='1m'),
+            Equals(['-noappend', '-comp', 'xz', '-no-xattrs', '-all-root',
+                    '-processors', '4', '-b', '1048576']))
+
+    def test_block_size_in_bytes(self):
+        self.assertThat(
+            squashfs.get_mksquashfs_args(block_size='4096')[-2:],
+            Equals(['-b', '4096']))
+
+    def test_reproducible(self):
+        self.assertThat(
+            squashfs.get_mksquashfs_args(
+                timestamp=0, sort_file='sort', version=(4, 4)),
+            Equals(['-noappend', '-comp', 'xz', '-no-xattrs', '-all-root',
+                    '-reproducible', '-mkfs-time', '0', '-all-time', '0',
+                    '-sort', 'sort']))
+
+    def test_reproducible_with_an_old_mksquashfs_uses_one_processor(self):
+        self.assertThat(
+            squashfs.get_mksquashfs_args(
+                processors=4, timestamp=0, version=(4, 3)),
+            Equals(['-noappend', '-comp', 'xz', '-no-xattrs', '-all-root',
+                    '-processors', '1']))
+
+    def test_unknown_profile(self):
+        raised = self.assertRaises(
+            errors.InvalidPackingProfileError,
+            squashfs.get_mksquashfs_args, profile='lz4')
+
+        self.assertThat(raised.profile, Equals('lz4'))
+
+    def test_invalid_block_sizes(self):
+        for block_size in ('2K', '2M', '100K', 'big'):
+            raised = self.assertRaises(
+                errors.InvalidBlockSizeError,
+                squashfs.get_mksquashfs_args, block_size=block_size)
+            self.assertThat(raised.block_size, Equals(block_size))
+
+
+class GetSourceDateEpochTestCase(tests.TestCase):
+
+    def test_default(self):
+        self.useFixture(fixtures.EnvironmentVariable('SOURCE_DATE_EPOCH'))
+
+        self.assertThat(squashfs.get_source_date_epoch(), Equals(0))
+
+    def test_from_environment(self):
+        self.useFixture(fixtures.EnvironmentVariable(
+            'SOURCE_DATE_EPOCH', '1500000000'))
+
+        self.assertThat(squashfs.get_source_date_epoch(), Equals(1500000000))
+
+    def test_invalid(self):
+        self.useFixture(fixtures.EnvironmentVariable(
+            'SOURCE_DATE_EPOCH', '-1'))
+
+        raised = self.assertRaises(
+            errors.InvalidSourceDateEpochError,
+            squashfs.get_source_date_epoch)
+        self.assertThat(raised.value, Equals('-1'))
+
+
+class PackingOrderTestCase(tests.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.order_file = os.path.join('cache', 'order.json')
+        for path in ('b', 'c', os.path.join('dir', 'a'), 'with space'):
+            self._create(path)
+        os.symlink('b', os.path.join('prime', 'link'))
+
+    def _create(self, path):
+        path = os.path.join('prime', path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        open(path, 'w').close()
+
+    def _pack(self):
+        order = squashfs.PackingOrder(self.order_file)
+        order.write_sort_file('prime', 'sort')
+        order.save()
+
+    def test_files_are_sorted(self):
+        self._pack()
+
+        self.assertThat('sort', FileContains(
+            'b 32767\nc 32767\ndir/a 32767\n'))
+
+    def test_new_files_are_packed_last(self):
+        self._pack()
+        self._create('a')
+        os.remove(os.path.join('prime', 'c'))
+        self._pack()
+
+        self.assertThat('sort', FileContains(
+            'a 32766\nb 32767\ndir/a 32767\n'))
+
+    def test_order_is_not_kept_unless_saved(self):
+        self._pack()
+        self._create('a')
+        squashfs.PackingOrder(self.order_file).write_sort_file(
+            'prime', 'sort')
+        os.remove(os.path.join('prime', 'a'))
+        self._create('d')
+        self._pack()
+
+        self.assertThat('sort', FileContains(
+            'b 32767\nc 32767\nd 32766\ndir/a 32767\n'))
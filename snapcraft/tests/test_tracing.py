@@ -0,0 +1,108 @@
+# -*- Mode:Python; indent-tabs-mode:nil; tab-width:4 -*-
+#
+# Copyright (C) 2017 Canonical Ltd
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+import os
+
+from snapcraft.internal import (
+    common,
+    scheduler,
+    tracing,
+)
+from snapcraft import tests
+
+
+class TracingTestCase(tests.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.trace_file = os.path.join(self.path, 'trace.json')
+        self.addCleanup(tracing.stop)
+
+    def _load_events(self):
+        with open(self.trace_file) as f:
+            trace = json.load(f)
+        return [e for e in trace['traceEvents'] if e['ph'] == 'X']
+
+    def test_disabled_by_default(self):
+        with tracing.span('span'):
+            pass
+
+        self.assertFalse(tracing.is_enabled())
+        self.assertFalse(os.path.exists(self.trace_file))
+
+    def test_spans(self):
+        tracing.start(self.trace_file)
+        with tracing.span('outer', part='part'):
+            with tracing.span('inner'):
+                pass
+        tracing.stop()
+
+        inner, outer = self._load_events()
+        self.assertEqual('outer', outer['name'])
+        self.assertEqual({'part': 'part'}, outer['args'])
+        self.assertEqual('inner', inner['name'])
+        self.assertLessEqual(outer['ts'], inner['ts'])
+        self.assertGreaterEqual(outer['ts'] + outer['dur'],
+                                inner['ts'] + inner['dur'])
+        self.assertFalse(os.path.exists(self.trace_file + '.events'))
+
+    def test_span_recorded_on_error(self):
+        tracing.start(self.trace_file)
+
+        def fail():
+            with tracing.span('failing'):
+                raise RuntimeError()
+
+        self.assertRaises(RuntimeError, fail)
+        tracing.stop()
+
+        self.assertEqual(['failing'],
+                         [e['name'] for e in self._load_events()])
+
+    def test_commands_record_resource_usage(self):
+        tracing.start(self.trace_file)
+        common.run(['true'])
+        tracing.stop()
+
+        event, = self._load_events()
+        self.assertEqual('true', event['name'])
+        self.assertEqual('process', event['cat'])
+        self.assertEqual('true', event['args']['command'])
+        for key in ('user_time', 'system_time', 'bytes_read',
+                    'bytes_written'):
+            self.assertIn(key, event['args'])
+
+    def test_forked_processes_are_traced(self):
+        tracing.start(self.trace_file)
+
+        def job():
+            with tracing.span('child'):
+                pass
+            # What the scheduler runs for jobs in child processes may stop
+            # tracing, that is only for the process that started it.
+            tracing.stop()
+
+        jobs = scheduler.Scheduler({'build': 1})
+        jobs.add('job', job, pool='build')
+        jobs.run()
+        with tracing.span('parent'):
+            pass
+        tracing.stop()
+
+        events = {e['name']: e['pid'] for e in self._load_events()}
+        self.assertEqual(os.getpid(), events['parent'])
+        self.assertNotEqual(os.getpid(), events['child'])